@@ -1,49 +1,205 @@
-from fastapi import Depends, status, HTTPException
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from fastapi import Depends, Request, status, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from calendar import timegm
+from data.revocation_store import create_revocation_store
+from data.schemas import GetUser, Principal
+from data.user_loader import get_user_loader
 
 SECRET_KEY = 'supersecretkey'
 ALGORITHM = 'HS256'
 ACCESS_EXPIRE_MINUTES = 60
+# role, blocked and registration claims are trusted for this long, after that they are read from the database
+CLAIMS_EXPIRE_MINUTES = 5
+# verified tokens are remembered until they expire, so a token is decoded once and not on every request
+TOKEN_CACHE_SIZE = 10_000
+# served without looking at the token
+PUBLIC_PATH_PREFIXES = ('/static/', '/docs', '/redoc', '/openapi.json', '/favicon.ico')
 
 bearer_scheme = HTTPBearer()
 
-token_blacklist = set()
+CREDENTIALS_EXCEPTION = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                      detail="Could not validate credentials",
+                                      headers={"WWW-Authenticate": "Bearer"})
+
+# revoked token ids (jti:<jti>) and users (user:<id>, tokens issued before the revocation are rejected)
+revocations = create_revocation_store()
+
+
+class TokenCache:
+    '''LRU of verified tokens, bounded to max_size tokens. An entry is dropped when its token expires,
+    revocations are checked on every use, so they apply to cached tokens too.'''
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[dict, float | None, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> tuple[dict, float | None] | None:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            claims, issued_at, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return claims, issued_at
+
+    def put(self, token: str, claims: dict, issued_at: float | None, expires_at: float):
+        with self._lock:
+            self._entries[token] = (claims, issued_at, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+verified_tokens = TokenCache()
 
 
 def create_token(data: dict):
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_EXPIRE_MINUTES)
 
-    data.update({"exp": expire})
+    data.setdefault("exp", expire)
+    # the token's id, logout revokes it
+    data.setdefault("jti", uuid.uuid4().hex)
 
     encoded_jwt = jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
 
     return encoded_jwt
 
 
-def verify_access_token(token: HTTPAuthorizationCredentials, credentials_exception):
-    try:
-        payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=ALGORITHM)
-        user_id: str = payload.get("user_id")
+def create_user_token(user: GetUser, refreshed: Principal | None = None):
+    '''Creates a token which carries the user's role, blocked and registration state as signed claims,
+    so admin checks do not need a database round trip. A token refreshing the claims of another one keeps
+    its jti and expiry, so the session does not outlive the login and revoking either token revokes both.'''
+    issued_at = datetime.utcnow()
+    claims_expire_at = issued_at + timedelta(minutes=CLAIMS_EXPIRE_MINUTES)
+    data = {"user_id": user.id,
+            "role": "admin" if user.is_admin else "user",
+            "blocked": user.is_blocked,
+            "registered": user.is_registered,
+            "iat": issued_at,
+            "claims_exp": timegm(claims_expire_at.utctimetuple())}
+    if refreshed is not None:
+        data.update({"jti": refreshed.jti, "exp": refreshed.expires_at})
+
+    return create_token(data=data)
+
+
+def revoke_user_tokens(user_id: int):
+    '''Rejects every token issued to the user until now, e.g. after an admin blocks the user.'''
+    # a revocation older than the token lifetime cannot match a valid token anymore
+    revocations.revoke(f'user:{user_id}', time.time() + ACCESS_EXPIRE_MINUTES * 60)
+
+
+def revoke_token(principal: Principal):
+    '''Rejects this one token, by its jti, until it expires.'''
+    revocations.revoke(f'jti:{principal.jti}', timegm(principal.expires_at.utctimetuple()))
 
-        if user_id is None:
-            raise credentials_exception
-        return user_id
 
+def verify_access_token(token: HTTPAuthorizationCredentials, credentials_exception) -> Principal:
+    '''Checks the token's signature and expiry on its first use, later uses are answered from verified_tokens.'''
+    verified = verified_tokens.get(token.credentials)
+    if verified is None:
+        verified = _decode_token(token.credentials, credentials_exception)
+    claims, issued_at = verified
+
+    if revocations.revoked_at(f'jti:{claims["jti"]}') is not None:
+        raise credentials_exception
+    revoked_at = revocations.revoked_at(f'user:{claims["user_id"]}')
+    if revoked_at is not None and (issued_at is None or issued_at <= revoked_at):
+        raise credentials_exception
+
+    # a new principal per call, callers may change it
+    return Principal(**claims)
+
+
+def _decode_token(token: str, credentials_exception) -> tuple[dict, float | None]:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
     except JWTError:
         raise credentials_exception
 
+    user_id = payload.get("user_id")
+    if user_id is None:
+        raise credentials_exception
+
+    claims_exp = payload.get("claims_exp")
+    # jose checks exp, a token without one is remembered for the lifetime of a new token
+    expires_at = payload.get("exp") or time.time() + ACCESS_EXPIRE_MINUTES * 60
+    claims = {'user_id': int(user_id),
+              # tokens issued before jti was added are revoked by their hash
+              'jti': payload.get("jti") or hashlib.sha256(token.encode()).hexdigest(),
+              'is_admin': payload["role"] == "admin" if "role" in payload else None,
+              'is_blocked': payload.get("blocked"),
+              'is_registered': payload.get("registered"),
+              'claims_expire_at': datetime.utcfromtimestamp(claims_exp) if claims_exp else None,
+              'expires_at': datetime.utcfromtimestamp(expires_at)}
+    issued_at = payload.get("iat")
+    verified_tokens.put(token, claims, issued_at, expires_at)
+    return claims, issued_at
+
+
+def is_public_path(path: str) -> bool:
+    return path.startswith(PUBLIC_PATH_PREFIXES)
+
+
+def request_token(request: Request) -> str | None:
+    '''The bearer token of an API call, or the access_token cookie of the web pages.'''
+    authorization = request.headers.get('authorization')
+    if authorization:
+        scheme, _, credentials = authorization.partition(' ')
+        if scheme.lower() == 'bearer' and credentials:
+            return credentials
+    return request.cookies.get('access_token')
+
+
+def authenticate(token: str | None) -> Principal | None:
+    '''The principal of a token, None when there is no token or it is not valid.'''
+    if not token:
+        return None
+    try:
+        return verify_access_token(HTTPAuthorizationCredentials(scheme='Bearer', credentials=token),
+                                   CREDENTIALS_EXCEPTION)
+    except HTTPException:
+        return None
 
-# verifies if the token is correct
-def get_current_user(token: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                          detail=f"Could not validate credentials",
-                                          headers={"WWW-Authenticate": "Bearer"})
 
-    user_id = verify_access_token(token, credentials_exception)
-    return int(user_id)
+async def authenticate_async(token: str | None) -> Principal | None:
+    '''authenticate for the event loop, with a revocation store which queries the database it runs on the
+    threadpool so a lookup does not stall the other requests.'''
+    if not token or not revocations.blocking:
+        return authenticate(token)
+    return await run_in_threadpool(authenticate, token)
+
+
+# verifies if the token is correct
+def get_current_user(request: Request, token: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    if getattr(request.state, 'auth_token', None) == token.credentials:
+        # the middleware has verified this token for the request already
+        principal = request.state.principal
+        if principal is None:
+            raise CREDENTIALS_EXCEPTION
+    else:
+        principal = verify_access_token(token, CREDENTIALS_EXCEPTION)
+    get_user_loader().remember(principal)
+    return principal.user_id
 
 
 def logout_user(token: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
-    token_blacklist.add(token.credentials)
+    principal = authenticate(token.credentials)
+    if principal:
+        revoke_token(principal)
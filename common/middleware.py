@@ -0,0 +1,67 @@
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from common.authorization import authenticate_async, create_user_token, is_public_path, request_token
+from data.helpers import find_user_by_id_async
+from data.user_loader import user_loader_scope
+
+
+class AuthMiddleware:
+    '''Pure ASGI middleware which resolves the request's user before the routes run.
+    Unlike @app.middleware("http") it calls the app directly, without a task and stream per request,
+    so responses, including streamed ones, pass through untouched.'''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or is_public_path(scope['path']):
+            # static files and the API docs do not need the user
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        # the one verification of the request's token, get_current_user reuses it
+        token = request_token(request)
+        principal = await authenticate_async(token)
+
+        # user lookups made while handling this request share one loader
+        with user_loader_scope() as user_loader:
+            refreshed_token = None
+            if principal and principal.claims_expired and token == request.cookies.get('access_token'):
+                # the role/blocked claims are too old to trust, read the user once and hand out a token with fresh
+                # claims, which expires with the old one
+                user = await find_user_by_id_async(principal.user_id)
+                if user:
+                    refreshed_token = create_user_token(user, refreshed=principal)
+                    principal = await authenticate_async(refreshed_token)
+                else:
+                    principal = None
+
+            if principal:
+                user_loader.remember(principal)
+                user_loader.prime(principal.user_id)
+            request.state.auth_token = token
+            request.state.principal = principal
+            request.state.user_id = principal.user_id if principal else None
+
+            if refreshed_token:
+                send = _cookie_sender(send, refreshed_token)
+            await self.app(scope, receive, send)
+
+
+def _cookie_sender(send: Send, token: str) -> Send:
+    '''Sets the refreshed token cookie on the response, unless the route has set or deleted it itself (login, logout).'''
+    cookie = Response()
+    cookie.set_cookie(key='access_token', value=token, httponly=True)
+
+    async def send_with_cookie(message: Message):
+        if message['type'] == 'http.response.start':
+            headers = MutableHeaders(scope=message)
+            if not any(value.startswith('access_token=') for value in headers.getlist('set-cookie')):
+                headers.append('set-cookie', cookie.headers['set-cookie'])
+        await send(message)
+
+    return send_with_cookie
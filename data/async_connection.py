@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+from postgrest import AsyncPostgrestClient
+
+from data.connection import url, key, query, STORAGE_BACKEND
+
+# connection pool shared by every async query of this worker
+POOL_MAX_CONNECTIONS = 100
+POOL_MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY_SECONDS = 30
+CONNECT_TIMEOUT_SECONDS = 5
+REQUEST_TIMEOUT_SECONDS = 10
+
+_async_query: AsyncPostgrestClient | None = None
+
+
+def create_http_client(max_connections: int = POOL_MAX_CONNECTIONS,
+                       max_keepalive_connections: int = POOL_MAX_KEEPALIVE_CONNECTIONS,
+                       keepalive_expiry: float = KEEPALIVE_EXPIRY_SECONDS,
+                       connect_timeout: float = CONNECT_TIMEOUT_SECONDS,
+                       request_timeout: float = REQUEST_TIMEOUT_SECONDS) -> httpx.AsyncClient:
+    '''Keep-alive HTTP/2 client, concurrent queries are multiplexed over the pooled connections.'''
+    return httpx.AsyncClient(
+        base_url=f'{url}/rest/v1',
+        http2=True,
+        limits=httpx.Limits(max_connections=max_connections,
+                            max_keepalive_connections=max_keepalive_connections,
+                            keepalive_expiry=keepalive_expiry),
+        timeout=httpx.Timeout(request_timeout, connect=connect_timeout),
+        headers={'apikey': key, 'Authorization': f'Bearer {key}'},
+    )
+
+
+class ThreadedAsyncQuery:
+    '''Async view of a SQL storage backend, every execute() runs on a worker thread so the event loop is not blocked.'''
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            return ThreadedAsyncQuery(getattr(self._builder, name)(*args, **kwargs))
+        return call
+
+    async def execute(self):
+        return await asyncio.to_thread(self._builder.execute)
+
+
+def get_async_query() -> AsyncPostgrestClient | ThreadedAsyncQuery:
+    '''Async counterpart of data.connection.query, created on first use and shared by the whole worker.'''
+    global _async_query
+    if STORAGE_BACKEND != 'supabase':
+        # the SQL backends pool their own connections
+        return ThreadedAsyncQuery(query)
+    if _async_query is None:
+        _async_query = AsyncPostgrestClient(f'{url}/rest/v1',
+                                            headers={'apikey': key, 'Authorization': f'Bearer {key}'})
+        # replace the default session, older postgrest versions have no http_client argument
+        _async_query.session = create_http_client()
+    return _async_query
+
+
+async def close_async_query():
+    global _async_query
+    if STORAGE_BACKEND != 'supabase':
+        query.close()
+    if _async_query is not None:
+        await _async_query.aclose()
+        _async_query = None
@@ -0,0 +1,136 @@
+import calendar
+from datetime import datetime, timedelta
+
+# recurring_time values:
+#   minutely, daily, weekly   every minute/day/week from the anchor
+#   monthly                   every month on the anchor's day, clamped to the month's last day (31 -> Feb 28)
+#   monthly:<day>             every month on the given day (1-31, clamped) at the anchor's time
+#   cron:<m> <h> <dom> <mon> <dow>   five cron fields with *, lists, ranges and /steps, dow 0 or 7 is Sunday
+INTERVALS = {'minutely': timedelta(minutes=1), 'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# a cron expression that matches no date within this many days (e.g. Feb 30) is rejected
+CRON_SEARCH_DAYS = 366 * 8
+_RESOLUTION = timedelta(microseconds=1)
+
+
+class IntervalCadence:
+    def __init__(self, step: timedelta):
+        self.step = step
+
+    def at_or_after(self, anchor: datetime, moment: datetime) -> datetime:
+        if moment <= anchor:
+            return anchor
+        # whole steps from the anchor, rounded up
+        return anchor - ((anchor - moment) // self.step) * self.step
+
+
+class MonthlyCadence:
+    def __init__(self, day: int | None = None):
+        self.day = day
+
+    def occurrence(self, anchor: datetime, months: int) -> datetime:
+        year, month = divmod(anchor.month - 1 + months, 12)
+        year += anchor.year
+        day = min(self.day or anchor.day, calendar.monthrange(year, month + 1)[1])
+        return anchor.replace(year=year, month=month + 1, day=day)
+
+    def at_or_after(self, anchor: datetime, moment: datetime) -> datetime:
+        months = max((moment.year - anchor.year) * 12 + moment.month - anchor.month, 0)
+        # the occurrence of moment's month may be earlier in the month than moment
+        while self.occurrence(anchor, months) < moment:
+            months += 1
+        return self.occurrence(anchor, months)
+
+
+class CronCadence:
+    def __init__(self, minutes: set, hours: set, days: set, months: set, weekdays: set, any_day: bool,
+                 any_weekday: bool):
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = any_day
+        self.any_weekday = any_weekday
+
+    def _day_matches(self, moment: datetime) -> bool:
+        if moment.month not in self.months:
+            return False
+        day_matches = moment.day in self.days
+        weekday_matches = (moment.weekday() + 1) % 7 in self.weekdays
+        # like cron, a restricted day of month and day of week match when either of them does
+        if not self.any_day and not self.any_weekday:
+            return day_matches or weekday_matches
+        return day_matches and weekday_matches
+
+    def at_or_after(self, anchor: datetime, moment: datetime) -> datetime:
+        moment = max(moment, anchor)
+        start = moment.replace(second=0, microsecond=0)
+        if start < moment:
+            start += timedelta(minutes=1)
+
+        day = start.replace(hour=0, minute=0)
+        for _ in range(CRON_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError('Cron expression matches no date')
+
+
+def parse_cadence(recurring_time: str):
+    '''Returns the cadence of a recurring_time value, raises ValueError when it is not one.'''
+    if recurring_time in INTERVALS:
+        return IntervalCadence(INTERVALS[recurring_time])
+    if recurring_time == 'monthly':
+        return MonthlyCadence()
+    if recurring_time.startswith('monthly:'):
+        day = int(recurring_time.removeprefix('monthly:'))
+        if not 1 <= day <= 31:
+            raise ValueError(f'Day of month out of range: {day}')
+        return MonthlyCadence(day)
+    if recurring_time.startswith('cron:'):
+        fields = recurring_time.removeprefix('cron:').split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f'Cron expression needs 5 fields: {recurring_time}')
+        minutes, hours, days, months, weekdays = (_cron_field(field, *bounds)
+                                                  for field, bounds in zip(fields, CRON_FIELDS))
+        cadence = CronCadence(minutes, hours, days, months, weekdays, any_day=fields[2] == '*',
+                              any_weekday=fields[4] == '*')
+        # rejects expressions like 0 0 30 2 * which never run
+        cadence.at_or_after(datetime(2000, 1, 1), datetime(2000, 1, 1))
+        return cadence
+    raise ValueError(f'Unknown recurring time: {recurring_time}')
+
+
+def _cron_field(field: str, low: int, high: int) -> set:
+    values = set()
+    for part in field.split(','):
+        part, _, step = part.partition('/')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = end = int(part)
+            if step:
+                end = high
+        step = int(step) if step else 1
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f'Cron field out of range: {field}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def first_run(cadence, anchor: datetime) -> datetime:
+    '''The first occurrence of a schedule starting at anchor, the anchor itself for interval cadences.'''
+    return cadence.at_or_after(anchor, anchor)
+
+
+def next_run(cadence, anchor: datetime, after: datetime) -> datetime:
+    '''The first occurrence strictly after the given one. Occurrences are counted from the anchor,
+    so paying late or early never moves the following runs.'''
+    return cadence.at_or_after(anchor, after + _RESOLUTION)
@@ -0,0 +1,140 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+from data.contact_search import ContactSearchIndex
+
+CONTACT_CACHE_SIZE = 10_000
+# contacts held by all cached lists together, cold users are evicted beyond it
+CONTACT_CACHE_MAX_CONTACTS = 1_000_000
+CONTACT_CACHE_TTL_SECONDS = 60
+
+
+class ContactList:
+    '''A user's resolved contacts, each one a dict of the contact's id, username, email and phone number.
+    The sorted orders and the search index are built on first use and kept with the list.'''
+    __slots__ = ('contacts', 'ids', '_orders', '_index', '_lock')
+
+    def __init__(self, contacts: list[dict]):
+        self.contacts = contacts
+        self.ids = {contact['id'] for contact in contacts}
+        self._orders: dict[str, tuple[list, list[dict]]] = {}
+        self._index: ContactSearchIndex | None = None
+        self._lock = threading.Lock()
+
+    def add(self, contact: dict):
+        with self._lock:
+            if contact['id'] in self.ids:
+                return
+            self.contacts.append(contact)
+            self.ids.add(contact['id'])
+            self._orders = {}
+            if self._index is not None:
+                self._index.add(contact)
+
+    def search_index(self) -> ContactSearchIndex:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = ContactSearchIndex(self.contacts)
+        return self._index
+
+    def ordered(self, sort_by: str) -> tuple[list, list[dict]]:
+        '''The contacts in ascending (sort_by, id) order and their sort keys, for bisecting a cursor.'''
+        order = self._orders.get(sort_by)
+        if order is None:
+            rows = sorted(self.contacts, key=lambda contact: (contact[sort_by], contact['id']))
+            order = ([(row[sort_by], row['id']) for row in rows], rows)
+            self._orders[sort_by] = order
+        return order
+
+    def page(self, sort_by: str, descending: bool, after: tuple | None, limit: int) -> tuple[list[dict], bool]:
+        '''Up to limit contacts after the (sort_by value, id) key, and whether more follow.'''
+        keys, rows = self.ordered(sort_by)
+        if descending:
+            end = bisect.bisect_left(keys, after) if after else len(keys)
+            start = max(end - limit, 0)
+            return rows[start:end][::-1], start > 0
+        start = bisect.bisect_right(keys, after) if after else 0
+        return rows[start:start + limit], start + limit < len(rows)
+
+
+class ContactCache:
+    '''Process-local LRU of each user's resolved contacts with a time to live, bounded to max_size users
+    and max_contacts contacts in all lists. Adding a contact must call add_contact or invalidate;
+    the TTL bounds how stale a contact's username, email or phone number changed by another worker can get.'''
+
+    def __init__(self, max_size: int = CONTACT_CACHE_SIZE, ttl: float = CONTACT_CACHE_TTL_SECONDS,
+                 max_contacts: int = CONTACT_CACHE_MAX_CONTACTS, clock=time.monotonic):
+        self.max_size = max_size
+        self.max_contacts = max_contacts
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._lists: OrderedDict[int, tuple[float, ContactList]] = OrderedDict()
+        self._contacts = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int) -> ContactList | None:
+        with self._lock:
+            entry = self._lists.get(user_id)
+            if entry is None or entry[0] <= self._clock():
+                self._remove(user_id)
+                self.misses += 1
+                return None
+            self._lists.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: int, contacts: ContactList):
+        with self._lock:
+            self._remove(user_id)
+            self._lists[user_id] = (self._clock() + self.ttl, contacts)
+            self._contacts += len(contacts.contacts)
+            self._evict()
+
+    def needs_contact(self, user_id: int, contact_id: int) -> bool:
+        '''True when the user's contacts are cached and do not include contact_id.'''
+        entry = self._lists.get(user_id)
+        return entry is not None and contact_id not in entry[1].ids
+
+    def add_contact(self, user_id: int, contact: dict):
+        '''Adds a new contact to the user's cached list and its search index, if the list is cached.'''
+        with self._lock:
+            entry = self._lists.get(user_id)
+            if entry is None or contact['id'] in entry[1].ids:
+                return
+            entry[1].add(contact)
+            self._contacts += 1
+            self._evict()
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._remove(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._lists.clear()
+            self._contacts = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._lists), 'contacts': self._contacts, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+    def _remove(self, user_id: int):
+        entry = self._lists.pop(user_id, None)
+        if entry is not None:
+            self._contacts -= len(entry[1].contacts)
+
+    def _evict(self):
+        # the least recently used lists go first, the newest one stays even when it alone is over the limit
+        while len(self._lists) > 1 and (len(self._lists) > self.max_size or self._contacts > self.max_contacts):
+            self._remove(next(iter(self._lists)))
+            self.evictions += 1
+
+
+contact_cache = ContactCache()
@@ -0,0 +1,155 @@
+import bisect
+from collections import defaultdict
+
+SEARCH_FIELDS = ('username', 'email', 'phone_number')
+# typos forgiven in a query of up to this many characters, longer queries are forgiven two
+ONE_TYPO_MAX_LENGTH = 6
+# queries shorter than this are matched by prefix and substring only
+MIN_FUZZY_LENGTH = 3
+# typos are looked for in the first characters of a value, like a prefix typed with a mistake
+FUZZY_PREFIX_LENGTH = 16
+
+
+class ContactSearchIndex:
+    '''In-memory search over one user's contacts for type-ahead: exact, prefix, substring and typo-tolerant
+    matches on username, email and phone number, case-insensitive.
+    Prefixes are bisected in a sorted list of the field values. Substrings are narrowed down with an index of
+    character bigrams, typos with an index of bigrams by their position in the value, before the values are
+    compared.'''
+
+    def __init__(self, contacts: list[dict] = ()):
+        self._contacts: list[dict] = []
+        # (field, lowercased value) -> contact positions
+        self._exact: dict[tuple[str, str], list[int]] = defaultdict(list)
+        # sorted (lowercased value, position) of every field
+        self._values: list[tuple[str, int]] = []
+        # bigram -> positions of the contacts with a field that contains it
+        self._bigrams: dict[str, set[int]] = defaultdict(set)
+        # (position, lowercased value) of every field
+        self._entries: list[tuple[int, str]] = []
+        # (bigram, index in the value) -> entries, for the first FUZZY_PREFIX_LENGTH characters
+        self._placed_bigrams: dict[tuple[str, int], list[int]] = defaultdict(list)
+        for contact in contacts:
+            self.add(contact)
+
+    def add(self, contact: dict):
+        position = len(self._contacts)
+        self._contacts.append(contact)
+        for field in SEARCH_FIELDS:
+            value = str(contact.get(field) or '').lower()
+            if not value:
+                continue
+            self._exact[(field, value)].append(position)
+            bisect.insort(self._values, (value, position))
+            entry = len(self._entries)
+            self._entries.append((position, value))
+            for index, bigram in enumerate(_bigrams(value)):
+                self._bigrams[bigram].add(position)
+                if index < FUZZY_PREFIX_LENGTH:
+                    self._placed_bigrams[(bigram, index)].append(entry)
+
+    def exact(self, field: str, value: str) -> list[dict]:
+        return [self._contacts[position] for position in self._exact.get((field, str(value).lower()), ())]
+
+    def search(self, text: str, limit: int = 10) -> list[dict]:
+        '''Contacts matching text: prefix matches first, then substring matches, then matches with typos.'''
+        text = text.strip().lower()
+        if not text:
+            return []
+        found: dict[int, None] = {}
+
+        # prefix: the values from text up to the last string starting with text
+        start = bisect.bisect_left(self._values, (text, -1))
+        for value, position in self._values[start:]:
+            if not value.startswith(text) or len(found) >= limit:
+                break
+            found.setdefault(position)
+
+        if len(found) < limit:
+            for position in self._candidates(text, len(text) - 1):
+                if any(text in value for value in self._field_values(position)):
+                    found.setdefault(position)
+                    if len(found) >= limit:
+                        break
+
+        if len(found) < limit and len(text) >= MIN_FUZZY_LENGTH:
+            typos = 1 if len(text) <= ONE_TYPO_MAX_LENGTH else 2
+            matches: dict[int, int] = {}
+            for entry in self._fuzzy_candidates(text, typos):
+                position, value = self._entries[entry]
+                # the first character has to be typed right, like the prefix_length of fuzzy queries in search
+                # engines, it rules out most candidates before their edit distance is computed
+                if position in found or value[0] != text[0]:
+                    continue
+                distance = _prefix_distance(text, value, typos)
+                if distance <= typos and distance < matches.get(position, typos + 1):
+                    matches[position] = distance
+            for position in sorted(matches, key=lambda position: (matches[position], position))[:limit - len(found)]:
+                found.setdefault(position)
+
+        return [self._contacts[position] for position in found]
+
+    def _field_values(self, position: int) -> list[str]:
+        contact = self._contacts[position]
+        return [str(contact.get(field) or '').lower() for field in SEARCH_FIELDS]
+
+    def _candidates(self, text: str, min_shared: int) -> list[int]:
+        '''Positions of contacts with at least min_shared of the bigrams of text, all contacts for one letter.'''
+        bigrams = set(_bigrams(text))
+        if not bigrams:
+            return list(range(len(self._contacts)))
+        if min_shared >= len(bigrams):
+            postings = sorted((self._bigrams.get(bigram, set()) for bigram in bigrams), key=len)
+            return sorted(set.intersection(*postings))
+        shared: dict[int, int] = defaultdict(int)
+        for bigram in bigrams:
+            for position in self._bigrams.get(bigram, ()):
+                shared[position] += 1
+        return sorted(position for position, count in shared.items() if count >= min_shared)
+
+    def _fuzzy_candidates(self, text: str, typos: int) -> list[int]:
+        '''Entries with a value that starts with most of the bigrams of text at about the same place.
+        A typo changes at most two bigrams and moves the ones after it by one character.'''
+        text = text[:FUZZY_PREFIX_LENGTH]
+        shared: dict[int, int] = defaultdict(int)
+        for index, bigram in enumerate(_bigrams(text)):
+            near = set()
+            for shift in range(-typos, typos + 1):
+                near.update(self._placed_bigrams.get((bigram, index + shift), ()))
+            for entry in near:
+                shared[entry] += 1
+        min_shared = max(len(text) - 1 - 2 * typos, 1)
+        return [entry for entry, count in shared.items() if count >= min_shared]
+
+    def __len__(self):
+        return len(self._contacts)
+
+
+def _bigrams(value: str) -> list[str]:
+    return [value[index:index + 2] for index in range(len(value) - 1)]
+
+
+def _prefix_distance(text: str, value: str, limit: int) -> int:
+    '''Edit distance between text and the closest prefix of value, limit + 1 when it is more than limit.
+    Only the cells within limit of the diagonal can stay within limit, the others are not computed.'''
+    # prefixes longer than text plus the allowed edits cannot be closer
+    value = value[:len(text) + limit]
+    over = limit + 1
+    previous = [column if column <= limit else over for column in range(len(value) + 1)]
+    for row, char in enumerate(text, 1):
+        current = [row if row <= limit else over] + [over] * len(value)
+        row_min = current[0]
+        for column in range(max(row - limit, 1), min(row + limit, len(value)) + 1):
+            # plain comparisons, min() is slow in this loop
+            cost = previous[column - 1] + (char != value[column - 1])
+            if previous[column] + 1 < cost:
+                cost = previous[column] + 1
+            if current[column - 1] + 1 < cost:
+                cost = current[column - 1] + 1
+            current[column] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return over
+        previous = current
+    return min(min(previous), over)
@@ -0,0 +1,166 @@
+import logging
+import threading
+from collections import OrderedDict
+from itertools import islice, takewhile
+
+from data.connection import query
+from data.contact_cache import ContactCache, contact_cache
+from data.user_loader import UserLoader
+
+# the unique constraint of script/contacts_unique.sql
+CONTACT_PAIR_COLUMNS = 'current_user,contact_name_id'
+# queued contacts are written this many seconds after the transfer at most, or once a batch is full
+CONTACT_WRITE_INTERVAL_SECONDS = 0.5
+CONTACT_WRITE_BATCH_SIZE = 500
+# pairs written recently, transfers to them are not queued again
+CONTACT_WRITE_MEMO_SIZE = 100_000
+# pairs waiting to be written, new pairs are dropped while the queue is full (e.g. the database is down)
+CONTACT_WRITE_QUEUE_SIZE = 100_000
+# a pair is dropped after failing this many times, the first failure may be another pair's in the same batch
+CONTACT_WRITE_MAX_ATTEMPTS = 5
+
+
+class ContactWriter:
+    '''Write-behind queue of the contacts that transfers add, so a transfer only waits for the money movement.
+    A background thread writes the queued (user, contact) pairs every interval seconds, or as soon as batch_size
+    are queued, with one upsert per batch_size pairs that skips the pairs the table already has. A pair queued
+    again before it is written, or written recently, is written once. Written contacts are added to the user's
+    cached contact list. The pairs of a failed batch go to the back of the queue and are retried one by one,
+    so a bad pair does not hold up the others; a pair is dropped after max_attempts failures, and new pairs
+    are dropped while max_pending pairs are queued. With interval=None the caller flushes.'''
+
+    def __init__(self, client=query, cache: ContactCache = contact_cache,
+                 interval: float | None = CONTACT_WRITE_INTERVAL_SECONDS, batch_size: int = CONTACT_WRITE_BATCH_SIZE,
+                 memo_size: int = CONTACT_WRITE_MEMO_SIZE, max_pending: int = CONTACT_WRITE_QUEUE_SIZE,
+                 max_attempts: int = CONTACT_WRITE_MAX_ATTEMPTS):
+        self.client = client
+        self.cache = cache
+        self.interval = interval
+        self.batch_size = batch_size
+        self.memo_size = memo_size
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # queued pairs in the order they came, a pair stays queued until it is written or dropped
+        self._pending: dict[tuple[int, int], None] = {}
+        # failures of the queued pairs which failed before
+        self._attempts: dict[tuple[int, int], int] = {}
+        self._written: OrderedDict[tuple[int, int], None] = OrderedDict()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        # logs once when the queue fills up, again after a write succeeded
+        self._dropping = False
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def add(self, user_id: int, contact_id: int):
+        pair = (user_id, contact_id)
+        with self._lock:
+            if pair in self._pending or pair in self._written:
+                self.coalesced += 1
+                return
+            if len(self._pending) >= self.max_pending:
+                if not self._dropping:
+                    logging.warning('Contact write queue is full, dropping new contacts')
+                    self._dropping = True
+                self.dropped += 1
+                return
+            self._pending[pair] = None
+            full = len(self._pending) >= self.batch_size
+        self._start()
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        '''Writes every queued pair, returns the number of pairs written. Stops at the first failed write
+        and raises its error, the pairs which are not written stay queued for the next flush.'''
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = list(islice(self._pending, self.batch_size))
+                    if batch and batch[0] in self._attempts:
+                        # failed before, written on its own to tell a bad pair from a failed database call
+                        batch = batch[:1]
+                    else:
+                        batch = list(takewhile(lambda pair: pair not in self._attempts, batch))
+                if not batch:
+                    return written
+                try:
+                    self.client.table('contacts').upsert(
+                        [{'current_user': user_id, 'contact_name_id': contact_id} for user_id, contact_id in batch],
+                        on_conflict=CONTACT_PAIR_COLUMNS, ignore_duplicates=True).execute()
+                except Exception:
+                    self._retry_later(batch)
+                    raise
+                with self._lock:
+                    for pair in batch:
+                        del self._pending[pair]
+                        self._attempts.pop(pair, None)
+                        self._written[pair] = None
+                    while len(self._written) > self.memo_size:
+                        self._written.popitem(last=False)
+                    self.written += len(batch)
+                    self._dropping = False
+                written += len(batch)
+                self._add_to_cache(batch)
+
+    def _retry_later(self, pairs: list[tuple[int, int]]):
+        # to the back of the queue, so the pairs queued after them are written first
+        with self._lock:
+            for pair in pairs:
+                del self._pending[pair]
+                attempts = self._attempts.pop(pair, 0) + 1
+                if attempts >= self.max_attempts:
+                    logging.error(f'Dropping contact {pair[1]} of user {pair[0]} after {attempts} failed writes')
+                    continue
+                self._attempts[pair] = attempts
+                self._pending[pair] = None
+
+    def _add_to_cache(self, pairs: list[tuple[int, int]]):
+        missing = [(user_id, contact_id) for user_id, contact_id in pairs
+                   if self.cache.needs_contact(user_id, contact_id)]
+        if not missing:
+            return
+        users = {user.id: user for user in UserLoader().load_many(list({contact_id for _, contact_id in missing}))
+                 if user}
+        for user_id, contact_id in missing:
+            user = users.get(contact_id)
+            if user:
+                self.cache.add_contact(user_id, {'id': user.id, 'username': user.username, 'email': user.email,
+                                                 'phone_number': user.phone_number})
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _start(self):
+        if self._thread is not None or self.interval is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='contact-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.exception('Writing contacts failed')
+
+    def stop(self):
+        '''Stops the writer thread and writes the contacts still queued.'''
+        self._stopping.set()
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception:
+            logging.exception('Writing contacts failed')
+
+
+contact_writer = ContactWriter()
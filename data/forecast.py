@@ -0,0 +1,139 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from data.cadence import IntervalCadence, MonthlyCadence, CronCadence, next_run
+
+DAY = timedelta(days=1)
+# runs of a cron schedule that are overdue when the forecast starts are counted up to this many
+MAX_OVERDUE_RUNS = 1000
+
+
+class Schedule:
+    '''A recurring transaction as the forecast sees it: amount is negative for outgoing payments,
+    anchor and next_run are local times without a timezone.'''
+    __slots__ = ('amount', 'cadence', 'anchor', 'next_run')
+
+    def __init__(self, amount: float, cadence, anchor: datetime, next_run: datetime):
+        self.amount = amount
+        self.cadence = cadence
+        self.anchor = anchor
+        self.next_run = next_run
+
+
+def daily_flows(schedules: list[Schedule], start: date, days: int) -> np.ndarray:
+    '''Net amount the schedules move on each of the days from start. Runs that are overdue on start
+    are counted on start, like the sweep catches them up.'''
+    flows = np.zeros(days)
+    intervals = [schedule for schedule in schedules if isinstance(schedule.cadence, IntervalCadence)]
+    _add_interval_flows(flows, [schedule for schedule in intervals if schedule.cadence.step >= DAY], start)
+    _add_sub_daily_flows(flows, [schedule for schedule in intervals if schedule.cadence.step < DAY], start)
+    _add_monthly_flows(flows, [schedule for schedule in schedules if isinstance(schedule.cadence, MonthlyCadence)],
+                       start)
+    crons = [schedule for schedule in schedules if isinstance(schedule.cadence, CronCadence)]
+    if crons:
+        calendar = _calendar(start, days)
+        for schedule in crons:
+            _add_cron_flows(flows, schedule, start, calendar)
+    return flows
+
+
+def _add_interval_flows(flows: np.ndarray, schedules: list[Schedule], start: date):
+    if not schedules:
+        return
+    days = len(flows)
+    amounts = np.array([schedule.amount for schedule in schedules])
+    steps = np.array([schedule.cadence.step.days for schedule in schedules])
+    first_days = np.array([(schedule.next_run.date() - start).days for schedule in schedules])
+
+    # runs on or before start all land on start
+    overdue = np.where(first_days <= 0, -first_days // steps + 1, 0)
+    flows[0] += (overdue * amounts).sum()
+    first_days = first_days + overdue * steps
+
+    # one row per schedule, one column per run, runs past the horizon are masked out
+    runs = np.arange(max((days - first_days.min()) // steps.min() + 1, 0))
+    day_of_run = first_days[:, None] + steps[:, None] * runs[None, :]
+    in_horizon = day_of_run < days
+    weights = np.broadcast_to(amounts[:, None], day_of_run.shape)[in_horizon]
+    flows += np.bincount(day_of_run[in_horizon], weights=weights, minlength=days)
+
+
+def _add_sub_daily_flows(flows: np.ndarray, schedules: list[Schedule], start: date):
+    tomorrow = datetime.combine(start + DAY, datetime.min.time())
+    for schedule in schedules:
+        step = schedule.cadence.step
+        first_day = (schedule.next_run.date() - start).days
+        if first_day >= len(flows):
+            continue
+        # runs until the end of the first day, overdue ones included, then the same number every day
+        day_end = max(tomorrow, datetime.combine(schedule.next_run.date() + DAY, datetime.min.time()))
+        first_runs = -((schedule.next_run - day_end) // step)
+        flows[max(first_day, 0)] += first_runs * schedule.amount
+        flows[max(first_day, 0) + 1:] += (DAY // step) * schedule.amount
+
+
+def _add_monthly_flows(flows: np.ndarray, schedules: list[Schedule], start: date):
+    if not schedules:
+        return
+    days = len(flows)
+    amounts = np.array([schedule.amount for schedule in schedules])
+    day_of_month = np.array([schedule.cadence.day or schedule.anchor.day for schedule in schedules])
+    first_months = np.array([np.datetime64(schedule.next_run.date(), 'M') for schedule in schedules])
+
+    # months are datetime64[M], the day is clamped to the length of each month
+    overdue_months = max(int((np.datetime64(start, 'M') - first_months.min()).astype(int)), 0)
+    months = first_months[:, None] + np.arange(overdue_months + days // 28 + 2)[None, :]
+    month_starts = months.astype('datetime64[D]')
+    month_lengths = ((months + 1).astype('datetime64[D]') - month_starts).astype(int)
+    run_dates = month_starts + np.minimum(day_of_month[:, None], month_lengths) - 1
+    day_of_run = np.maximum((run_dates - np.datetime64(start, 'D')).astype(int), 0)
+    in_horizon = day_of_run < days
+    weights = np.broadcast_to(amounts[:, None], day_of_run.shape)[in_horizon]
+    flows += np.bincount(day_of_run[in_horizon], weights=weights, minlength=days)
+
+
+def _calendar(start: date, days: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Month (1-12), day of month and cron weekday of each day from start.'''
+    dates = np.datetime64(start, 'D') + np.arange(days)
+    months = dates.astype('datetime64[M]')
+    # 1970-01-01 was a Thursday, cron counts weekdays from Sunday = 0
+    return months.astype(int) % 12 + 1, (dates - months.astype('datetime64[D]')).astype(int) + 1, \
+        (dates.astype(int) + 4) % 7
+
+
+def _lookup(values: set, size: int) -> np.ndarray:
+    table = np.zeros(size, dtype=bool)
+    table[list(values)] = True
+    return table
+
+
+def _add_cron_flows(flows: np.ndarray, schedule: Schedule, start: date, calendar: tuple):
+    cadence = schedule.cadence
+    month_numbers, day_numbers, weekdays = calendar
+
+    # overdue runs land on start
+    moment, overdue = schedule.next_run, 0
+    start_of_day = datetime.combine(start, datetime.min.time())
+    while moment < start_of_day and overdue < MAX_OVERDUE_RUNS:
+        overdue += 1
+        moment = next_run(cadence, schedule.anchor, moment)
+    flows[0] += overdue * schedule.amount
+
+    day_matches = _lookup(cadence.days, 32)[day_numbers]
+    weekday_matches = _lookup(cadence.weekdays, 7)[weekdays]
+    if not cadence.any_day and not cadence.any_weekday:
+        matches = day_matches | weekday_matches
+    else:
+        matches = day_matches & weekday_matches
+    matches &= _lookup(cadence.months, 13)[month_numbers]
+
+    runs_per_day = len(cadence.hours) * len(cadence.minutes)
+    counts = np.where(matches, runs_per_day, 0)
+    # no runs before the first pending one, and on its day only the ones from it on
+    first_day = (moment.date() - start).days
+    counts[:max(first_day, 0)] = 0
+    if 0 <= first_day < len(counts) and counts[first_day]:
+        counts[first_day] = sum(1 for hour in cadence.hours for minute in cadence.minutes
+                                if (hour, minute) >= (moment.hour, moment.minute))
+    flows += counts * schedule.amount
@@ -1,7 +1,13 @@
 from data.connection import query
 from data.schemas import GetUser, AccountBalanceOut, TransactionOut
+from data.user_loader import get_user_loader
 from fastapi import HTTPException, status
 from re import search
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+import hashlib
+import json
+import math
 
 PHONE_NUMBER_ERROR = HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                    detail='User with this phone number not found!')
@@ -11,114 +17,50 @@ USERNAME_ERROR = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Us
 ADMIN_ERROR = HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Admin cannot do this!')
 TRANSACTION_ERROR = HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                   detail='Transaction with this id is not found!')
+CURSOR_ERROR = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor!')
+# also for the cards of other users, it does not tell whether their card exists
+CARD_NOT_FOUND_ERROR = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Card not found')
+RECURRING_TIME_ERROR = HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                     detail='Recurring time must be minutely, daily, weekly, monthly, '
+                                            'monthly:<day> or cron:<5 cron fields>!')
+PASSWORD_HASHING_BUSY_ERROR = HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                            detail='Too many logins right now, try again in a moment!',
+                                            headers={'Retry-After': '1'})
 
 
 def find_user_by_phone_number(phone_number: str) -> GetUser | None:
     """This function retrieves a user record from the database by the specified phone number.
-        It queries the 'users' table for a matching phone number and
+        It looks the user up through the request's user loader and
         returns a User object populated with the user's details if found.
         If no user is found with the given phone number, the function returns None."""
 
-    user_data = query.table('users').select('*').eq('phone_number', phone_number).execute()
-
     if len(phone_number) != 10:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Phone number must be EXACTLY 10 symbols!')
 
-    if not user_data.data:
-        return
-
-    user = user_data.data[0]
-
-    return GetUser(
-        id=user['id'],
-        username=user['username'],
-        password=user['password'],
-        email=user['email'],
-        phone_number=user['phone_number'],
-        is_admin=user['is_admin'],
-        created_at=user['created_at'],
-        amount=user['amount'],
-        is_registered=user['is_registered'],
-        is_blocked=user['is_blocked']
-    )
+    return get_user_loader().load(phone_number, key='phone_number')
 
 
 def find_user_by_username(username: str):
-    user_data = query.table('users').select('*').eq('username', username).execute()
+    user = get_user_loader().load(username, key='username')
 
-    if not user_data.data:
+    if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f'User with username: {username} is not found!')
 
-    user = user_data.data[0]
-
-    return GetUser(
-        id=user['id'],
-        username=user['username'],
-        password=user['password'],
-        email=user['email'],
-        phone_number=user['phone_number'],
-        is_admin=user['is_admin'],
-        created_at=user['created_at'],
-        amount=user['amount'],
-        is_registered=user['is_registered'],
-        is_blocked=user['is_blocked']
-    )
+    return user
 
 
 def find_user_by_email(email) -> GetUser | None:
     """This function retrieves a user record from the database by the specified email address.
-    It queries the 'users' table for a matching email and returns a User object populated with
+    It looks the user up through the request's user loader and returns a User object populated with
     the user's details if found.
     If no user is found with the given email, the function returns None."""
 
-    # return ORM object
-    email_data = query.table('users').select('*').eq('email', email).execute()
-
-    # convert data ORM object to list with dictionary in it
-    email_data_lst = email_data.data
-
-    if not email_data_lst:
-        return
-
-        # check if data_lst is empty, if it's empty, that's because user with this email is not found and return none
-
-        # access dictionary from the list
-    email_dict = email_data_lst[0]
-
-    return GetUser(
-        id=email_dict['id'],
-        username=email_dict['username'],
-        password=email_dict['password'],
-        email=email_dict['email'],
-        phone_number=email_dict['phone_number'],
-        is_admin=email_dict['is_admin'],
-        created_at=email_dict['created_at'],
-        amount=email_dict['amount'],
-        is_registered=email_dict['is_registered'],
-        is_blocked=email_dict['is_blocked']
-    )
+    return get_user_loader().load(email, key='email')
 
 
 def find_user_by_id(user_id: int) -> GetUser | None:
-    user_data = query.table('users').select('*').eq('id', user_id).execute()
-
-    if not user_data.data:
-        return
-    user = user_data.data[0]
-
-    return GetUser(
-        id=user['id'],
-        username=user['username'],
-        password=user['password'],
-        email=user['email'],
-        phone_number=user['phone_number'],
-        is_admin=user['is_admin'],
-        created_at=user['created_at'],
-        amount=user['amount'],
-        is_registered=user['is_registered'],
-        is_blocked=user['is_blocked']
-    )
+    return get_user_loader().load(user_id)
 
 
 def get_account_balance(user_id: int) -> AccountBalanceOut | None:
@@ -131,17 +73,106 @@ def get_account_balance(user_id: int) -> AccountBalanceOut | None:
 
 
 def is_admin(user_id: int):
+    # answered from the signed token claims of the logged user while they are fresh
+    principal = get_user_loader().get_principal(user_id)
+    if principal and not principal.claims_expired:
+        return principal.is_admin
+
     user = find_user_by_id(user_id)
     if user and user.is_admin:
         return True
     return False
 
 
+async def find_user_by_id_async(user_id: int) -> GetUser | None:
+    return await get_user_loader().load_async(user_id)
+
+
+async def find_user_by_email_async(email) -> GetUser | None:
+    return await get_user_loader().load_async(email, key='email')
+
+
+async def get_account_balance_async(user_id: int) -> AccountBalanceOut | None:
+    """Async version of get_account_balance for async routes, it does not block the event loop."""
+    user = await find_user_by_id_async(user_id)
+    if not user:
+        return
+    return AccountBalanceOut(balance=user.amount)
+
+
+async def is_admin_async(user_id: int):
+    principal = get_user_loader().get_principal(user_id)
+    if principal and not principal.claims_expired:
+        return principal.is_admin
+
+    user = await find_user_by_id_async(user_id)
+    return bool(user and user.is_admin)
+
+
 def pagination_offset(page: int, page_size: int):
     offset = (page - 1) * page_size
     return offset
 
 
+def encode_cursor(row: dict, sort_by: str) -> str:
+    '''Opaque cursor pointing after the row, for keyset pagination on (sort_by, id).'''
+    return urlsafe_b64encode(json.dumps([row[sort_by], row['id']]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        value, row_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        return value, int(row_id)
+    except (ValueError, TypeError):
+        raise CURSOR_ERROR
+
+
+def make_etag(payload) -> str:
+    '''Weak ETag of a JSON response body, the same for equal contents.'''
+    digest = hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    '''Whether an If-None-Match header matches the ETag, by weak comparison.'''
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
+
+def _filter_value(value) -> str:
+    # double quotes keep the ".", ":" and "+" of timestamps from being read as PostgREST syntax,
+    # backslashes and double quotes inside them are escaped with a backslash
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _keyset_value(value, sort_by: str):
+    '''The cursor's sort value if it has the type of the sort column, so a cursor of another column or a made up
+    one is rejected with CURSOR_ERROR instead of failing in the database.'''
+    if sort_by == 'created_at' and isinstance(value, str):
+        try:
+            datetime.fromisoformat(value)
+            return value
+        except ValueError:
+            pass
+    elif sort_by == 'amount' and isinstance(value, (int, float)) and not isinstance(value, bool) \
+            and math.isfinite(value):
+        return value
+    elif sort_by == 'id' and isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise CURSOR_ERROR
+
+
+def keyset_filter(cursor: str, sort_by: str, descending: bool) -> str:
+    '''PostgREST filter for the rows after the cursor in (sort_by, id) order, sort_by is created_at, amount or id.'''
+    value, row_id = decode_cursor(cursor)
+    value = _keyset_value(value, sort_by)
+    operator = 'lt' if descending else 'gt'
+    return (f'or({sort_by}.{operator}.{_filter_value(value)},'
+            f'and({sort_by}.eq.{_filter_value(value)},id.{operator}.{row_id}))')
+
+
 def get_transaction(transaction_id: int) -> TransactionOut | None:
     transaction_data = query.table('transactions').select('*').eq('id', transaction_id).execute().data
 
@@ -0,0 +1,148 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from decouple import config
+
+from data.connection import query
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# file: an OS file lock, for the workers of one host and for local runs
+# database: a lease row renewed through script/leader_lease.sql, for workers on several hosts
+LEADER_ELECTION = config('LEADER_ELECTION', default='file')
+LEADER_LOCK_DIRECTORY = config('LEADER_LOCK_DIRECTORY', default='.')
+LEASE_TTL_SECONDS = 30
+# renewing three times per lease keeps the lease when one renewal fails
+LEASE_RENEW_SECONDS = 10
+
+
+class FileLease:
+    '''Leadership is an exclusive lock on a file, the OS releases it when the process dies,
+    so another worker takes over on its next attempt.'''
+
+    def __init__(self, name: str, directory: str = LEADER_LOCK_DIRECTORY):
+        self.path = os.path.join(directory, f'{name}.lock')
+        self._file = None
+
+    def acquire(self) -> bool:
+        if self._file is not None:
+            # the lock is held until it is released, there is nothing to renew
+            return True
+        lock_file = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+
+class DatabaseLease:
+    '''Leadership is a row in leader_leases which expires after ttl_seconds unless the holder renews it.
+    Expiry is decided by the database clock, so the hosts' clocks do not matter.'''
+
+    def __init__(self, name: str, holder: str, ttl_seconds: int = LEASE_TTL_SECONDS):
+        self.name = name
+        self.holder = holder
+        self.ttl_seconds = ttl_seconds
+
+    def acquire(self) -> bool:
+        # also renews the lease when this holder has it
+        return bool(query.rpc('acquire_lease', {'p_name': self.name, 'p_holder': self.holder,
+                                                'p_ttl_seconds': self.ttl_seconds}).execute().data)
+
+    def release(self):
+        query.rpc('release_lease', {'p_name': self.name, 'p_holder': self.holder}).execute()
+
+
+def create_lease(name: str, holder: str, election: str = LEADER_ELECTION):
+    if election == 'file':
+        return FileLease(name)
+    if election == 'database':
+        return DatabaseLease(name, holder)
+    raise ValueError(f'Unknown leader election: {election}, expected file or database')
+
+
+class LeaderElector:
+    '''Keeps trying to get the lease and renews it while this process leads.
+    on_elected runs when the process becomes the leader, on_demoted when it loses the lease,
+    including when it could not renew it for a whole lease, so two leaders never overlap for long.'''
+
+    def __init__(self, name: str, on_elected, on_demoted, lease=None, renew_seconds: float = LEASE_RENEW_SECONDS,
+                 ttl_seconds: float = LEASE_TTL_SECONDS):
+        self.name = name
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lease = lease or create_lease(name, self.holder)
+        self.renew_seconds = renew_seconds
+        self.ttl_seconds = ttl_seconds
+        self.is_leader = False
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._valid_until = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}-elector', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        if self.is_leader:
+            self._demote()
+        self.lease.release()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.campaign()
+            self._stopped.wait(self.renew_seconds)
+
+    def campaign(self):
+        '''One acquire or renew attempt.'''
+        attempted_at = time.monotonic()
+        try:
+            acquired = self.lease.acquire()
+        except Exception:
+            logging.exception(f'Could not renew the {self.name} lease')
+            # keep leading until the lease this process last got would have expired
+            acquired = None
+
+        if acquired:
+            self._valid_until = attempted_at + self.ttl_seconds
+            if not self.is_leader:
+                self.is_leader = True
+                logging.info(f'{self.holder} is now the {self.name} leader')
+                self._on_elected()
+        elif self.is_leader and (acquired is False or time.monotonic() >= self._valid_until):
+            self._demote()
+
+    def _demote(self):
+        self.is_leader = False
+        logging.info(f'{self.holder} is no longer the {self.name} leader')
+        self._on_demoted()
@@ -0,0 +1,660 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+
+# Same tables as the Supabase project, in SQLite syntax, so the services can run on a laptop and in tests.
+# The category_rollups triggers mirror script/category_rollups.sql
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    password TEXT NOT NULL,
+    email TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    amount REAL NOT NULL DEFAULT 0,
+    is_registered INTEGER NOT NULL DEFAULT 0,
+    is_blocked INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    amount REAL NOT NULL,
+    sender_id INTEGER NOT NULL,
+    receiver_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    category TEXT,
+    acceptation TEXT NOT NULL DEFAULT 'pending'
+);
+CREATE INDEX IF NOT EXISTS transactions_sender_created_at ON transactions (sender_id, created_at, id);
+CREATE INDEX IF NOT EXISTS transactions_receiver_created_at ON transactions (receiver_id, created_at, id);
+CREATE INDEX IF NOT EXISTS transactions_created_at ON transactions (created_at, id);
+CREATE INDEX IF NOT EXISTS transactions_amount ON transactions (amount, id);
+CREATE TABLE IF NOT EXISTS category_rollups (
+    user_id INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    day TEXT NOT NULL,
+    total REAL NOT NULL,
+    count INTEGER NOT NULL,
+    min_amount REAL NOT NULL,
+    max_amount REAL NOT NULL,
+    PRIMARY KEY (user_id, category, day)
+);
+CREATE TRIGGER IF NOT EXISTS category_rollups_insert AFTER INSERT ON transactions BEGIN
+    INSERT INTO category_rollups (user_id, category, day, total, count, min_amount, max_amount)
+    VALUES (NEW.sender_id, COALESCE(NEW.category, ''), substr(NEW.created_at, 1, 10), NEW.amount, 1, NEW.amount,
+            NEW.amount)
+    ON CONFLICT (user_id, category, day) DO UPDATE
+        SET total = total + excluded.total, count = count + 1,
+            min_amount = MIN(min_amount, excluded.min_amount), max_amount = MAX(max_amount, excluded.max_amount);
+END;
+CREATE TRIGGER IF NOT EXISTS category_rollups_update
+AFTER UPDATE OF sender_id, category, amount, created_at ON transactions BEGIN
+    UPDATE category_rollups SET total = total - OLD.amount, count = count - 1
+    WHERE user_id = OLD.sender_id AND category = COALESCE(OLD.category, '') AND day = substr(OLD.created_at, 1, 10);
+    DELETE FROM category_rollups
+    WHERE user_id = OLD.sender_id AND category = COALESCE(OLD.category, '') AND day = substr(OLD.created_at, 1, 10)
+      AND count <= 0;
+    UPDATE category_rollups
+    SET min_amount = (SELECT min(amount) FROM transactions
+                      WHERE sender_id = OLD.sender_id AND COALESCE(category, '') = COALESCE(OLD.category, '')
+                        AND substr(created_at, 1, 10) = substr(OLD.created_at, 1, 10)),
+        max_amount = (SELECT max(amount) FROM transactions
+                      WHERE sender_id = OLD.sender_id AND COALESCE(category, '') = COALESCE(OLD.category, '')
+                        AND substr(created_at, 1, 10) = substr(OLD.created_at, 1, 10))
+    WHERE user_id = OLD.sender_id AND category = COALESCE(OLD.category, '') AND day = substr(OLD.created_at, 1, 10);
+    INSERT INTO category_rollups (user_id, category, day, total, count, min_amount, max_amount)
+    VALUES (NEW.sender_id, COALESCE(NEW.category, ''), substr(NEW.created_at, 1, 10), NEW.amount, 1, NEW.amount,
+            NEW.amount)
+    ON CONFLICT (user_id, category, day) DO UPDATE
+        SET total = total + excluded.total, count = count + 1,
+            min_amount = MIN(min_amount, excluded.min_amount), max_amount = MAX(max_amount, excluded.max_amount);
+END;
+CREATE TRIGGER IF NOT EXISTS category_rollups_delete AFTER DELETE ON transactions BEGIN
+    UPDATE category_rollups SET total = total - OLD.amount, count = count - 1
+    WHERE user_id = OLD.sender_id AND category = COALESCE(OLD.category, '') AND day = substr(OLD.created_at, 1, 10);
+    DELETE FROM category_rollups
+    WHERE user_id = OLD.sender_id AND category = COALESCE(OLD.category, '') AND day = substr(OLD.created_at, 1, 10)
+      AND count <= 0;
+    UPDATE category_rollups
+    SET min_amount = (SELECT min(amount) FROM transactions
+                      WHERE sender_id = OLD.sender_id AND COALESCE(category, '') = COALESCE(OLD.category, '')
+                        AND substr(created_at, 1, 10) = substr(OLD.created_at, 1, 10)),
+        max_amount = (SELECT max(amount) FROM transactions
+                      WHERE sender_id = OLD.sender_id AND COALESCE(category, '') = COALESCE(OLD.category, '')
+                        AND substr(created_at, 1, 10) = substr(OLD.created_at, 1, 10))
+    WHERE user_id = OLD.sender_id AND category = COALESCE(OLD.category, '') AND day = substr(OLD.created_at, 1, 10);
+END;
+CREATE TABLE IF NOT EXISTS contacts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    "current_user" INTEGER NOT NULL,
+    contact_name_id INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS contacts_pair ON contacts ("current_user", contact_name_id);
+CREATE TABLE IF NOT EXISTS cards (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    expiration_date TEXT NOT NULL,
+    cvv INTEGER NOT NULL,
+    number TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cards_user_id ON cards (user_id, id);
+CREATE TABLE IF NOT EXISTS recurring_transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sender_id INTEGER NOT NULL,
+    receiver_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    recurring_time TEXT NOT NULL,
+    next_run_time TEXT,
+    anchor_time TEXT,
+    status TEXT NOT NULL DEFAULT 'approved'
+);
+CREATE TABLE IF NOT EXISTS leader_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    revoked_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revoked_tokens_key ON revoked_tokens (key);
+CREATE INDEX IF NOT EXISTS revoked_tokens_revoked_at ON revoked_tokens (revoked_at);
+CREATE TABLE IF NOT EXISTS recipient_scores (
+    user_id INTEGER NOT NULL,
+    recipient_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    last_paid_at REAL NOT NULL,
+    PRIMARY KEY (user_id, recipient_id)
+);
+CREATE INDEX IF NOT EXISTS recipient_scores_user_score ON recipient_scores (user_id, score DESC);
+CREATE INDEX IF NOT EXISTS recurring_transactions_due ON recurring_transactions (next_run_time, id)
+    WHERE status = 'approved';
+'''
+
+# SQLite has no boolean type, these columns are converted back to bool when rows are returned
+BOOLEAN_COLUMNS = {
+    'users': {'is_admin', 'is_registered', 'is_blocked'},
+}
+
+OPERATORS = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+def _to_db(value):
+    if isinstance(value, datetime) or isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _quote(column: str) -> str:
+    return '"' + column.strip().replace('"', '') + '"'
+
+
+def _split_top_level(text: str) -> list[str]:
+    '''Splits a PostgREST filter list on commas which are not inside parentheses or double quotes.'''
+    parts, depth, current, quoted, escaped = [], 0, '', False, False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == ',' and depth == 0 and not quoted:
+            parts.append(current)
+            current = ''
+            continue
+        elif char == '"':
+            quoted = not quoted
+        elif char == '(' and not quoted:
+            depth += 1
+        elif char == ')' and not quoted:
+            depth -= 1
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _parse_condition(expression: str) -> tuple[str, list]:
+    '''Converts one PostgREST filter expression, e.g. "sender_id.eq.1" or "and(a.eq.1,b.gt.2)", to SQL.'''
+    expression = expression.strip()
+    for group in ('and', 'or'):
+        if expression.startswith(group + '(') and expression.endswith(')'):
+            return _parse_group(expression[len(group) + 1:-1], group.upper())
+
+    column, operator, value = expression.split('.', 2)
+    # values with reserved characters (",", ".", ":", "(", ")") are double quoted, with \ and " escaped
+    if len(value) > 1 and value.startswith('"') and value.endswith('"'):
+        value = re.sub(r'\\(.)', r'\1', value[1:-1])
+    if operator == 'in':
+        values = [v.strip() for v in value.strip('()').split(',') if v.strip()]
+        return f'{_quote(column)} IN ({", ".join("?" * len(values))})', values
+    if operator == 'is' and value == 'null':
+        return f'{_quote(column)} IS NULL', []
+    return f'{_quote(column)} {OPERATORS[operator]} ?', [value]
+
+
+def _parse_group(expressions: str, joiner: str) -> tuple[str, list]:
+    sql_parts, params = [], []
+    for expression in _split_top_level(expressions):
+        sql, expression_params = _parse_condition(expression)
+        sql_parts.append(sql)
+        params.extend(expression_params)
+    return '(' + f' {joiner} '.join(sql_parts) + ')', params
+
+
+class SqlResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class SqlQuery:
+    '''Subset of the postgrest request builder used by the services, executed as SQL.
+    Placeholders are written as "?", clients whose driver uses another style translate them.'''
+
+    def __init__(self, client: 'SqlClient', table: str):
+        self._client = client
+        self._table = table
+        self._action = 'select'
+        self._columns = '*'
+        self._payload = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._count = None
+        self._filters = []
+        self._params = []
+        self._order = []
+        self._limit = None
+        self._offset = None
+
+    def select(self, *columns, count=None):
+        columns = [c.strip() for column in columns for c in column.split(',') if c.strip()]
+        self._columns = '*' if not columns or '*' in columns else ', '.join(_quote(c) for c in columns)
+        self._count = count
+        return self
+
+    def insert(self, payload):
+        self._action = 'insert'
+        self._payload = payload if isinstance(payload, list) else [payload]
+        return self
+
+    def upsert(self, payload, on_conflict: str = '', ignore_duplicates: bool = False):
+        self.insert(payload)
+        self._action = 'upsert'
+        self._on_conflict = on_conflict
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload: dict):
+        self._action = 'update'
+        self._payload = payload
+        return self
+
+    def delete(self):
+        self._action = 'delete'
+        return self
+
+    def _filter(self, column: str, operator: str, value):
+        self._filters.append(f'{_quote(column)} {operator} ?')
+        self._params.append(_to_db(value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, '=', value)
+
+    def neq(self, column, value):
+        return self._filter(column, '!=', value)
+
+    def gt(self, column, value):
+        return self._filter(column, '>', value)
+
+    def gte(self, column, value):
+        return self._filter(column, '>=', value)
+
+    def lt(self, column, value):
+        return self._filter(column, '<', value)
+
+    def lte(self, column, value):
+        return self._filter(column, '<=', value)
+
+    def in_(self, column, values):
+        values = [_to_db(v) for v in values]
+        if not values:
+            self._filters.append('1 = 0')
+            return self
+        self._filters.append(f'{_quote(column)} IN ({", ".join("?" * len(values))})')
+        self._params.extend(values)
+        return self
+
+    def or_(self, filters: str):
+        sql, params = _parse_group(filters, 'OR')
+        self._filters.append(sql)
+        self._params.extend(params)
+        return self
+
+    def order(self, column, desc: bool = False):
+        self._order.append(f'{_quote(column)} {"DESC" if desc else "ASC"}')
+        return self
+
+    def limit(self, size: int):
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    def _where(self) -> str:
+        return (' WHERE ' + ' AND '.join(self._filters)) if self._filters else ''
+
+    def execute(self) -> SqlResponse:
+        return self._client.run(self._execute)
+
+    def _execute(self, connection) -> SqlResponse:
+        table = _quote(self._table)
+        count = None
+
+        if self._action == 'select':
+            sql = f'SELECT {self._columns} FROM {table}{self._where()}'
+            if self._order:
+                sql += ' ORDER BY ' + ', '.join(self._order)
+            if self._limit is not None:
+                sql += f' LIMIT {int(self._limit)} OFFSET {int(self._offset or 0)}'
+            rows = connection.execute(sql, self._params).fetchall()
+            if self._count:
+                count = self._client.count_rows(connection, table, self._where(), self._params, self._count)
+
+        elif self._action in ('insert', 'upsert'):
+            rows = []
+            for record in self._payload:
+                columns = list(record)
+                sql = (f'INSERT INTO {table} ({", ".join(_quote(c) for c in columns)}) '
+                       f'VALUES ({", ".join("?" * len(columns))})')
+                if self._action == 'upsert' and self._on_conflict:
+                    targets = ', '.join(_quote(c) for c in self._on_conflict.split(','))
+                    if self._ignore_duplicates:
+                        sql += f' ON CONFLICT ({targets}) DO NOTHING'
+                    else:
+                        # postgrest merges the duplicates by default
+                        sql += f' ON CONFLICT ({targets}) DO UPDATE SET ' + \
+                               ', '.join(f'{_quote(c)} = excluded.{_quote(c)}' for c in columns)
+                rows.extend(connection.execute(sql + ' RETURNING *', [_to_db(record[c]) for c in columns]).fetchall())
+
+        elif self._action == 'update':
+            columns = list(self._payload)
+            assignments = ', '.join(f'{_quote(c)} = ?' for c in columns)
+            params = [_to_db(self._payload[c]) for c in columns] + self._params
+            rows = connection.execute(f'UPDATE {table} SET {assignments}{self._where()} RETURNING *', params).fetchall()
+
+        else:
+            rows = connection.execute(f'DELETE FROM {table}{self._where()} RETURNING *', self._params).fetchall()
+
+        return SqlResponse([self._client.to_record(self._table, row) for row in rows], count)
+
+
+class SqlRpc:
+    def __init__(self, client: 'SqlClient', name: str, params: dict):
+        self._client = client
+        self._name = name
+        self._params = params
+
+    def execute(self) -> SqlResponse:
+        return self._client.run(
+            lambda connection: SqlResponse(self._client.call_procedure(connection, self._name, self._params)),
+            transaction=True)
+
+
+class SqlClient:
+    '''Storage backend which runs the services' table(...) / rpc(...) calls as SQL on a database connection.
+    It counts every execute() as one round trip and can add an artificial network latency per round trip
+    for benchmarks. Subclasses provide the connection handling.'''
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self._round_trips_lock = threading.Lock()
+
+    def table(self, name: str) -> SqlQuery:
+        return SqlQuery(self, name)
+
+    def rpc(self, name: str, params: dict) -> SqlRpc:
+        return SqlRpc(self, name, params)
+
+    def run(self, operation, transaction: bool = False):
+        '''Calls operation(connection), inside one database transaction if transaction is True.'''
+        if self.latency:
+            time.sleep(self.latency)
+        with self._round_trips_lock:
+            self.round_trips += 1
+        return self._run(operation, transaction)
+
+    def _run(self, operation, transaction: bool):
+        raise NotImplementedError
+
+    def call_procedure(self, connection, name: str, params: dict):
+        raise NotImplementedError
+
+    def count_rows(self, connection, table: str, where: str, params: list, count: str) -> int:
+        '''The number of rows select(count=...) matches. Counts them, whichever count was asked for;
+        backends with planner statistics answer "planned" and "estimated" from them.'''
+        return connection.execute(f'SELECT COUNT(*) AS count FROM {table}{where}', params).fetchone()['count']
+
+    def to_record(self, table: str, row) -> dict:
+        return dict(row)
+
+    def close(self):
+        pass
+
+
+class LocalClient(SqlClient):
+    '''SQLite storage backend, a stand-in for the Supabase project on a laptop and in tests.
+    All threads share one connection, server-side procedures run as their Python versions in PROCEDURES.'''
+
+    def __init__(self, path: str = ':memory:', latency: float = 0.0):
+        super().__init__(latency)
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(SCHEMA)
+
+    def _run(self, operation, transaction: bool):
+        with self._lock:
+            if not transaction:
+                return operation(self._connection)
+            # BEGIN IMMEDIATE takes the write lock up front, like SELECT ... FOR UPDATE in the Postgres procedure
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = operation(self._connection)
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+            return result
+
+    def call_procedure(self, connection: sqlite3.Connection, name: str, params: dict):
+        return PROCEDURES[name](self, connection, params)
+
+    def to_record(self, table: str, row: sqlite3.Row) -> dict:
+        record = dict(row)
+        for column in BOOLEAN_COLUMNS.get(table, ()):
+            if column in record and record[column] is not None:
+                record[column] = bool(record[column])
+        return record
+
+    def close(self):
+        self._connection.close()
+
+
+def _error(code: str, status_code: int, detail: str) -> dict:
+    return {'error': code, 'status': status_code, 'detail': detail}
+
+
+def _user(connection: sqlite3.Connection, user_id) -> dict | None:
+    row = connection.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def _set_balance(connection: sqlite3.Connection, user_id, amount: float):
+    connection.execute('UPDATE users SET amount = ? WHERE id = ?', (amount, user_id))
+
+
+def _insert_transaction(connection: sqlite3.Connection, **values) -> dict:
+    columns = list(values)
+    row = connection.execute(f'INSERT INTO transactions ({", ".join(columns)}) '
+                             f'VALUES ({", ".join("?" * len(columns))}) RETURNING *',
+                             [values[c] for c in columns]).fetchone()
+    return dict(row)
+
+
+def _update_transaction(connection: sqlite3.Connection, transaction_id, **values) -> dict:
+    assignments = ', '.join(f'{c} = ?' for c in values)
+    row = connection.execute(f'UPDATE transactions SET {assignments} WHERE id = ? RETURNING *',
+                             [*values.values(), transaction_id]).fetchone()
+    return dict(row)
+
+
+def _move_money(client: LocalClient, connection: sqlite3.Connection, params: dict) -> dict:
+    '''SQLite version of script/move_money.sql, it must return exactly what the Postgres function returns.'''
+    operation = params['p_operation']
+    user_id = params['p_user_id']
+    amount = params.get('p_amount')
+    action = params.get('p_action')
+
+    user = _user(connection, user_id)
+    if not user:
+        detail = f'Sender with id: {user_id} not found!' if operation == 'transfer' else 'User with this id not found!'
+        return _error('user_not_found', 404, detail)
+    if user['is_admin']:
+        return _error('admin', 403, 'Admin cannot do this!')
+
+    if operation == 'transfer':
+        receiver_id = params['p_counterparty_id']
+        if user['is_blocked']:
+            return _error('blocked', 403, 'You are blocked! You cannot make transactions!')
+        if not _user(connection, receiver_id):
+            return _error('receiver_not_found', 404, f'Receiver with id: {receiver_id} not found!')
+        if amount <= 0:
+            return _error('invalid_amount', 400, 'The sum has to be a positive number')
+        if user['amount'] < amount:
+            return _error('insufficient_balance', 400, 'Insufficient balance')
+
+        new_balance = user['amount'] - amount
+        _set_balance(connection, user_id, new_balance)
+        transaction = _insert_transaction(connection, sender_id=user_id, receiver_id=receiver_id, amount=amount,
+                                          status='pending', category=params.get('p_category'))
+        return {'transaction': transaction, 'old_balance': user['amount'], 'new_balance': new_balance}
+
+    if operation in ('deposit', 'withdraw'):
+        if amount <= 0:
+            detail = 'The deposit sum has to be a positive number!' if operation == 'deposit' \
+                else 'The sum has to be a positive number'
+            return _error('invalid_amount', 400, detail)
+        if operation == 'withdraw' and user['amount'] < amount:
+            return _error('insufficient_balance', 400, 'Insufficient balance')
+
+        new_balance = user['amount'] + amount if operation == 'deposit' else user['amount'] - amount
+        _set_balance(connection, user_id, new_balance)
+        transaction = _insert_transaction(connection, sender_id=user_id, receiver_id=user_id, amount=amount,
+                                          status='confirmed', category='atm', acceptation='accepted')
+        return {'transaction': transaction, 'old_balance': user['amount'], 'new_balance': new_balance}
+
+    transaction_id = params['p_transaction_id']
+
+    if operation == 'confirm':
+        row = connection.execute("SELECT * FROM transactions WHERE id = ? AND sender_id = ? AND status = 'pending'",
+                                 (transaction_id, user_id)).fetchone()
+        if not row:
+            return _error('transaction_not_found', 404,
+                          f'Transaction with id: {transaction_id} is not found! You can confirm only pending '
+                          f'transactions!')
+        if action not in ('confirm', 'deny'):
+            return _error('invalid_action', 400, 'You can only "confirm" or "deny" the transaction!')
+
+        if action == 'confirm':
+            return {'transaction': _update_transaction(connection, transaction_id, status='confirmed')}
+        _set_balance(connection, user_id, user['amount'] + row['amount'])
+        return {'transaction': _update_transaction(connection, transaction_id, status='declined')}
+
+    if operation == 'accept':
+        row = connection.execute("SELECT * FROM transactions WHERE id = ? AND receiver_id = ? "
+                                 "AND acceptation = 'pending'", (transaction_id, user_id)).fetchone()
+        if not row:
+            return _error('transaction_not_found', 404,
+                          f'Transaction with id: {transaction_id} not found or is already accepted!')
+        if row['status'] != 'confirmed':
+            return _error('not_confirmed', 400,
+                          f'Transaction with id: {transaction_id} is NOT CONFIRMED by the sender!')
+        if action not in ('accept', 'pending', 'decline'):
+            return _error('invalid_action', 400, 'Acceptation could be only accept, pending, decline!')
+
+        if action == 'accept':
+            _set_balance(connection, user_id, user['amount'] + row['amount'])
+            return {'transaction': _update_transaction(connection, transaction_id, acceptation='accepted')}
+        if action == 'decline':
+            sender = _user(connection, row['sender_id'])
+            _set_balance(connection, sender['id'], sender['amount'] + row['amount'])
+            return {'transaction': _update_transaction(connection, transaction_id, acceptation='declined')}
+        return {'transaction': dict(row)}
+
+    return _error('invalid_operation', 400, f'Unknown operation: {operation}')
+
+
+def _pay_recurring_runs(client: LocalClient, connection: sqlite3.Connection, params: dict) -> dict:
+    '''SQLite version of script/recurring_sweep.sql, it must return exactly what the Postgres function returns.
+    Timestamps are compared as strings, so expected has to be the next_run_time value as it was read.'''
+    planned = {run['id']: run for run in params['p_runs']}
+
+    due = []
+    for row in connection.execute(f"SELECT * FROM recurring_transactions WHERE status = 'approved' "
+                                  f"AND id IN ({', '.join('?' * len(planned))}) ORDER BY next_run_time, id",
+                                  list(planned)):
+        run = planned[row['id']]
+        if row['next_run_time'] == run['expected']:
+            due.append({**dict(row), 'runs': run['runs'], 'run_times': run['run_times'],
+                        'following_run_time': run['next_run_time']})
+
+    account_ids = list({row['sender_id'] for row in due} | {row['receiver_id'] for row in due})
+    balances = {row['id']: row['amount'] for row in
+                connection.execute(f'SELECT id, amount FROM users WHERE id IN ({", ".join("?" * len(account_ids))})',
+                                   account_ids)}
+
+    # what the rows paid so far took from each sender's balance, a row that does not fit is skipped
+    spent = defaultdict(float)
+    paid, failed = [], []
+    for row in due:
+        if row['sender_id'] not in balances or row['receiver_id'] not in balances:
+            failed.append(row)
+            continue
+        total = spent[row['sender_id']] + row['amount'] * row['runs']
+        if row['following_run_time'] is not None and (row['runs'] == 0 or total <= balances[row['sender_id']]):
+            spent[row['sender_id']] = total
+            paid.append(row)
+        else:
+            failed.append(row)
+
+    deltas = defaultdict(float)
+    for row in paid:
+        deltas[row['sender_id']] -= row['amount'] * row['runs']
+        deltas[row['receiver_id']] += row['amount'] * row['runs']
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+
+    connection.executemany('UPDATE users SET amount = amount + ? WHERE id = ?',
+                           [(delta, user_id) for user_id, delta in deltas.items()])
+    payments = [(row['sender_id'], row['receiver_id'], row['amount'], run_time)
+                for row in paid for run_time in row['run_times']]
+    connection.executemany("INSERT INTO transactions (sender_id, receiver_id, amount, status, category, created_at) "
+                           "VALUES (?, ?, ?, 'confirmed', 'recurring', ?)", payments)
+    connection.executemany('UPDATE recurring_transactions SET next_run_time = ? WHERE id = ?',
+                           [(row['following_run_time'], row['id']) for row in paid])
+    connection.executemany("UPDATE recurring_transactions SET status = 'failed' WHERE id = ?",
+                           [(row['id'],) for row in failed])
+
+    return {'due': len(due), 'processed': len(payments), 'failed': len(failed),
+            'oldest_due': min((row['next_run_time'] for row in due), default=None),
+            'user_ids': list(deltas), 'next_runs': [[row['id'], row['following_run_time']] for row in paid],
+            'payments': [[row['sender_id'], row['receiver_id'], row['runs']] for row in paid if row['runs']]}
+
+
+def _add_recipient_scores(client: LocalClient, connection: sqlite3.Connection, params: dict):
+    '''SQLite version of add_recipient_scores in script/recipient_scores.sql.'''
+    connection.executemany(
+        'INSERT INTO recipient_scores (user_id, recipient_id, score, last_paid_at) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT (user_id, recipient_id) DO UPDATE SET score = score + excluded.score, '
+        'last_paid_at = MAX(last_paid_at, excluded.last_paid_at)',
+        [(row['user_id'], row['recipient_id'], row['score'], row['last_paid_at']) for row in params['p_scores']])
+
+
+def _acquire_lease(client: LocalClient, connection: sqlite3.Connection, params: dict) -> bool | None:
+    '''SQLite version of acquire_lease in script/leader_lease.sql.'''
+    now = datetime.utcnow()
+    row = connection.execute(
+        'INSERT INTO leader_leases (name, holder, expires_at) VALUES (?, ?, ?) '
+        'ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at '
+        'WHERE leader_leases.holder = excluded.holder OR leader_leases.expires_at < ? RETURNING 1',
+        (params['p_name'], params['p_holder'], (now + timedelta(seconds=params['p_ttl_seconds'])).isoformat(),
+         now.isoformat())).fetchone()
+    return True if row else None
+
+
+def _release_lease(client: LocalClient, connection: sqlite3.Connection, params: dict):
+    connection.execute('DELETE FROM leader_leases WHERE name = ? AND holder = ?', (params['p_name'], params['p_holder']))
+
+
+# Python versions of the server-side procedures in script/*.sql
+PROCEDURES = {
+    'move_money': _move_money,
+    'pay_recurring_runs': _pay_recurring_runs,
+    'acquire_lease': _acquire_lease,
+    'release_lease': _release_lease,
+    'add_recipient_scores': _add_recipient_scores,
+}
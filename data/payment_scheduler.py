@@ -0,0 +1,182 @@
+import heapq
+import logging
+import threading
+import time
+from itertools import islice
+
+# due ids handed to the executor per call, the sweep function pays them in one database call
+DISPATCH_BATCH_SIZE = 500
+# the heap is rebuilt without stale entries when they outnumber the live ones
+COMPACT_RATIO = 2
+# pushing k entries costs k log n, heapify costs n, so small batches are pushed
+HEAPIFY_RATIO = 16
+# runs added per step when the thread loads the schedule, it checks for stop between steps
+LOAD_CHUNK_SIZE = 5000
+
+
+class ScheduledPayment:
+    '''A pending run of a recurring transaction, run_at is a POSIX timestamp.'''
+    __slots__ = ('run_at', 'recurring_id')
+
+    def __init__(self, run_at: float, recurring_id: int):
+        self.run_at = run_at
+        self.recurring_id = recurring_id
+
+    def __lt__(self, other):
+        return self.run_at < other.run_at
+
+
+class PaymentScheduler:
+    '''In-process min-heap of pending recurring payments.
+    A thread sleeps until the earliest run_at and hands the due ids, batch_size at a time, to execute.
+    Rescheduling or cancelling an id leaves its old entry in the heap, it is skipped when it comes up.
+    If given, sweep is called every sweep_seconds for rows this process does not know about.'''
+
+    def __init__(self, execute, sweep=None, sweep_seconds: float = 10.0, batch_size: int = DISPATCH_BATCH_SIZE,
+                 clock=time.time):
+        self._execute = execute
+        self._sweep = sweep
+        self.sweep_seconds = sweep_seconds
+        self.batch_size = batch_size
+        self._clock = clock
+        self._heap: list[ScheduledPayment] = []
+        self._entries: dict[int, ScheduledPayment] = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = True
+        # the last load of the schedule, see start
+        self.loading = False
+        self.loaded = 0
+        self.load_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def running(self) -> bool:
+        return not self._stopped
+
+    def schedule(self, recurring_id: int, run_at: float):
+        '''Adds or moves the run of recurring_id.'''
+        entry = ScheduledPayment(run_at, recurring_id)
+        with self._condition:
+            self._entries[recurring_id] = entry
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                # the thread sleeps until the old earliest run
+                self._condition.notify()
+            self._compact()
+
+    def schedule_many(self, runs):
+        '''Adds or moves many (recurring_id, run_at) runs, a large load is heapified once instead of pushed.'''
+        entries = [ScheduledPayment(run_at, recurring_id) for recurring_id, run_at in runs]
+        with self._condition:
+            for entry in entries:
+                self._entries[entry.recurring_id] = entry
+            if len(entries) * HEAPIFY_RATIO < len(self._heap):
+                for entry in entries:
+                    heapq.heappush(self._heap, entry)
+            else:
+                self._heap.extend(entries)
+                heapq.heapify(self._heap)
+            self._compact()
+            self._condition.notify()
+
+    def cancel(self, recurring_id: int):
+        with self._condition:
+            self._entries.pop(recurring_id, None)
+
+    def clear(self):
+        with self._condition:
+            self._heap.clear()
+            self._entries.clear()
+
+    def due(self, now: float) -> list[int]:
+        '''Takes up to batch_size ids whose run_at has passed off the heap.'''
+        ids = []
+        with self._condition:
+            while self._heap and self._heap[0].run_at <= now and len(ids) < self.batch_size:
+                entry = heapq.heappop(self._heap)
+                if self._entries.get(entry.recurring_id) is entry:
+                    del self._entries[entry.recurring_id]
+                    ids.append(entry.recurring_id)
+        return ids
+
+    def _compact(self):
+        if len(self._heap) > COMPACT_RATIO * len(self._entries) + self.batch_size:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    def start(self, load=None):
+        '''Starts the thread. If given, load() yields the (recurring_id, run_at) runs to schedule first; the thread
+        adds them LOAD_CHUNK_SIZE at a time before it dispatches anything, so the caller does not wait for them.'''
+        with self._condition:
+            if not self._stopped:
+                return
+            self._stopped = False
+        self._thread = threading.Thread(target=self._run, args=(load,), name='payment-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stops the thread after the batch it is running, pending runs are kept until clear.'''
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _load(self, load):
+        self.loading, self.loaded = True, 0
+        started = time.perf_counter()
+        try:
+            runs = iter(load())
+            while not self._stopped:
+                chunk = list(islice(runs, LOAD_CHUNK_SIZE))
+                if not chunk:
+                    break
+                self.schedule_many(chunk)
+                self.loaded += len(chunk)
+                self.load_seconds = time.perf_counter() - started
+        except Exception:
+            # the sweep still pays the rows which were not loaded
+            logging.exception('Loading the recurring payment schedule failed')
+        self.loading = False
+        self.load_seconds = time.perf_counter() - started
+        logging.info(f'Loaded {self.loaded} scheduled recurring transactions in {self.load_seconds:.2f} s '
+                     f'({self.loaded / self.load_seconds if self.load_seconds else 0:.0f} runs/s)')
+
+    def load_stats(self) -> dict:
+        return {'scheduled': len(self), 'schedule_loading': self.loading, 'schedule_loaded': self.loaded,
+                'schedule_load_seconds': self.load_seconds}
+
+    def _run(self, load=None):
+        if load is not None:
+            self._load(load)
+        next_sweep = self._clock()
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                now = self._clock()
+                wake_at = next_sweep if self._sweep else now + self.sweep_seconds
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0].run_at)
+                if wake_at > now:
+                    self._condition.wait(wake_at - now)
+                    continue
+
+            if self._sweep and now >= next_sweep:
+                next_sweep = now + self.sweep_seconds
+                self._call(self._sweep)
+            ids = self.due(now)
+            while ids and not self._stopped:
+                self._call(self._execute, ids)
+                ids = self.due(now)
+
+    def _call(self, function, *args):
+        try:
+            function(*args)
+        except Exception:
+            # the runs stay due in the database, the next sweep pays them
+            logging.exception('Recurring payment dispatch failed')
@@ -0,0 +1,68 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import ConnectionPool
+
+from data.local_client import SqlClient, _quote
+
+# count='estimated' counts the rows exactly when the planner expects fewer than this many, as PostgREST does
+# with its max-rows setting; larger counts are the planner's estimate
+ESTIMATED_COUNT_EXACT_ROWS = 1000
+
+
+class _Connection:
+    '''Runs the "?" placeholder SQL written by SqlQuery through psycopg, which expects "%s".'''
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def execute(self, sql: str, params=()):
+        return self._connection.execute(sql.replace('%', '%%').replace('?', '%s'), params)
+
+
+class PostgresClient(SqlClient):
+    '''Direct SQL storage backend, talks to the Postgres database through a connection pool instead of PostgREST.
+    Procedures are the SQL functions in script/*.sql, called with named arguments.'''
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, latency: float = 0.0):
+        super().__init__(latency)
+        self._pool = ConnectionPool(dsn, min_size=min_size, max_size=max_size,
+                                    kwargs={'row_factory': dict_row, 'autocommit': True})
+
+    def _run(self, operation, transaction: bool):
+        with self._pool.connection() as connection:
+            if not transaction:
+                return operation(_Connection(connection))
+            with connection.transaction():
+                return operation(_Connection(connection))
+
+    def call_procedure(self, connection: _Connection, name: str, params: dict):
+        arguments = ', '.join(f'{_quote(param)} => ?' for param in params)
+        # psycopg cannot adapt dicts and lists of dicts, the procedures take them as jsonb like PostgREST sends them
+        values = [Jsonb(value) if isinstance(value, (dict, list)) else value for value in params.values()]
+        return connection.execute(f'SELECT {_quote(name)}({arguments}) AS result', values).fetchone()['result']
+
+    def count_rows(self, connection: _Connection, table: str, where: str, params: list, count: str) -> int:
+        if count not in ('planned', 'estimated'):
+            return super().count_rows(connection, table, where, params, count)
+        # the row estimate of the plan, from pg_class.reltuples and the column statistics of the filters
+        plan = connection.execute(f'EXPLAIN (FORMAT JSON) SELECT 1 FROM {table}{where}', params).fetchone()
+        planned = plan['QUERY PLAN'][0]['Plan']['Plan Rows']
+        if count == 'estimated' and planned < ESTIMATED_COUNT_EXACT_ROWS:
+            return super().count_rows(connection, table, where, params, count)
+        return planned
+
+    def to_record(self, table: str, row: dict) -> dict:
+        # same value types as the JSON PostgREST returns
+        record = dict(row)
+        for column, value in record.items():
+            if isinstance(value, (datetime, date)):
+                record[column] = value.isoformat()
+            elif isinstance(value, Decimal):
+                record[column] = float(value)
+        return record
+
+    def close(self):
+        self._pool.close()
@@ -0,0 +1,170 @@
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from data.connection import query
+
+# script/recipient_scores.sql
+RECIPIENT_SCORES_TABLE = 'recipient_scores'
+ADD_SCORES_PROCEDURE = 'add_recipient_scores'
+# a payment counts half as much after this long, so the score is a frequency which favours recent payments
+SCORE_HALF_LIFE_SECONDS = 30 * 24 * 3600
+# scores are stored as of this moment (2024-01-01 UTC): a payment adds 2 ** ((paid_at - epoch) / half-life),
+# so adding a payment never rescales the other scores and their order does not change as time passes;
+# doubles hold that for about 80 years of half-lives
+SCORE_EPOCH = 1_704_067_200
+# recipients kept in memory per user, the table has all of them
+TRACKED_RECIPIENTS = 64
+TOP_RECIPIENTS_LIMIT = 10
+MAX_TOP_RECIPIENTS_LIMIT = TRACKED_RECIPIENTS
+RANKING_CACHE_SIZE = 10_000
+# scores added by other workers show up within this many seconds
+RANKING_TTL_SECONDS = 60
+# new payments are written to the table at most this many seconds later
+RANKING_FLUSH_SECONDS = 5
+
+
+class RecipientRanking:
+    '''Each user's most paid recipients by a decayed count of payments, updated in memory on every payment.
+    The scores added since the last flush are written to the recipient_scores table by a background thread,
+    added to the stored ones in one call, so the workers' scores add up. A user's scores are read from the table
+    on first use and kept for ttl seconds, up to max_users users. With flush_seconds=None the caller flushes.'''
+
+    def __init__(self, client=query, tracked: int = TRACKED_RECIPIENTS, max_users: int = RANKING_CACHE_SIZE,
+                 ttl: float = RANKING_TTL_SECONDS, flush_seconds: float | None = RANKING_FLUSH_SECONDS,
+                 half_life: float = SCORE_HALF_LIFE_SECONDS, clock=time.time):
+        self.client = client
+        self.tracked = tracked
+        self.max_users = max_users
+        self.ttl = ttl
+        self.flush_seconds = flush_seconds
+        self.half_life = half_life
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # user -> (expires at, recipient -> [score, last paid at])
+        self._users: OrderedDict[int, tuple[float, dict[int, list[float]]]] = OrderedDict()
+        # scores not written yet, and the ones being written, by user and recipient
+        self._pending: dict[int, dict[int, list[float]]] = {}
+        self._flushing: dict[int, dict[int, list[float]]] = {}
+        self._stopping = threading.Event()
+        self._thread = None
+        self.loads = 0
+
+    def weight(self, at: float) -> float:
+        return 2 ** ((at - SCORE_EPOCH) / self.half_life)
+
+    def record(self, sender_id: int, receiver_id: int, payments: int = 1, at: float = None):
+        '''Counts payments from sender to receiver made at the epoch time at, now by default.'''
+        if sender_id == receiver_id or payments <= 0:
+            return
+        at = at or self._clock()
+        score = payments * self.weight(at)
+        self._start()
+        with self._lock:
+            _add(self._pending.setdefault(sender_id, {}), receiver_id, score, at)
+            entry = self._users.get(sender_id)
+            if entry is not None:
+                self._add_tracked(entry[1], receiver_id, score, at)
+
+    def top(self, user_id: int, limit: int = TOP_RECIPIENTS_LIMIT) -> list[dict]:
+        '''The user's recipients with the highest score, the score is the number of payments now, with each
+        payment halved for every half-life since it was made.'''
+        now = self._clock()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._users.move_to_end(user_id)
+                return self._ranked(entry[1], limit, now)
+        scores = self._load(user_id, now)
+        with self._lock:
+            return self._ranked(scores, limit, now)
+
+    def _ranked(self, scores: dict[int, list[float]], limit: int, now: float) -> list[dict]:
+        decay = 1 / self.weight(now)
+        return [{'id': recipient_id, 'score': score * decay, 'last_paid_at': last_paid_at}
+                for recipient_id, (score, last_paid_at) in
+                heapq.nlargest(limit, scores.items(), key=lambda item: (item[1][0], item[1][1]))]
+
+    def _load(self, user_id: int, now: float) -> dict[int, list[float]]:
+        self.loads += 1
+        rows = self.client.table(RECIPIENT_SCORES_TABLE).select('recipient_id', 'score', 'last_paid_at') \
+            .eq('user_id', user_id).order('score', desc=True).limit(self.tracked).execute().data
+        scores = {row['recipient_id']: [row['score'], row['last_paid_at']] for row in rows}
+        with self._lock:
+            # payments the table does not have yet
+            for unwritten in (self._flushing, self._pending):
+                for recipient_id, (score, at) in unwritten.get(user_id, {}).items():
+                    self._add_tracked(scores, recipient_id, score, at)
+            self._users.pop(user_id, None)
+            self._users[user_id] = (now + self.ttl, scores)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return scores
+
+    def _add_tracked(self, scores: dict[int, list[float]], recipient_id: int, score: float, at: float):
+        _add(scores, recipient_id, score, at)
+        if len(scores) > self.tracked:
+            del scores[min(scores, key=lambda recipient: scores[recipient][0])]
+
+    def flush(self) -> int:
+        '''Adds the scores recorded since the last flush to the table, returns the number of rows written.'''
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+            rows = [{'user_id': user_id, 'recipient_id': recipient_id, 'score': score, 'last_paid_at': at}
+                    for user_id, recipients in self._flushing.items()
+                    for recipient_id, (score, at) in recipients.items()]
+            try:
+                self.client.rpc(ADD_SCORES_PROCEDURE, {'p_scores': rows}).execute()
+            except Exception:
+                with self._lock:
+                    # kept for the next flush
+                    for user_id, recipients in self._flushing.items():
+                        pending = self._pending.setdefault(user_id, {})
+                        for recipient_id, (score, at) in recipients.items():
+                            _add(pending, recipient_id, score, at)
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            return len(rows)
+
+    def _start(self):
+        if self._thread is not None or self.flush_seconds is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='recipient-ranking', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception('Writing recipient scores failed')
+
+    def stop(self):
+        '''Stops the flush thread and writes the scores it has not written yet.'''
+        self._stopping.set()
+        try:
+            self.flush()
+        except Exception:
+            logging.exception('Writing recipient scores failed')
+
+
+def _add(scores: dict[int, list[float]], recipient_id: int, score: float, at: float):
+    current = scores.get(recipient_id)
+    if current is None:
+        scores[recipient_id] = [score, at]
+    else:
+        current[0] += score
+        current[1] = max(current[1], at)
+
+
+recipient_ranking = RecipientRanking()
@@ -0,0 +1,224 @@
+import hashlib
+import heapq
+import logging
+import math
+import threading
+import time
+
+from decouple import config
+
+from data.connection import query
+
+# memory: revocations of this process only, enough for a single worker and for local runs
+# database: the revoked_tokens table from script/revoked_tokens.sql, shared by every worker
+TOKEN_REVOCATION_STORE = config('TOKEN_REVOCATION_STORE', default='memory')
+REVOCATION_STORES = ('memory', 'database')
+REVOKED_TOKENS_TABLE = 'revoked_tokens'
+# the database store keeps a Bloom filter of the revoked keys, tokens which are not in it are answered without a query
+REVOCATION_FILTER_CAPACITY = 100_000
+REVOCATION_FILTER_ERROR_RATE = 0.01
+# revocations made by other workers reach the filter within this many seconds
+REVOCATION_SYNC_SECONDS = 5
+
+
+class BloomFilter:
+    '''Set of strings in a fixed number of bits. It never misses an added item and answers "maybe" for an item
+    which was not added with a probability of about error_rate while it holds at most capacity items.
+    Items cannot be removed, the filter is rebuilt instead.'''
+
+    def __init__(self, capacity: int = REVOCATION_FILTER_CAPACITY, error_rate: float = REVOCATION_FILTER_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # double hashing, two halves of one digest give every position
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class MemoryRevocationStore:
+    '''Revoked keys of this process with the time they were revoked. An entry is dropped once the tokens
+    it rejects have expired, so the store holds at most the revocations of one token lifetime.'''
+
+    # revoked_at only reads memory, it can be called on the event loop
+    blocking = False
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (revoked_at, expires_at), the heap orders the keys by expiry
+        self._entries: dict[str, tuple[float, float]] = {}
+        self._expiry: list[tuple[float, str]] = []
+
+    def revoke(self, key: str, expires_at: float):
+        now = self._clock()
+        with self._lock:
+            self._purge(now)
+            previous = self._entries.get(key)
+            expires_at = max(expires_at, previous[1]) if previous else expires_at
+            self._entries[key] = (now, expires_at)
+            heapq.heappush(self._expiry, (expires_at, key))
+
+    def revoked_at(self, key: str) -> float | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= self._clock():
+            return None
+        return entry[0]
+
+    def _purge(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            if entry and entry[1] <= now:
+                del self._entries[key]
+
+    def stop(self):
+        pass
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DatabaseRevocationStore:
+    '''Revocations in the revoked_tokens table, shared by the workers. A Bloom filter of the revoked keys,
+    synced from the table in a background thread, answers the common "not revoked" check without a query;
+    only keys the filter may hold are looked up. The first check syncs the filter before it answers, so a new
+    worker rejects the tokens revoked before it started. With sync_seconds=None the caller syncs after that.'''
+
+    # revoked_at may query the table, async callers run it on a thread
+    blocking = True
+
+    def __init__(self, client=query, capacity: int = REVOCATION_FILTER_CAPACITY,
+                 error_rate: float = REVOCATION_FILTER_ERROR_RATE, sync_seconds: float | None = REVOCATION_SYNC_SECONDS,
+                 clock=time.time):
+        self.client = client
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_seconds = sync_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._filter = BloomFilter(capacity, error_rate)
+        # revocations read since the last sync, revoked_at of later rows is newer
+        self._synced_to = 0.0
+        # key -> (revoked_at, expires_at) of keys found revoked, kept up to date by the sync
+        self._revoked: dict[str, tuple[float, float]] = {}
+        # false positives of the filter, forgotten when a sync brings new revocations
+        self._not_revoked: set[str] = set()
+        self._synced = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.lookups = 0
+
+    def revoke(self, key: str, expires_at: float):
+        now = self._clock()
+        self.client.table(REVOKED_TOKENS_TABLE).insert(
+            {'key': key, 'revoked_at': now, 'expires_at': expires_at}).execute()
+        # rows which cannot match a valid token anymore
+        self.client.table(REVOKED_TOKENS_TABLE).delete().lt('expires_at', now).execute()
+        with self._lock:
+            self._filter.add(key)
+            self._not_revoked.discard(key)
+            self._revoked[key] = (now, expires_at)
+
+    def revoked_at(self, key: str) -> float | None:
+        if not self._synced.is_set():
+            self._initial_sync()
+        self._start()
+        if key not in self._filter or key in self._not_revoked:
+            return None
+
+        now = self._clock()
+        entry = self._revoked.get(key)
+        if entry and entry[1] > now:
+            return entry[0]
+
+        self.lookups += 1
+        rows = self.client.table(REVOKED_TOKENS_TABLE).select('revoked_at', 'expires_at').eq('key', key) \
+            .gt('expires_at', now).order('revoked_at', desc=True).limit(1).execute().data
+        if not rows:
+            with self._lock:
+                if len(self._not_revoked) >= self.capacity:
+                    self._not_revoked.clear()
+                self._not_revoked.add(key)
+            return None
+        with self._lock:
+            self._revoked[key] = (rows[0]['revoked_at'], rows[0]['expires_at'])
+        return rows[0]['revoked_at']
+
+    def sync(self):
+        '''Adds the revocations made since the last sync to the filter, rebuilds it when it is full.'''
+        now = self._clock()
+        table = self.client.table(REVOKED_TOKENS_TABLE).select('key', 'revoked_at', 'expires_at') \
+            .gt('expires_at', now)
+        if self._filter.count < self.capacity:
+            # clocks of other hosts and late commits, re-reading a row is harmless
+            table = table.gte('revoked_at', self._synced_to - (self.sync_seconds or 0))
+        rows = table.execute().data
+
+        with self._lock:
+            # rows read again are in the filter already
+            added = sum(row['key'] not in self._filter for row in rows)
+            if self._filter.count + added > self.capacity:
+                rows = self.client.table(REVOKED_TOKENS_TABLE).select('key', 'revoked_at', 'expires_at') \
+                    .gt('expires_at', now).execute().data
+                # room to grow, so the next syncs add to the filter instead of reading the table again
+                self.capacity = max(self.capacity, 2 * len(rows))
+                self._filter = BloomFilter(self.capacity, self.error_rate)
+            for row in rows:
+                if row['key'] not in self._filter:
+                    self._filter.add(row['key'])
+                self._not_revoked.discard(row['key'])
+                entry = self._revoked.get(row['key'])
+                if entry and entry[0] < row['revoked_at']:
+                    self._revoked[row['key']] = (row['revoked_at'], row['expires_at'])
+                self._synced_to = max(self._synced_to, row['revoked_at'])
+            for key, (_, expires_at) in list(self._revoked.items()):
+                if expires_at <= now:
+                    del self._revoked[key]
+        self._synced.set()
+
+    def _initial_sync(self):
+        # a failed sync raises, tokens are not accepted on an empty filter
+        with self._sync_lock:
+            if not self._synced.is_set():
+                self.sync()
+
+    def _start(self):
+        if self._thread is not None or self.sync_seconds is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='token-revocations', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        # the first check has synced already
+        while not self._stopping.wait(self.sync_seconds):
+            try:
+                self.sync()
+            except Exception:
+                logging.exception('Syncing token revocations failed')
+
+    def stop(self):
+        self._stopping.set()
+
+
+def create_revocation_store(store: str = TOKEN_REVOCATION_STORE):
+    if store == 'memory':
+        return MemoryRevocationStore()
+    if store == 'database':
+        return DatabaseRevocationStore()
+    raise ValueError(f'Unknown token revocation store: {store}, expected one of {", ".join(REVOCATION_STORES)}')
@@ -1,8 +0,0 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime, timedelta
-
-# Create the scheduler instance
-scheduler = BackgroundScheduler()
-
-# Start the scheduler
-scheduler.start()
\ No newline at end of file
@@ -91,10 +91,15 @@ class Card(CardBase):
     user_id: int
 
 
+class CardPage(BaseModel):
+    cards: list[Card]
+    next_cursor: Optional[str] = None
+
+
 class CreateRecurringTransaction(BaseModel):
     receiver_id: int
     amount: float
-    recurring_time: str  # e.g., 'daily', 'weekly', 'monthly'
+    recurring_time: str  # e.g., 'daily', 'weekly', 'monthly', 'monthly:15', 'cron:0 9 * * 1-5'
 
 
 class UpdateRecurringTransaction(BaseModel):
@@ -145,3 +150,36 @@ class TransactionOut(BaseModel):
     category: str
     acceptation: str
 
+
+
+class Principal(BaseModel):
+    user_id: int
+    jti: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    is_admin: Optional[bool] = None
+    is_blocked: Optional[bool] = None
+    is_registered: Optional[bool] = None
+    claims_expire_at: Optional[datetime] = None
+
+    @property
+    def claims_expired(self) -> bool:
+        # tokens issued before the claims were added only carry user_id
+        return self.claims_expire_at is None or self.claims_expire_at <= datetime.utcnow()
+
+
+class CategoryTotal(BaseModel):
+    category: str
+    total: float
+    count: int
+    min_amount: float
+    max_amount: float
+
+
+class BalanceForecast(BaseModel):
+    start_date: date
+    balance: float
+    # balance at the end of each day from start_date
+    balances: list[float]
+    first_negative_date: date | None
+    lowest_balance: float
+    lowest_balance_date: date
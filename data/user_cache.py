@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+from data.schemas import GetUser
+
+USER_CACHE_SIZE = 10_000
+USER_CACHE_TTL_SECONDS = 30
+
+# lookup columns besides the id, every cached user is reachable by all of them
+SECONDARY_KEYS = ('email', 'phone_number', 'username')
+
+
+class UserCache:
+    '''Process-local LRU cache of GetUser records with a time to live.
+    Entries are stored by id and indexed by email, phone number and username.
+    Every write to the users table made by this process must call invalidate(user_id);
+    the TTL bounds how stale a user changed by another worker can get.'''
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._users: OrderedDict[int, tuple[float, GetUser]] = OrderedDict()
+        self._index: dict[tuple[str, object], int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, value, key: str = 'id') -> GetUser | None:
+        with self._lock:
+            user_id = value if key == 'id' else self._index.get((key, value))
+            entry = self._users.get(user_id)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, user = entry
+            if expires_at <= self._clock():
+                self._remove(user_id)
+                self.misses += 1
+                return None
+
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return user
+
+    def put(self, user: GetUser):
+        with self._lock:
+            self._remove(user.id)
+            self._users[user.id] = (self._clock() + self.ttl, user)
+            for key in SECONDARY_KEYS:
+                self._index[(key, getattr(user, key))] = user.id
+
+            while len(self._users) > self.max_size:
+                self._remove(next(iter(self._users)))
+                self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._remove(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._index.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._users),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _remove(self, user_id: int):
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            return
+        user = entry[1]
+        for key in SECONDARY_KEYS:
+            # the index may already point to a newer user which took over this email/phone/username
+            if self._index.get((key, getattr(user, key))) == user_id:
+                del self._index[(key, getattr(user, key))]
+
+
+user_cache = UserCache()
@@ -0,0 +1,139 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from data.connection import query
+from data.async_connection import get_async_query
+from data.schemas import GetUser
+from data.user_cache import user_cache
+
+# columns a user can be looked up by, all of them are unique in the users table
+USER_KEYS = ('id', 'email', 'phone_number', 'username')
+
+
+def to_user(user: dict) -> GetUser:
+    return GetUser(
+        id=user['id'],
+        username=user['username'],
+        password=user['password'],
+        email=user['email'],
+        phone_number=user['phone_number'],
+        is_admin=user['is_admin'],
+        created_at=user['created_at'],
+        amount=user['amount'],
+        is_registered=user['is_registered'],
+        is_blocked=user['is_blocked']
+    )
+
+
+class UserLoader:
+    '''Collects the user lookups made during one request and resolves them with one
+    users query per column (in_ filter). Users found in the process-wide user_cache are not queried.
+    Results, including "not found", are memoized until the request ends.'''
+
+    def __init__(self):
+        self._pending = {key: set() for key in USER_KEYS}
+        self._loaded = {key: {} for key in USER_KEYS}
+        self._principals = {}
+
+    def remember(self, principal):
+        '''Keeps the verified token claims of the request's user, see common.authorization.'''
+        self._principals[principal.user_id] = principal
+
+    def get_principal(self, user_id: int):
+        return self._principals.get(user_id)
+
+    def prime(self, *values, key: str = 'id'):
+        '''Registers lookups which will be resolved together with the next load.'''
+        for value in values:
+            if value is not None and value not in self._loaded[key]:
+                self._pending[key].add(value)
+
+    def load(self, value, key: str = 'id') -> GetUser | None:
+        self.prime(value, key=key)
+        self._flush(key)
+        return self._loaded[key].get(value)
+
+    def load_many(self, values, key: str = 'id') -> list[GetUser | None]:
+        self.prime(*values, key=key)
+        self._flush(key)
+        return [self._loaded[key].get(value) for value in values]
+
+    def forget(self, user_id: int):
+        '''Drops a user from this loader and from the process cache after a write,
+        so the next load reads it from the database again.'''
+        user_cache.invalidate(user_id)
+        user = self._loaded['id'].pop(user_id, None)
+        if user:
+            for key in USER_KEYS[1:]:
+                self._loaded[key].pop(getattr(user, key), None)
+
+    def clear(self):
+        for key in USER_KEYS:
+            self._loaded[key].clear()
+
+    async def load_async(self, value, key: str = 'id') -> GetUser | None:
+        self.prime(value, key=key)
+        await self._flush_async(key)
+        return self._loaded[key].get(value)
+
+    async def load_many_async(self, values, key: str = 'id') -> list[GetUser | None]:
+        self.prime(*values, key=key)
+        await self._flush_async(key)
+        return [self._loaded[key].get(value) for value in values]
+
+    def _flush(self, key: str):
+        values, users, missing = self._take_pending(key)
+        if missing:
+            users += self._cache_rows(query.table('users').select('*').in_(key, list(missing)).execute().data)
+        self._store(key, values, users)
+
+    async def _flush_async(self, key: str):
+        values, users, missing = self._take_pending(key)
+        if missing:
+            response = await get_async_query().table('users').select('*').in_(key, list(missing)).execute()
+            users += self._cache_rows(response.data)
+        self._store(key, values, users)
+
+    def _take_pending(self, key: str) -> tuple[set, list[GetUser], set]:
+        values = self._pending[key]
+        self._pending[key] = set()
+
+        users = [user for user in (user_cache.get(value, key) for value in values) if user]
+        missing = values - {getattr(user, key) for user in users}
+        return values, users, missing
+
+    @staticmethod
+    def _cache_rows(rows: list[dict]) -> list[GetUser]:
+        users = [to_user(row) for row in rows]
+        for user in users:
+            user_cache.put(user)
+        return users
+
+    def _store(self, key: str, values: set, users: list[GetUser]):
+        for user in users:
+            for user_key in USER_KEYS:
+                self._loaded[user_key][getattr(user, user_key)] = user
+                self._pending[user_key].discard(getattr(user, user_key))
+
+        # remember misses too, so a second lookup of a missing user does not query again
+        for value in values:
+            self._loaded[key].setdefault(value, None)
+
+
+_request_loader: ContextVar[UserLoader | None] = ContextVar('user_loader', default=None)
+
+
+def get_user_loader() -> UserLoader:
+    '''Returns the loader of the current request. Outside a request (scheduler jobs, scripts)
+    every call gets a new loader, so nothing is memoized.'''
+    loader = _request_loader.get()
+    return loader if loader is not None else UserLoader()
+
+
+@contextmanager
+def user_loader_scope():
+    token = _request_loader.set(UserLoader())
+    try:
+        yield _request_loader.get()
+    finally:
+        _request_loader.reset(token)
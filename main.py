@@ -1,12 +1,16 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.security import HTTPAuthorizationCredentials
+from fastapi import FastAPI
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import status
 import uvicorn
-from common.authorization import verify_access_token
+from common.authorization import revocations
+from common.middleware import AuthMiddleware
+from data.async_connection import close_async_query
+from data.contact_writer import contact_writer
+from data.recipient_ranking import recipient_ranking
+from security.password_hashing import configure_password_hashing, password_hasher
+from services.recurring_transactions_services import start_recurring_scheduler, stop_recurring_scheduler
 from routers.cards import cards_router
 from routers.transactions import transaction_router
 from routers.recurring_transactoins import recurring_transaction_router
@@ -34,27 +38,47 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# added last, so it runs first
+app.add_middleware(AuthMiddleware)
 
-@app.middleware("http")
-async def add_token_to_request(request: Request, call_next):
-    token = request.cookies.get("access_token")
-    if token:
-        credentials_exception = HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-        try:
-            user_id = verify_access_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token),
-                                          credentials_exception)
-            request.state.user_id = user_id
-        except HTTPException:
-            request.state.user_id = None
-    else:
-        request.state.user_id = None
-
-    response = await call_next(request)
-    return response
+@app.on_event("startup")
+def start_scheduler():
+    start_recurring_scheduler()
+
+
+@app.on_event("startup")
+def calibrate_password_hashing():
+    configure_password_hashing()
+
+
+@app.on_event("shutdown")
+async def close_connection_pool():
+    await close_async_query()
+
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    stop_recurring_scheduler()
+
+
+@app.on_event("shutdown")
+def stop_token_revocations():
+    revocations.stop()
+
+
+@app.on_event("shutdown")
+def flush_contacts():
+    contact_writer.stop()
+
+
+@app.on_event("shutdown")
+def flush_recipient_ranking():
+    recipient_ranking.stop()
+
+
+@app.on_event("shutdown")
+def stop_password_hashing():
+    password_hasher.shutdown()
 
 
 if __name__ == "__main__":
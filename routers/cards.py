@@ -1,6 +1,6 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List
-from data.schemas import Card, CardCreate, CardUpdate
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+from data.helpers import CARD_NOT_FOUND_ERROR, make_etag, etag_matches
+from data.schemas import Card, CardCreate, CardUpdate, CardPage
 from services import cards_services
 from common.authorization import get_current_user
 
@@ -20,43 +20,44 @@ def create_card(card: CardCreate, user_id: int = Depends(get_current_user)):
 
 
 
-@cards_router.get("/", response_model=List[Card])
-def read_cards(user_id: int = Depends(get_current_user)):
-    try:
-        return cards_services.get_all_cards()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+@cards_router.get("/", response_model=CardPage)
+def read_cards(request: Request, response: Response,
+               cursor: str = Query(None, description='next_cursor of the previous page'),
+               limit: int = Query(cards_services.CARDS_PAGE_SIZE, ge=1, le=cards_services.MAX_CARDS_PAGE_SIZE),
+               user_id: int = Depends(get_current_user)):
+    '''The logged user's cards in pages of limit cards, pass next_cursor as cursor to get the next page,
+    next_cursor is null on the last page. Send the ETag of a page back in If-None-Match to get
+    304 Not Modified without the page when the cards have not changed.'''
+    cards, next_cursor = cards_services.get_user_cards(user_id, cursor, limit)
+    page = {'cards': cards, 'next_cursor': next_cursor}
+    etag = make_etag(page)
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return page
 
 
 @cards_router.get("/{card_id}", response_model=Card)
 def read_card(card_id: int, user_id: int = Depends(get_current_user)):
-    try:
-        card = cards_services.get_card_by_id(card_id)
-        if not card:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Card not found")
-        return card
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    card = cards_services.get_card_by_id(card_id, user_id)
+    if not card:
+        raise CARD_NOT_FOUND_ERROR
+    return card
 
 
 @cards_router.put("/{card_id}", response_model=Card)
 def update_card(card_id: int, card: CardUpdate, user_id: int = Depends(get_current_user)):
     card_data = card.dict(exclude_unset=True)
-    try:
-        updated_card = cards_services.update_card(card_id, card_data)
-        if not updated_card:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Card not found")
-        return updated_card
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    updated_card = cards_services.update_card(card_id, user_id, card_data)
+    if not updated_card:
+        raise CARD_NOT_FOUND_ERROR
+    return updated_card
 
 
 @cards_router.delete("/{card_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_card(card_id: int, user_id: int = Depends(get_current_user)):
-    try:
-        deleted_card = cards_services.delete_card(card_id)
-        if not deleted_card:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Card not found")
-        return {}
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    deleted_card = cards_services.delete_card(card_id, user_id)
+    if not deleted_card:
+        raise CARD_NOT_FOUND_ERROR
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,15 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from common.authorization import get_current_user
-from services.contacts_services import get_contacts_of_user, find_contact_by_attribute
+from services.contacts_services import get_contacts_of_user, find_contact_by_attribute, search_contacts, \
+    get_top_recipients, CONTACTS_PAGE_SIZE, MAX_CONTACTS_PAGE_SIZE, CONTACT_SEARCH_LIMIT, MAX_CONTACT_SEARCH_LIMIT, \
+    TOP_RECIPIENTS_LIMIT, MAX_TOP_RECIPIENTS_LIMIT
 
 router_contacts = APIRouter(prefix='/contacts')
 
 
 @router_contacts.get('/', tags=['Contacts'])
-def all_users_contacts(logged_user_id: int = Depends(get_current_user)): 
-    '''Retrieve contact details for a given user.'''
-    result = get_contacts_of_user(logged_user_id)
-    return result
+def all_users_contacts(logged_user_id: int = Depends(get_current_user),
+                       sort_by: str = Query('username', pattern='^(username|email|phone_number|id)$'),
+                       order: str = Query('asc', pattern='^(asc|desc)$'),
+                       cursor: str = Query(None, description='next_cursor of the previous page'),
+                       limit: int = Query(CONTACTS_PAGE_SIZE, ge=1, le=MAX_CONTACTS_PAGE_SIZE)):
+    '''Retrieve contact details for a given user.
+    Results are returned in pages of limit contacts, pass next_cursor as cursor to get the next page,
+    next_cursor is null on the last page.'''
+    contacts, next_cursor = get_contacts_of_user(logged_user_id, sort_by, order, cursor, limit)
+    return {'contacts': contacts, 'next_cursor': next_cursor}
+
+
+@router_contacts.get('/search', tags=['Contacts'])
+def search_users_contacts(q: str = Query(..., min_length=1, description='start, part or misspelling of a username, '
+                                                                        'email or phone number'),
+                          limit: int = Query(CONTACT_SEARCH_LIMIT, ge=1, le=MAX_CONTACT_SEARCH_LIMIT),
+                          logged_user_id: int = Depends(get_current_user)):
+    '''Type-ahead search of the user's contacts for the transfer form, best matches first.'''
+    return search_contacts(logged_user_id, q, limit)
+
+
+@router_contacts.get('/top', tags=['Contacts'])
+def top_recipients(limit: int = Query(TOP_RECIPIENTS_LIMIT, ge=1, le=MAX_TOP_RECIPIENTS_LIMIT),
+                   logged_user_id: int = Depends(get_current_user)):
+    '''The people the user pays most often and most recently, for the transfer form. score counts each payment,
+    halved for every 30 days since it was made.'''
+    return get_top_recipients(logged_user_id, limit)
 
 @router_contacts.get('/find', tags=['Contacts'])
 def find_contact(logged_user_id:int = Depends(get_current_user), search: str = 'phone_number, username, or email', value: str = ''):
@@ -1,7 +1,7 @@
 from fastapi.responses import HTMLResponse
 from fastapi import APIRouter, Request
 from fastapi.templating import Jinja2Templates
-from data.helpers import is_admin
+from data.helpers import is_admin_async
 
 home_router = APIRouter()
 
@@ -20,7 +20,7 @@ async def read_menu(request: Request):
     if not logged_user_id:
         return templates.TemplateResponse('error.html',
                                           {'request': request, 'error': 'Only registered users can see the menu!'})
-    if not is_admin(logged_user_id):
+    if not await is_admin_async(logged_user_id):
         return templates.TemplateResponse('users_menu.html', {'request': request})
 
     return templates.TemplateResponse('admins_menu.html', {'request': request})
@@ -1,9 +1,11 @@
 # routers/recurring_transactions.py
 from fastapi import APIRouter, Depends, HTTPException, Query
-from services.recurring_transactions_services import create_recurring_transaction, process_recurring_transaction, update_recurring_transaction, delete_recurring_transaction, get_all_recurring_transactions
+from services.recurring_transactions_services import create_recurring_transaction, process_recurring_transaction, update_recurring_transaction, delete_recurring_transaction, get_all_recurring_transactions, sweep_metrics, \
+    recurring_schedule, forecast_balance, DEFAULT_FORECAST_DAYS, MAX_FORECAST_DAYS
 from data.schemas import CreateRecurringTransaction, UpdateRecurringTransaction
 from common.authorization import get_current_user
 from data.connection import query
+from data.helpers import is_admin
 
 
 recurring_transaction_router = APIRouter(prefix='/recurring_transactions')
@@ -62,6 +64,53 @@ def process_recurring_transaction_endpoint(transaction_id: int, user_id: int = D
     process_recurring_transaction(transaction_id)
     return {'message': f"Recurring transaction {transaction_id} processed successfully"}
 
+@recurring_transaction_router.get('/metrics', tags=['Recurring Transactions'])
+def get_sweep_metrics(user_id: int = Depends(get_current_user)):
+    '''
+    Throughput and lag counters of the recurring transaction sweep, for admins.
+
+    Returns:
+    - dict: Sweeps, batches, paid and failed counts, duration and lag of the last sweep, and on the leader
+      the runs scheduled and how long loading them from the table took.
+    '''
+    if not is_admin(user_id):
+        raise HTTPException(status_code=403, detail="Only admins can see the sweep metrics")
+    return {**sweep_metrics.stats(), **recurring_schedule.load_stats()}
+
+@recurring_transaction_router.get('/forecast', tags=['Recurring Transactions'])
+def forecast_balance_endpoint(days: int = Query(DEFAULT_FORECAST_DAYS, ge=1, le=MAX_FORECAST_DAYS),
+                              user_id: int = Depends(get_current_user)):
+    '''
+    Projects the logged-in user's balance over the next days from their recurring transactions.
+
+    Parameters:
+    - days (int): How many days to project, up to five years.
+    - user_id (int): ID of the logged-in user.
+
+    Returns:
+    - BalanceForecast: The balance at the end of each day and the first date it goes negative, if any.
+    '''
+    return forecast_balance(user_id, days)
+
+
+@recurring_transaction_router.get('/forecast/{user_id}', tags=['Recurring Transactions'])
+def forecast_user_balance_endpoint(user_id: int, days: int = Query(DEFAULT_FORECAST_DAYS, ge=1, le=MAX_FORECAST_DAYS),
+                                   logged_user_id: int = Depends(get_current_user)):
+    '''
+    Projects a user's balance over the next days from their recurring transactions, for admins.
+
+    Parameters:
+    - user_id (int): ID of the user.
+    - days (int): How many days to project, up to five years.
+    - logged_user_id (int): ID of the logged-in admin.
+
+    Returns:
+    - BalanceForecast: The balance at the end of each day and the first date it goes negative, if any.
+    '''
+    if not is_admin(logged_user_id):
+        raise HTTPException(status_code=403, detail="Only admins can see the forecast of other users")
+    return forecast_balance(user_id, days)
+
 @recurring_transaction_router.put('/{recurring_transaction_id}', tags=['Recurring Transactions'])
 def update_recurring_transaction_endpoint(recurring_transaction_id: int, update_transaction: UpdateRecurringTransaction, user_id: int = Depends(get_current_user)):
     '''
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from services import transactions_services
 from common.authorization import get_current_user
 from typing import Optional, List
@@ -16,19 +17,37 @@ def get_logged_user_transactions(sort_by: Optional[str] = Query('created_at', pa
                                  order: Optional[str] = Query('desc', pattern='^(asc|desc)$'),
                                  transaction_type: str = Query(None, pattern='^(sent|received)$'),
                                  transaction_status: str = Query('all', pattern='^(confirmed|pending|declined|all)$'),
+                                 cursor: str = Query(None, description='next_cursor of the previous page'),
+                                 limit: int = Query(transactions_services.TRANSACTIONS_PAGE_SIZE, ge=1,
+                                                   le=transactions_services.MAX_PAGE_SIZE),
                                  sender_id: int = Depends(get_current_user)):
-    ''''This endpoint retrieves transactions associated with the logged-in user.
+    '''This endpoint retrieves transactions associated with the logged-in user.
     It allows filtering transactions based on parameters such as sorting criteria (sort_by),
     sorting order (order), transaction type (transaction_type),
     and transaction status (transaction_status).
     The default sorting criterion is created_at in descending order (desc).
     The transaction type can be specified as either sent or received, and the transaction status
     can be confirmed, pending, declined, or all.
+    Results are returned in pages of limit transactions, pass next_cursor as cursor to get the next page,
+    next_cursor is null on the last page.
     The endpoint ensures authentication by depending on the get_current_user
     dependency to retrieve the sender's ID.'''
-    transactions = transactions_services.get_logged_user_transactions(sender_id, transaction_type, sort_by, order,
-                                                                      transaction_status)
-    return transactions
+    transactions, next_cursor = transactions_services.get_logged_user_transactions(sender_id, transaction_type, sort_by,
+                                                                                   order, transaction_status, cursor,
+                                                                                   limit)
+    return {'transactions': transactions, 'next_cursor': next_cursor}
+
+
+@transaction_router.get('/export')
+def export_logged_user_transactions(export_format: str = Query('csv', pattern='^(csv|ndjson)$'),
+                                    transaction_type: str = Query(None, pattern='^(sent|received)$'),
+                                    start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                    category: Optional[str] = None, user_id: int = Depends(get_current_user)):
+    '''Downloads the logged-in user's transactions as CSV or NDJSON, oldest first.
+    The file is streamed while it is read from the database, so it works for any length of history.'''
+    chunks = transactions_services.export_user_transactions(user_id, export_format, transaction_type, start_date,
+                                                            end_date, category)
+    return _export_response(chunks, export_format, f'transactions_{user_id}')
 
 
 @transaction_router.post('/transaction')
@@ -48,6 +67,14 @@ def edit_category(transaction_id: int, category_name: str, logged_user_id: int =
     return result
 
 
+@transaction_router.get('/report/categories')
+def get_category_totals(start_date: Optional[date] = None, end_date: Optional[date] = None,
+                        category_name: Optional[str] = None, logged_user_id: int = Depends(get_current_user)):
+    '''Total, count, smallest and largest amount the logged-in user spent per category in the date range.'''
+    result = transactions_services.get_category_totals(logged_user_id, start_date, end_date, category_name)
+    return result
+
+
 @transaction_router.get('/{category_name}')
 def get_category_report(order: str, category_name: str, logged_user_id: int = Depends(get_current_user),
                         start_date: Optional[date] = None, end_date: Optional[date] = None):
@@ -121,19 +148,43 @@ def accept_transaction(transaction_id: int, acceptation: AcceptTransaction, user
 
 
 @transaction_router.get('/all/{user_id}')
-def get_all_transactions(user_id: int, logged_user_id: int = Depends(get_current_user), page: int = 1,
+def get_all_transactions(user_id: int, logged_user_id: int = Depends(get_current_user),
                          sent_or_received: str = None,
                          start_date: Optional[str] = None,
                          end_date: Optional[str] = None, direction: str = None,
-                         sort: str = Query(None, description="amount | created_at"), order: str = 'desc'):
-    '''Retrieves all transactions for a specified user.'''
-    result = transactions_services.get_all_transactions(user_id, logged_user_id, page, sent_or_received, start_date,
-                                                        end_date, direction, sort, order)
+                         sort: str = Query('created_at', pattern='^(amount|created_at)$'),
+                         order: str = Query('desc', pattern='^(asc|desc)$'),
+                         cursor: str = Query(None, description='next_cursor of the previous page'),
+                         page_size: int = Query(transactions_services.TRANSACTIONS_PAGE_SIZE, ge=1,
+                                                le=transactions_services.MAX_PAGE_SIZE),
+                         with_count: bool = False):
+    '''Retrieves all transactions for a specified user, one page at a time.
+    Pass next_cursor as cursor to get the next page, with_count adds an estimated total.'''
+    result = transactions_services.get_all_transactions(user_id, logged_user_id, sent_or_received, start_date,
+                                                        end_date, direction, sort, order, cursor, page_size,
+                                                        with_count)
     return result
 
 
+@transaction_router.get('/all/{user_id}/export')
+def export_all_transactions(user_id: int, logged_user_id: int = Depends(get_current_user),
+                            export_format: str = Query('csv', pattern='^(csv|ndjson)$'),
+                            sent_or_received: str = None, start_date: Optional[date] = None,
+                            end_date: Optional[date] = None, direction: str = None,
+                            category: Optional[str] = None):
+    '''Admin download of the transactions selected with the filters of /all/{user_id}, as CSV or NDJSON.'''
+    chunks = transactions_services.export_all_transactions(user_id, logged_user_id, export_format, sent_or_received,
+                                                           start_date, end_date, direction, category)
+    return _export_response(chunks, export_format, 'transactions')
+
+
 @transaction_router.put('/deny/{transaction_id}')
 def deny_transaction(transaction_id: int, logged_user_id: int = Depends(get_current_user)):
     '''Denies a transaction by the logged-in user.'''
     result = transactions_services.deny_transaction(transaction_id, logged_user_id)
     return result
+
+
+def _export_response(chunks, export_format: str, file_name: str) -> StreamingResponse:
+    return StreamingResponse(chunks, media_type=transactions_services.EXPORT_MEDIA_TYPES[export_format],
+                             headers={'Content-Disposition': f'attachment; filename="{file_name}.{export_format}"'})
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, status, Form
-from common.authorization import create_token, get_current_user, logout_user
+from common.authorization import create_token, create_user_token, get_current_user, logout_user
 from fastapi.requests import Request
 from fastapi import HTTPException
 from fastapi.responses import RedirectResponse, HTMLResponse, Response
@@ -7,7 +7,9 @@ from services import user_services
 from data.schemas import UserCreate, UserLogin, UpdateProfile, ConfirmUserRegistration, BlockOrUnblock
 from fastapi import Depends
 from fastapi.templating import Jinja2Templates
-from data.helpers import is_admin
+from data.helpers import is_admin, is_admin_async, find_user_by_id_async
+from fastapi.concurrency import run_in_threadpool
+from data.user_cache import user_cache
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import JSONResponse
 
@@ -23,11 +25,11 @@ async def get_account_balance(request: Request):
         return templates.TemplateResponse('error.html',
                                           {'request': request, 'error': 'Only registered users can see their balance!'})
 
-    elif is_admin(logged_user_id):
+    elif await is_admin_async(logged_user_id):
         return templates.TemplateResponse('error.html',
                                           {'request': request, 'error': 'Admins do not have balance!'})
 
-    balance_data = user_services.get_user_balance(logged_user_id)
+    balance_data = await user_services.get_user_balance_async(logged_user_id)
     balance = balance_data.balance
 
     return templates.TemplateResponse('get_account_balance.html', {'request': request, 'balance': balance})
@@ -54,7 +56,7 @@ async def register_form(request: Request):
 async def register(request: Request, username: str = Form(...), email: str = Form(...), password: str = Form(...),
                    phone_number: str = Form(...)):
     try:
-        new_user = user_services.create(username, password, email, phone_number)
+        new_user = await run_in_threadpool(user_services.create, username, password, email, phone_number)
         return templates.TemplateResponse("register.html",
                                           {"request": request, "success": "Registration successful! Please log in."})
     except HTTPException as e:
@@ -69,8 +71,9 @@ async def login_form(request: Request):
 @users_router.post('/login', status_code=status.HTTP_200_OK)
 async def login(request: Request, email: str = Form(...), password: str = Form(...)):
     try:
-        user = user_services.try_login(email, password)
-        access_token = create_token(data={"user_id": user.id})
+        user = await user_services.try_login_async(email, password)
+        # the user is already loaded by try_login_async, this does not query again
+        access_token = create_user_token(await find_user_by_id_async(user.id))
         response = RedirectResponse(url="/menu", status_code=status.HTTP_302_FOUND)
         response.set_cookie(key="access_token", value=access_token, httponly=True)
         return response
@@ -88,7 +91,7 @@ async def update_profile_form(request: Request):
     user_id = request.state.user_id
     if user_id is None:
         return templates.TemplateResponse("error.html", {"request": request, "error": "Not authenticated"})
-    user = user_services.get_logged_user(user_id)
+    user = await user_services.get_logged_user_async(user_id)
     return templates.TemplateResponse("update_profile.html", {"request": request, "user": user})
 
 
@@ -99,12 +102,12 @@ async def update_profile(request: Request, email: str = Form(...), password: str
     if user_id is None:
         return templates.TemplateResponse("error.html", {"request": request, "error": "Not authenticated"})
     try:
-        result = user_services.update_profile(password, email, phone_number, user_id)
+        result = await run_in_threadpool(user_services.update_profile, password, email, phone_number, user_id)
         return templates.TemplateResponse("update_profile.html",
                                           {"request": request, "success": "Profile updated successfully!",
                                            "user": {"email": email, "phone_number": phone_number}})
     except HTTPException as e:
-        user = user_services.get_logged_user(user_id)
+        user = await user_services.get_logged_user_async(user_id)
         return templates.TemplateResponse("update_profile.html", {"request": request, "error": e.detail, "user": user})
 
 
@@ -184,7 +187,7 @@ async def get_all_users(request: Request, page: int = 1, username: str = None, e
                         phone_number: str = None, registered: str = None):
     logged_user_id = request.state.user_id
 
-    if not logged_user_id or not is_admin(logged_user_id):
+    if not logged_user_id or not await is_admin_async(logged_user_id):
         return templates.TemplateResponse('error.html',
                                           {"request": request, "error": "Only admins can get all users information!"})
 
@@ -194,7 +197,8 @@ async def get_all_users(request: Request, page: int = 1, username: str = None, e
     elif registered == "false":
         registered_bool = False
 
-    result = user_services.get_all_users(logged_user_id, username, email, phone_number, registered_bool, page)
+    result = await user_services.get_all_users_async(logged_user_id, username, email, phone_number, registered_bool,
+                                                     page)
     return templates.TemplateResponse("all_users.html",
                                       {"request": request, "users": result, "page": page, "username": username,
                                        "email": email, "phone_number": phone_number, "registered": registered})
@@ -211,7 +215,7 @@ async def get_all_users(request: Request, page: int = 1, username: str = None, e
 @users_router.get('/confirm', response_class=HTMLResponse)
 async def confirm_user_registration_form(request: Request):
     user_id = request.state.user_id
-    if user_id is None or not is_admin(user_id):
+    if user_id is None or not await is_admin_async(user_id):
         return templates.TemplateResponse("error.html", {"request": request,
                                                          "error": "You must be an admin to confirm registrations"})
     return templates.TemplateResponse("confirm_user_registration.html", {"request": request})
@@ -220,12 +224,13 @@ async def confirm_user_registration_form(request: Request):
 @users_router.post('/confirm', status_code=status.HTTP_200_OK)
 async def confirm_user_registration(request: Request, email: str = Form(...)):
     user_id = request.state.user_id
-    if user_id is None or not is_admin(user_id):
+    if user_id is None or not await is_admin_async(user_id):
         return templates.TemplateResponse("error.html", {"request": request,
                                                          "error": "You must be an admin to confirm registrations"})
     try:
         confirmation = ConfirmUserRegistration(confirm=True)
-        result = user_services.confirm_user_registration(confirmation.confirm, email, user_id)
+        result = await run_in_threadpool(user_services.confirm_user_registration, confirmation.confirm, email,
+                                         user_id)
         return templates.TemplateResponse("confirm_user_registration.html",
                                           {"request": request, "success": "User registration confirmed successfully!"})
     except HTTPException as e:
@@ -251,12 +256,12 @@ def block_user_form(request: Request):
 @users_router.post('/block')
 async def block_user(request: Request, user_id: int = Form(...), block_status: str = Form(...)):
     logged_user_id = request.state.user_id
-    if not logged_user_id or not is_admin(logged_user_id):
+    if not logged_user_id or not await is_admin_async(logged_user_id):
         return templates.TemplateResponse('error.html',
                                           {'request': request, 'error': 'Only admins can block or unblock users!'})
     block_status_bool = block_status.lower() == 'true'
     try:
-        result = user_services.block_user(block_status_bool, user_id, logged_user_id)
+        result = await run_in_threadpool(user_services.block_user, block_status_bool, user_id, logged_user_id)
         return templates.TemplateResponse("block_user.html", {"request": request, "success": result})
     except Exception as e:
         return templates.TemplateResponse("block_user.html", {"request": request, "error": str(e)})
@@ -268,6 +273,16 @@ async def block_user(request: Request, user_id: int = Form(...), block_status: s
 #     return result
 
 
+@users_router.get('/cache')
+def get_user_cache_stats(request: Request):
+    '''Hit, miss and eviction counters of the process-local user cache, used to size it.'''
+    logged_user_id = request.state.user_id
+    if not logged_user_id or not is_admin(logged_user_id):
+        return templates.TemplateResponse('error.html',
+                                          {'request': request, 'error': 'Only admins can see the user cache stats!'})
+    return user_cache.stats()
+
+
 @users_router.get('/logout', response_class=HTMLResponse)
 def show_logout_form(request: Request):
     return templates.TemplateResponse('logout.html', {'request': request, 'user_id': request.state.user_id})
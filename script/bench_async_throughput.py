@@ -0,0 +1,87 @@
+'''Concurrent-request throughput of the balance page before and after the async data-access layer.
+
+PostgREST is replaced by an httpx MockTransport which answers every request after --latency-ms, so the
+numbers show how many requests one worker's event loop serves while queries are in flight.
+"before" calls the synchronous service from a coroutine, like the async routes used to,
+"after" awaits the async variant on the shared async client.
+
+    python -m script.bench_async_throughput --requests 200 --latency-ms 20
+'''
+import argparse
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+import httpx
+from postgrest import AsyncPostgrestClient, SyncPostgrestClient
+
+from data.user_cache import UserCache
+from data.user_loader import user_loader_scope
+from services import user_services
+
+USER = {'id': 1, 'username': 'bench', 'password': 'x', 'email': 'bench@bench.com', 'phone_number': '1234567890',
+        'is_admin': False, 'created_at': '2024-06-01T00:00:00+00:00', 'amount': 100.0, 'is_registered': True,
+        'is_blocked': False}
+BASE_URL = 'http://postgrest.local/rest/v1'
+
+
+def run(name: str, handle_request, requests: int):
+    async def one_request():
+        with user_loader_scope():
+            return await handle_request()
+
+    async def all_requests():
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(requests)))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(all_requests())
+    print(f'{name:<7} {requests} concurrent requests in {elapsed:6.2f} s -> {requests / elapsed:8.1f} req/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+
+    def sync_postgrest(request: httpx.Request) -> httpx.Response:
+        time.sleep(latency)
+        return httpx.Response(200, content=json.dumps([USER]), headers={'Content-Type': 'application/json'})
+
+    async def async_postgrest(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        return httpx.Response(200, content=json.dumps([USER]), headers={'Content-Type': 'application/json'})
+
+    sync_query = SyncPostgrestClient(BASE_URL)
+    sync_query.session = httpx.Client(base_url=BASE_URL, transport=httpx.MockTransport(sync_postgrest))
+
+    async def before():
+        return user_services.get_user_balance(1)
+
+    async def after():
+        # the async client has to be created inside the running loop
+        return await user_services.get_user_balance_async(1)
+
+    # every request must reach PostgREST, the user cache would hide the difference
+    with patch('data.user_loader.user_cache', UserCache(max_size=0)), patch('data.user_loader.query', sync_query):
+        run('before', before, args.requests)
+
+        async_query = None
+
+        def get_async_query():
+            nonlocal async_query
+            if async_query is None:
+                async_query = AsyncPostgrestClient(BASE_URL)
+                async_query.session = httpx.AsyncClient(base_url=BASE_URL,
+                                                        transport=httpx.MockTransport(async_postgrest))
+            return async_query
+
+        with patch('data.user_loader.get_async_query', get_async_query):
+            run('after', after, args.requests)
+
+
+if __name__ == '__main__':
+    main()
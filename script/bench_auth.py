@@ -0,0 +1,79 @@
+'''Per-request cost of token verification.
+
+"verify" times verify_access_token with an empty token cache (a jose decode on every call) and with the cache.
+"requests" sends requests through the app in-process, a static file and an admin route which is called with the
+token both as bearer header and cookie, and counts the jose decodes per request. With the cache off every request
+to the route still decodes once, the middleware and get_current_user share that one verification.
+
+    python -m script.bench_auth --calls 20000 --requests 2000
+'''
+import argparse
+import asyncio
+import logging
+import time
+from unittest.mock import patch
+
+import httpx
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwt
+
+import common.authorization
+from common.authorization import TokenCache, create_user_token, verify_access_token, CREDENTIALS_EXCEPTION
+from data.schemas import GetUser
+
+ADMIN = GetUser(id=1, username='bench', password='x', email='bench@bench.com', phone_number='1234567890',
+                is_admin=True, amount=0.0, is_registered=True, is_blocked=False)
+
+
+def bench_verify(calls: int):
+    credentials = HTTPAuthorizationCredentials(scheme='Bearer', credentials=create_user_token(ADMIN))
+    for name, cache_size in (('uncached', 0), ('cached', 1000)):
+        with patch.object(common.authorization, 'verified_tokens', TokenCache(cache_size)):
+            started = time.perf_counter()
+            for _ in range(calls):
+                verify_access_token(credentials, CREDENTIALS_EXCEPTION)
+            elapsed = time.perf_counter() - started
+        print(f'verify    {name:<9} {elapsed / calls * 1e6:8.2f} us/call')
+
+
+def bench_requests(requests: int):
+    from main import app
+    # the services log every request at debug level
+    logging.getLogger().setLevel(logging.WARNING)
+    token = create_user_token(ADMIN)
+    paths = {'static': ('/static/styles.css', {}),
+             'route': ('/recurring_transactions/metrics', {'Authorization': f'Bearer {token}'})}
+
+    async def run(client: httpx.AsyncClient, path: str, headers: dict) -> tuple[float, int]:
+        await client.get(path, headers=headers)
+        with patch('common.authorization.jwt.decode', side_effect=jwt.decode) as decode:
+            started = time.perf_counter()
+            for _ in range(requests):
+                assert (await client.get(path, headers=headers)).status_code == 200
+            return time.perf_counter() - started, decode.call_count
+
+    async def run_all():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench',
+                                     cookies={'access_token': token}) as client:
+            for name, cache_size in (('uncached', 0), ('cached', 1000)):
+                with patch.object(common.authorization, 'verified_tokens', TokenCache(cache_size)):
+                    for kind, (path, headers) in paths.items():
+                        elapsed, decodes = await run(client, path, headers)
+                        print(f'requests  {name:<9} {kind:<7} {elapsed / requests * 1e6:8.1f} us/request  '
+                              f'decodes/request: {decodes / requests:.2f}')
+
+    asyncio.run(run_all())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20_000)
+    parser.add_argument('--requests', type=int, default=2_000)
+    args = parser.parse_args()
+
+    bench_verify(args.calls)
+    bench_requests(args.requests)
+
+
+if __name__ == '__main__':
+    main()
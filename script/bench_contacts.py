@@ -0,0 +1,63 @@
+'''Contact listing latency against the number of contacts.
+
+Compares the old listing, one users query per contact, with the batched one (one contacts query and one users
+query per RESOLVE_BATCH_SIZE contacts) cold and served from the contact cache. Runs against the SQLite stand-in
+(data/local_client.py) with an artificial network latency per round trip.
+
+    python -m script.bench_contacts --contacts 10 100 500 1000 --latency-ms 5
+'''
+import argparse
+import time
+from unittest.mock import patch
+
+from data.contact_cache import ContactCache
+from data.local_client import LocalClient
+from services import contacts_services
+
+
+def legacy_contacts(query, user_id: int) -> list[dict]:
+    '''The listing before the batched resolution: one users query per contact.'''
+    contacts = query.table('contacts').select('*').eq('current_user', user_id).execute().data
+    return [query.table('users').select('username', 'email', 'phone_number').eq('id', contact['contact_name_id'])
+            .execute().data[0] for contact in contacts]
+
+
+def seed(contacts: int, latency: float) -> LocalClient:
+    client = LocalClient()
+    client.table('users').insert([{'username': f'user{number}', 'password': 'x', 'email': f'{number}@bench',
+                                   'phone_number': f'{number:010d}'} for number in range(contacts + 1)]).execute()
+    client.table('contacts').insert([{'current_user': 1, 'contact_name_id': contact_id}
+                                     for contact_id in range(2, contacts + 2)]).execute()
+    client.latency = latency
+    return client
+
+
+def timed(function) -> tuple[float, int]:
+    client = contacts_services.query
+    client.round_trips = 0
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started, client.round_trips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--contacts', type=int, nargs='+', default=[10, 100, 500, 1000])
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f'{"contacts":>8} {"path":<10} {"latency":>12} {"round trips":>12}')
+    for contacts in args.contacts:
+        client = seed(contacts, args.latency_ms / 1000)
+        with patch.object(contacts_services, 'query', client), \
+                patch.object(contacts_services, 'contact_cache', ContactCache()):
+            paths = (('n+1', lambda: legacy_contacts(client, 1)),
+                     ('batched', lambda: contacts_services.get_contacts_of_user(1)),
+                     ('cached', lambda: contacts_services.get_contacts_of_user(1)))
+            for name, function in paths:
+                elapsed, round_trips = timed(function)
+                print(f'{contacts:>8} {name:<10} {elapsed * 1e3:9.2f} ms {round_trips:>12}')
+
+
+if __name__ == '__main__':
+    main()
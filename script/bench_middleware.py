@@ -0,0 +1,96 @@
+'''Load test of the auth middleware: the pure ASGI AuthMiddleware against the @app.middleware("http") function
+it replaced (kept below as legacy_auth, run the same way through BaseHTTPMiddleware).
+
+Requests are sent in-process by a number of concurrent clients to an admin route, the OpenAPI JSON and a static
+file (the last two are public paths, which both stacks pass straight through), and requests/sec and p99 latency are
+reported per stack.
+
+    python -m script.bench_middleware --requests 4000 --concurrency 32
+'''
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+import httpx
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+from common.authorization import authenticate, create_user_token, request_token, is_public_path
+from common.middleware import AuthMiddleware
+from data.schemas import GetUser
+from data.user_loader import user_loader_scope
+
+ADMIN = GetUser(id=1, username='bench', password='x', email='bench@bench.com', phone_number='1234567890',
+                is_admin=True, amount=0.0, is_registered=True, is_blocked=False)
+
+
+async def legacy_auth(request: Request, call_next):
+    '''The decorator middleware as it was, without the claims refresh which the benchmark never hits.'''
+    if is_public_path(request.url.path):
+        return await call_next(request)
+    token = request_token(request)
+    principal = authenticate(token)
+    with user_loader_scope() as user_loader:
+        if principal:
+            user_loader.remember(principal)
+            user_loader.prime(principal.user_id)
+        request.state.auth_token = token
+        request.state.principal = principal
+        request.state.user_id = principal.user_id if principal else None
+        return await call_next(request)
+
+
+def use_stack(app, auth: Middleware):
+    app.user_middleware = [middleware for middleware in app.user_middleware
+                           if middleware.cls not in (AuthMiddleware, BaseHTTPMiddleware)]
+    app.user_middleware.insert(0, auth)
+    # rebuilt on the next request
+    app.middleware_stack = None
+
+
+async def load(app, path: str, headers: dict, requests: int, concurrency: int) -> tuple[float, float]:
+    latencies = []
+
+    async def worker(client: httpx.AsyncClient, count: int):
+        for _ in range(count):
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        await client.get(path, headers=headers)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client, requests // concurrency) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, statistics.quantiles(latencies, n=100)[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=4_000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    from main import app
+    # the services log every request at debug level
+    logging.getLogger().setLevel(logging.WARNING)
+    headers = {'Authorization': f'Bearer {create_user_token(ADMIN)}'}
+    paths = {'route': ('/recurring_transactions/metrics', headers),
+             'openapi': ('/openapi.json', {}),
+             'static': ('/static/styles.css', {})}
+    stacks = {'decorator': Middleware(BaseHTTPMiddleware, dispatch=legacy_auth),
+              'asgi': Middleware(AuthMiddleware)}
+
+    for kind, (path, path_headers) in paths.items():
+        for name, auth in stacks.items():
+            use_stack(app, auth)
+            rate, p99 = asyncio.run(load(app, path, path_headers, args.requests, args.concurrency))
+            print(f'{kind:<8} {name:<10} {rate:9.0f} req/s   p99 {p99 * 1e3:7.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+'''Compares the old read-modify-write transfer path with the single move_money procedure call.
+
+Both paths run against the SQLite stand-in (data/local_client.py) with an artificial network latency per
+round trip, so the numbers show what the extra PostgREST calls cost and how many updates get lost when
+concurrent requests hit the same account.
+
+    python -m script.bench_money_movement --transfers 400 --workers 16 --latency-ms 5
+'''
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+from data.local_client import LocalClient
+from services import transactions_services
+
+START_BALANCE = 1_000_000.0
+AMOUNT = 1.0
+
+
+def legacy_transfer(query, sender_id: int, receiver_id: int, amount: float, category: str):
+    '''The transfer path before move_money: two user reads, balance update, contact lookup and two inserts.'''
+    sender = query.table('users').select('*').eq('id', sender_id).execute().data[0]
+    query.table('users').select('*').eq('id', receiver_id).execute()
+    query.table('users').update({'amount': sender['amount'] - amount}).eq('id', sender_id).execute()
+    existing_contact = query.table('contacts').select('*').eq('current_user', sender_id) \
+        .eq('contact_name_id', receiver_id).execute()
+    query.table('transactions').insert({'sender_id': sender_id, 'receiver_id': receiver_id, 'amount': amount,
+                                        'status': 'pending', 'category': category}).execute()
+    if not existing_contact.data:
+        query.table('contacts').insert({'current_user': sender_id, 'contact_name_id': receiver_id}).execute()
+
+
+def procedure_transfer(query, sender_id: int, receiver_id: int, amount: float, category: str):
+    transactions_services.transfer_money(sender_id, receiver_id, amount, category)
+
+
+def run(name: str, transfer, transfers: int, workers: int, latency: float):
+    client = LocalClient(latency=latency)
+    client.table('users').insert([
+        {'username': 'sender', 'password': 'x', 'email': 's@bench', 'phone_number': '1111111111',
+         'amount': START_BALANCE},
+        {'username': 'receiver', 'password': 'x', 'email': 'r@bench', 'phone_number': '2222222222'},
+    ]).execute()
+    client.round_trips = 0
+
+    def timed(_):
+        started = time.perf_counter()
+        try:
+            transfer(client, 1, 2, AMOUNT, 'bench')
+        except HTTPException:
+            pass
+        return time.perf_counter() - started
+
+    with patch.object(transactions_services, 'query', client):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            latencies = sorted(pool.map(timed, range(transfers)))
+        elapsed = time.perf_counter() - started
+    round_trips = client.round_trips
+
+    balance = client.table('users').select('amount').eq('id', 1).execute().data[0]['amount']
+    written = len(client.table('transactions').select('id').execute().data)
+    lost_updates = round((balance - (START_BALANCE - written * AMOUNT)) / AMOUNT)
+
+    print(f'{name:<10} round trips/transfer: {round_trips / transfers:5.2f}  '
+          f'p50: {statistics.median(latencies) * 1000:7.2f} ms  '
+          f'p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.2f} ms  '
+          f'throughput: {transfers / elapsed:8.1f}/s  lost updates: {lost_updates}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transfers', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    for name, transfer in (('legacy', legacy_transfer), ('move_money', procedure_transfer)):
+        run(name, transfer, args.transfers, args.workers, args.latency_ms / 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''Login throughput of the password hashing pool.
+
+Calibrates the scrypt cost like the app does at startup (or takes --rounds), then verifies --logins passwords
+through verify_and_update_async from --concurrency concurrent logins and reports logins/sec, logins/sec per core
+and p99 latency. While the logins run, a ticker on the event loop measures how late it is woken up, which stays
+small because the hashing runs on the pool. The first run admits every login, the second one uses the default
+PASSWORD_HASH_MAX_PENDING and shows admission control turning away the logins that do not fit.
+
+    python -m script.bench_password_hashing --logins 200 --concurrency 16
+'''
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from fastapi import HTTPException
+
+import security.password_hashing
+from security.password_hashing import PasswordHasher, configure_password_hashing, pwd_context, \
+    verify_and_update_async, PASSWORD_HASH_WORKERS
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - started - 0.005)
+
+
+async def run_logins(hashed: str, logins: int, concurrency: int) -> tuple[float, list, int, list]:
+    latencies, lags, rejected = [], [], 0
+
+    async def login():
+        nonlocal rejected
+        started = time.perf_counter()
+        try:
+            verified, _ = await verify_and_update_async('Password1!', hashed)
+            assert verified
+            latencies.append(time.perf_counter() - started)
+        except HTTPException:
+            rejected += 1
+
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(stop, lags))
+    started = time.perf_counter()
+    for first in range(0, logins, concurrency):
+        await asyncio.gather(*(login() for _ in range(min(concurrency, logins - first))))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    return elapsed, latencies, rejected, lags
+
+
+def report(name: str, elapsed: float, latencies: list, rejected: int, lags: list, cores: int):
+    rate = len(latencies) / elapsed
+    p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+    print(f'{name:<14} {rate:8.1f} logins/s  {rate / cores:8.1f} logins/s/core  p99 {p99 * 1e3:7.1f} ms  '
+          f'rejected {rejected:4d}  loop lag max {max(lags, default=0) * 1e3:5.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=0, help='scrypt rounds, calibrated when 0')
+    args = parser.parse_args()
+
+    if args.rounds:
+        pwd_context.update(scrypt__rounds=args.rounds, scrypt__min_rounds=args.rounds)
+        rounds = args.rounds
+    else:
+        rounds = configure_password_hashing()
+    hashed = pwd_context.hash('Password1!')
+    cores = min(PASSWORD_HASH_WORKERS, os.cpu_count() or 1)
+    print(f'scrypt rounds {rounds}, {PASSWORD_HASH_WORKERS} hashing threads, {os.cpu_count()} cores')
+
+    for name, hasher in (('all admitted', PasswordHasher(max_pending=args.concurrency)),
+                         ('max pending', PasswordHasher())):
+        security.password_hashing.password_hasher = hasher
+        report(name, *asyncio.run(run_logins(hashed, args.logins, args.concurrency)), cores)
+
+
+if __name__ == '__main__':
+    main()
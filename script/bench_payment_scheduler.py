@@ -0,0 +1,107 @@
+'''Memory and dispatch throughput of the recurring payment heap against one APScheduler date job per payment.
+
+Memory is traced with tracemalloc while --schedules runs are pending and reported per million runs.
+APScheduler jobs are much larger, so only --apscheduler-jobs of them are added to a memory job store
+and the result is scaled to a million.
+Dispatch throughput is how many due ids per second the scheduler thread hands to a no-op executor.
+
+    python -m script.bench_payment_scheduler --schedules 1000000 --apscheduler-jobs 20000
+'''
+import argparse
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from data.payment_scheduler import PaymentScheduler
+
+MILLION = 1_000_000
+
+
+def noop(*args):
+    pass
+
+
+def traced(build):
+    '''Returns what build returns and the bytes it left allocated.'''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def heap_memory(schedules: int):
+    start = time.time() + 3600
+
+    def build():
+        payments = PaymentScheduler(noop)
+        payments.schedule_many((recurring_id, start + recurring_id) for recurring_id in range(1, schedules + 1))
+        return payments
+
+    started = time.perf_counter()
+    _, size = traced(build)
+    elapsed = time.perf_counter() - started
+    print(f'heap         {size / schedules * MILLION / 2 ** 20:8.1f} MiB per million runs  '
+          f'({size / schedules:5.0f} B/run, loaded {schedules / elapsed:10.0f} runs/s)')
+
+
+def apscheduler_memory(jobs: int):
+    scheduler = BackgroundScheduler()
+    # a paused scheduler stores jobs without running them
+    scheduler.start(paused=True)
+    start = datetime.now() + timedelta(hours=1)
+
+    def build():
+        for recurring_id in range(1, jobs + 1):
+            scheduler.add_job(noop, 'date', run_date=start + timedelta(seconds=recurring_id), args=(recurring_id,),
+                              id=str(recurring_id))
+
+    started = time.perf_counter()
+    _, size = traced(build)
+    elapsed = time.perf_counter() - started
+    scheduler.shutdown(wait=False)
+    print(f'apscheduler  {size / jobs * MILLION / 2 ** 20:8.1f} MiB per million runs  '
+          f'({size / jobs:5.0f} B/run, added  {jobs / elapsed:10.0f} runs/s)')
+
+
+def dispatch_throughput(schedules: int, batch_size: int):
+    dispatched = 0
+    done = threading.Event()
+
+    def execute(ids):
+        nonlocal dispatched
+        dispatched += len(ids)
+        if dispatched == schedules:
+            done.set()
+
+    # every run is due, the thread drains the heap as fast as it can
+    payments = PaymentScheduler(execute, batch_size=batch_size)
+    now = time.time()
+    payments.schedule_many((recurring_id, now - schedules + recurring_id) for recurring_id in range(schedules))
+
+    started = time.perf_counter()
+    payments.start()
+    done.wait()
+    elapsed = time.perf_counter() - started
+    payments.stop()
+    print(f'dispatch     {schedules / elapsed:10.0f} ids/s in batches of {batch_size}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schedules', type=int, default=MILLION)
+    parser.add_argument('--apscheduler-jobs', type=int, default=20_000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    heap_memory(args.schedules)
+    apscheduler_memory(args.apscheduler_jobs)
+    dispatch_throughput(args.schedules, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
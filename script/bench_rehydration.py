@@ -0,0 +1,67 @@
+'''Time to rebuild the recurring payment schedule when a worker becomes the leader.
+
+Fills a local SQLite database with --schedules approved recurring transactions and loads them the way the leader
+does: load_recurring_schedule reads the table in keyset pages of SCHEDULE_LOAD_PAGE_SIZE and the scheduler thread
+adds them to its heap LOAD_CHUNK_SIZE at a time. --latency adds a delay per query, like a remote database.
+Also reports how long the calling thread (the leader elector) is held, which must stay well below the lease TTL.
+
+    python -m script.bench_rehydration --schedules 100000 --latency 0.02
+'''
+import argparse
+import logging
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from data.local_client import LocalClient
+from data.payment_scheduler import PaymentScheduler
+from services import recurring_transactions_services
+from services.recurring_transactions_services import load_recurring_schedule, SCHEDULE_LOAD_PAGE_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schedules', type=int, default=100_000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every query')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    client = LocalClient()
+    start = datetime.now() + timedelta(days=1)
+    client.table('recurring_transactions').insert([
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 10, 'recurring_time': 'daily',
+         'next_run_time': (start + timedelta(seconds=i)).isoformat()} for i in range(args.schedules)
+    ]).execute()
+    client.latency = args.latency
+    client.round_trips = 0
+
+    read = threading.Event()
+
+    def load():
+        yield from load_recurring_schedule()
+        read.set()
+
+    # nothing is due, the thread only loads
+    payments = PaymentScheduler(lambda ids: None)
+    with patch.object(recurring_transactions_services, 'query', client):
+        tracemalloc.start()
+        started = time.perf_counter()
+        payments.start(load=load)
+        held = time.perf_counter() - started
+        read.wait()
+        # stop lets the thread add the last chunk
+        payments.stop()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    print(f'loaded       {payments.loaded} runs in {payments.load_seconds:6.2f} s '
+          f'({payments.loaded / max(payments.load_seconds, 1e-9):8.0f} runs/s, {client.round_trips} queries of '
+          f'{SCHEDULE_LOAD_PAGE_SIZE} rows)')
+    print(f'heap         {memory / 2 ** 20:6.1f} MiB')
+    print(f'caller held  {held * 1000:6.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
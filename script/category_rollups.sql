@@ -0,0 +1,82 @@
+-- Per-user, per-category, per-day spending rollups, read by the category totals report.
+-- A trigger on transactions keeps them current for every write: transfers, deposits and withdrawals
+-- (move_money), edit_category and recurring transactions, in the same database transaction as the write.
+-- Spending is counted for the sender, like get_category_report. Transactions without a category are kept
+-- under ''. data/local_client.py has the SQLite version used in tests.
+
+CREATE TABLE IF NOT EXISTS category_rollups (
+    user_id bigint NOT NULL,
+    category text NOT NULL,
+    day date NOT NULL,
+    total double precision NOT NULL,
+    count integer NOT NULL,
+    min_amount double precision NOT NULL,
+    max_amount double precision NOT NULL,
+    PRIMARY KEY (user_id, category, day)
+);
+
+
+CREATE OR REPLACE FUNCTION add_to_category_rollup(p_user_id bigint, p_category text, p_day date,
+                                                  p_amount double precision) RETURNS void
+LANGUAGE sql
+AS $$
+    INSERT INTO category_rollups (user_id, category, day, total, count, min_amount, max_amount)
+    VALUES (p_user_id, p_category, p_day, p_amount, 1, p_amount, p_amount)
+    ON CONFLICT (user_id, category, day) DO UPDATE
+        SET total = category_rollups.total + EXCLUDED.total,
+            count = category_rollups.count + 1,
+            min_amount = LEAST(category_rollups.min_amount, EXCLUDED.min_amount),
+            max_amount = GREATEST(category_rollups.max_amount, EXCLUDED.max_amount);
+$$;
+
+
+CREATE OR REPLACE FUNCTION remove_from_category_rollup(p_user_id bigint, p_category text, p_day date,
+                                                       p_amount double precision) RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE category_rollups SET total = total - p_amount, count = count - 1
+    WHERE user_id = p_user_id AND category = p_category AND day = p_day;
+
+    DELETE FROM category_rollups
+    WHERE user_id = p_user_id AND category = p_category AND day = p_day AND count <= 0;
+
+    -- min and max cannot be taken back, they are recomputed from the day's remaining transactions
+    UPDATE category_rollups r
+    SET min_amount = d.min_amount, max_amount = d.max_amount
+    FROM (SELECT min(amount) AS min_amount, max(amount) AS max_amount
+          FROM transactions
+          WHERE sender_id = p_user_id AND COALESCE(category, '') = p_category
+            AND created_at >= p_day AND created_at < p_day + 1) d
+    WHERE r.user_id = p_user_id AND r.category = p_category AND r.day = p_day;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION maintain_category_rollups() RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM remove_from_category_rollup(OLD.sender_id, COALESCE(OLD.category, ''), OLD.created_at::date,
+                                            OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM add_to_category_rollup(NEW.sender_id, COALESCE(NEW.category, ''), NEW.created_at::date, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS category_rollups ON transactions;
+CREATE TRIGGER category_rollups
+AFTER INSERT OR DELETE OR UPDATE OF sender_id, category, amount, created_at ON transactions
+FOR EACH ROW EXECUTE FUNCTION maintain_category_rollups();
+
+
+-- backfill the existing history once
+INSERT INTO category_rollups (user_id, category, day, total, count, min_amount, max_amount)
+SELECT sender_id, COALESCE(category, ''), created_at::date, sum(amount), count(*), min(amount), max(amount)
+FROM transactions
+GROUP BY sender_id, COALESCE(category, ''), created_at::date
+ON CONFLICT (user_id, category, day) DO NOTHING;
@@ -0,0 +1,12 @@
+-- One contacts row per (current_user, contact_name_id) pair.
+-- Transfers queue the receiver as a contact of the sender, data/contact_writer.py writes the queue in batches with
+-- an upsert on this constraint that skips the pairs already there (on_conflict=current_user,contact_name_id).
+-- Run once: it deletes the duplicate rows older versions of transfer_money inserted, keeping the first of each
+-- pair, then adds the constraint. data/local_client.py creates the same index in SQLite.
+
+DELETE FROM contacts c
+USING contacts first
+WHERE c."current_user" = first."current_user" AND c.contact_name_id = first.contact_name_id AND c.id > first.id;
+
+ALTER TABLE contacts DROP CONSTRAINT IF EXISTS contacts_pair;
+ALTER TABLE contacts ADD CONSTRAINT contacts_pair UNIQUE ("current_user", contact_name_id);
@@ -0,0 +1,12 @@
+-- Indexes for the keyset-paginated queries, run once in the Supabase SQL editor.
+
+-- transaction history of a user, see get_logged_user_transactions
+CREATE INDEX IF NOT EXISTS transactions_sender_created_at ON transactions (sender_id, created_at, id);
+CREATE INDEX IF NOT EXISTS transactions_receiver_created_at ON transactions (receiver_id, created_at, id);
+
+-- admin browsing of all transactions, see get_all_transactions
+CREATE INDEX IF NOT EXISTS transactions_created_at ON transactions (created_at, id);
+CREATE INDEX IF NOT EXISTS transactions_amount ON transactions (amount, id);
+
+-- cards of a user, see get_user_cards; also checks the owner of a card looked up by id
+CREATE INDEX IF NOT EXISTS cards_user_id ON cards (user_id, id);
@@ -0,0 +1,29 @@
+-- Leases for leader election, see data/leader_election.py (LEADER_ELECTION=database).
+-- acquire_lease gives the lease to p_holder if it is free, expired or already theirs, and pushes its expiry
+-- p_ttl_seconds from now. It returns true when p_holder holds the lease, null otherwise.
+-- data/local_client.py has the SQLite version used in tests.
+
+CREATE TABLE IF NOT EXISTS leader_leases (
+    name text PRIMARY KEY,
+    holder text NOT NULL,
+    expires_at timestamptz NOT NULL
+);
+
+
+CREATE OR REPLACE FUNCTION acquire_lease(p_name text, p_holder text, p_ttl_seconds integer) RETURNS boolean
+LANGUAGE sql
+AS $$
+    INSERT INTO leader_leases (name, holder, expires_at)
+    VALUES (p_name, p_holder, now() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (name) DO UPDATE
+        SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+        WHERE leader_leases.holder = EXCLUDED.holder OR leader_leases.expires_at < now()
+    RETURNING true;
+$$;
+
+
+CREATE OR REPLACE FUNCTION release_lease(p_name text, p_holder text) RETURNS void
+LANGUAGE sql
+AS $$
+    DELETE FROM leader_leases WHERE name = p_name AND holder = p_holder;
+$$;
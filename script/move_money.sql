@@ -0,0 +1,152 @@
+-- Money movement procedure, called from the services with query.rpc('move_money', {...}).
+-- It validates, debits, credits and writes the transaction row in one database transaction, so every
+-- transfer / deposit / withdraw / confirm / accept is a single round trip and two requests hitting the same
+-- account cannot overwrite each other's balance (rows are locked with FOR UPDATE in id order).
+-- Validation errors are returned as {"error", "status", "detail"} instead of raised, so the API can map them
+-- to the same HTTPException as before. data/local_client.py has the SQLite version used in tests.
+-- A transfer no longer adds the receiver to the sender's contacts here, data/contact_writer.py writes them in
+-- batches after the transfer (script/contacts_unique.sql).
+
+CREATE OR REPLACE FUNCTION move_money(
+    p_operation text,
+    p_user_id bigint,
+    p_counterparty_id bigint DEFAULT NULL,
+    p_amount double precision DEFAULT NULL,
+    p_category text DEFAULT NULL,
+    p_transaction_id bigint DEFAULT NULL,
+    p_action text DEFAULT NULL
+) RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_user users%ROWTYPE;
+    v_other users%ROWTYPE;
+    v_transaction transactions%ROWTYPE;
+    v_new_balance double precision;
+    v_counterparty_id bigint := p_counterparty_id;
+BEGIN
+    IF p_operation = 'accept' AND p_action = 'decline' THEN
+        -- declining gives the money back to the sender, the receiver does not pass it; a transaction's sender
+        -- never changes, so it is read before the accounts are locked
+        SELECT sender_id INTO v_counterparty_id FROM transactions WHERE id = p_transaction_id;
+    END IF;
+    -- lock every account this call can touch, always in id order to avoid deadlocks
+    PERFORM 1 FROM users WHERE id IN (p_user_id, v_counterparty_id) ORDER BY id FOR UPDATE;
+
+    SELECT * INTO v_user FROM users WHERE id = p_user_id;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('error', 'user_not_found', 'status', 404, 'detail',
+            CASE WHEN p_operation = 'transfer' THEN format('Sender with id: %s not found!', p_user_id)
+                 ELSE 'User with this id not found!' END);
+    END IF;
+    IF v_user.is_admin THEN
+        RETURN jsonb_build_object('error', 'admin', 'status', 403, 'detail', 'Admin cannot do this!');
+    END IF;
+
+    IF p_operation = 'transfer' THEN
+        IF v_user.is_blocked THEN
+            RETURN jsonb_build_object('error', 'blocked', 'status', 403,
+                                      'detail', 'You are blocked! You cannot make transactions!');
+        END IF;
+        SELECT * INTO v_other FROM users WHERE id = p_counterparty_id;
+        IF NOT FOUND THEN
+            RETURN jsonb_build_object('error', 'receiver_not_found', 'status', 404,
+                                      'detail', format('Receiver with id: %s not found!', p_counterparty_id));
+        END IF;
+        IF p_amount <= 0 THEN
+            RETURN jsonb_build_object('error', 'invalid_amount', 'status', 400,
+                                      'detail', 'The sum has to be a positive number');
+        END IF;
+        IF v_user.amount < p_amount THEN
+            RETURN jsonb_build_object('error', 'insufficient_balance', 'status', 400, 'detail', 'Insufficient balance');
+        END IF;
+
+        v_new_balance := v_user.amount - p_amount;
+        UPDATE users SET amount = v_new_balance WHERE id = p_user_id;
+        INSERT INTO transactions (sender_id, receiver_id, amount, status, category)
+        VALUES (p_user_id, p_counterparty_id, p_amount, 'pending', p_category)
+        RETURNING * INTO v_transaction;
+
+        RETURN jsonb_build_object('transaction', to_jsonb(v_transaction),
+                                  'old_balance', v_user.amount, 'new_balance', v_new_balance);
+    END IF;
+
+    IF p_operation IN ('deposit', 'withdraw') THEN
+        IF p_amount <= 0 THEN
+            RETURN jsonb_build_object('error', 'invalid_amount', 'status', 400, 'detail',
+                CASE WHEN p_operation = 'deposit' THEN 'The deposit sum has to be a positive number!'
+                     ELSE 'The sum has to be a positive number' END);
+        END IF;
+        IF p_operation = 'withdraw' AND v_user.amount < p_amount THEN
+            RETURN jsonb_build_object('error', 'insufficient_balance', 'status', 400, 'detail', 'Insufficient balance');
+        END IF;
+
+        v_new_balance := CASE WHEN p_operation = 'deposit' THEN v_user.amount + p_amount
+                              ELSE v_user.amount - p_amount END;
+        UPDATE users SET amount = v_new_balance WHERE id = p_user_id;
+        INSERT INTO transactions (sender_id, receiver_id, amount, status, category, acceptation)
+        VALUES (p_user_id, p_user_id, p_amount, 'confirmed', 'atm', 'accepted')
+        RETURNING * INTO v_transaction;
+
+        RETURN jsonb_build_object('transaction', to_jsonb(v_transaction),
+                                  'old_balance', v_user.amount, 'new_balance', v_new_balance);
+    END IF;
+
+    IF p_operation = 'confirm' THEN
+        SELECT * INTO v_transaction FROM transactions
+        WHERE id = p_transaction_id AND sender_id = p_user_id AND status = 'pending'
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            RETURN jsonb_build_object('error', 'transaction_not_found', 'status', 404, 'detail',
+                format('Transaction with id: %s is not found! You can confirm only pending transactions!',
+                       p_transaction_id));
+        END IF;
+        IF p_action NOT IN ('confirm', 'deny') THEN
+            RETURN jsonb_build_object('error', 'invalid_action', 'status', 400,
+                                      'detail', 'You can only "confirm" or "deny" the transaction!');
+        END IF;
+
+        IF p_action = 'deny' THEN
+            UPDATE users SET amount = amount + v_transaction.amount WHERE id = p_user_id;
+        END IF;
+        UPDATE transactions SET status = CASE WHEN p_action = 'confirm' THEN 'confirmed' ELSE 'declined' END
+        WHERE id = p_transaction_id
+        RETURNING * INTO v_transaction;
+
+        RETURN jsonb_build_object('transaction', to_jsonb(v_transaction));
+    END IF;
+
+    IF p_operation = 'accept' THEN
+        SELECT * INTO v_transaction FROM transactions
+        WHERE id = p_transaction_id AND receiver_id = p_user_id AND acceptation = 'pending'
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            RETURN jsonb_build_object('error', 'transaction_not_found', 'status', 404, 'detail',
+                format('Transaction with id: %s not found or is already accepted!', p_transaction_id));
+        END IF;
+        IF v_transaction.status <> 'confirmed' THEN
+            RETURN jsonb_build_object('error', 'not_confirmed', 'status', 400, 'detail',
+                format('Transaction with id: %s is NOT CONFIRMED by the sender!', p_transaction_id));
+        END IF;
+        IF p_action NOT IN ('accept', 'pending', 'decline') THEN
+            RETURN jsonb_build_object('error', 'invalid_action', 'status', 400,
+                                      'detail', 'Acceptation could be only accept, pending, decline!');
+        END IF;
+
+        IF p_action = 'accept' THEN
+            UPDATE users SET amount = amount + v_transaction.amount WHERE id = p_user_id;
+            UPDATE transactions SET acceptation = 'accepted' WHERE id = p_transaction_id
+            RETURNING * INTO v_transaction;
+        ELSIF p_action = 'decline' THEN
+            UPDATE users SET amount = amount + v_transaction.amount WHERE id = v_transaction.sender_id;
+            UPDATE transactions SET acceptation = 'declined' WHERE id = p_transaction_id
+            RETURNING * INTO v_transaction;
+        END IF;
+
+        RETURN jsonb_build_object('transaction', to_jsonb(v_transaction));
+    END IF;
+
+    RETURN jsonb_build_object('error', 'invalid_operation', 'status', 400,
+                              'detail', format('Unknown operation: %s', p_operation));
+END;
+$$;
@@ -0,0 +1,39 @@
+-- Frequent recipients, see data/recipient_ranking.py and GET /contacts/top.
+-- One row per (sender, recipient) pair. Each payment adds 2 ^ ((paid at - 2024-01-01) / 30 days) to score, so a
+-- payment is worth half as much after every 30 days and the rows can be ordered by score without rescaling them.
+-- last_paid_at is epoch seconds. Workers keep the scores of new payments in memory and add them here every few
+-- seconds with add_recipient_scores(p_scores => [{user_id, recipient_id, score, last_paid_at}, ...]).
+-- The INSERT at the end scores the existing transactions once. data/local_client.py has the SQLite version.
+
+CREATE TABLE IF NOT EXISTS recipient_scores (
+    user_id bigint NOT NULL,
+    recipient_id bigint NOT NULL,
+    score double precision NOT NULL,
+    last_paid_at double precision NOT NULL,
+    PRIMARY KEY (user_id, recipient_id)
+);
+
+CREATE INDEX IF NOT EXISTS recipient_scores_user_score ON recipient_scores (user_id, score DESC);
+
+
+CREATE OR REPLACE FUNCTION add_recipient_scores(p_scores jsonb) RETURNS void
+LANGUAGE sql
+AS $$
+    INSERT INTO recipient_scores (user_id, recipient_id, score, last_paid_at)
+    SELECT user_id, recipient_id, score, last_paid_at
+    FROM jsonb_to_recordset(p_scores)
+        AS s(user_id bigint, recipient_id bigint, score double precision, last_paid_at double precision)
+    ON CONFLICT (user_id, recipient_id) DO UPDATE
+        SET score = recipient_scores.score + excluded.score,
+            last_paid_at = greatest(recipient_scores.last_paid_at, excluded.last_paid_at);
+$$;
+
+
+INSERT INTO recipient_scores (user_id, recipient_id, score, last_paid_at)
+SELECT sender_id, receiver_id,
+       sum(power(2, (extract(epoch FROM created_at) - 1704067200) / (30 * 24 * 3600))),
+       max(extract(epoch FROM created_at))
+FROM transactions
+WHERE sender_id <> receiver_id
+GROUP BY sender_id, receiver_id
+ON CONFLICT (user_id, recipient_id) DO NOTHING;
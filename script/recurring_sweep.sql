@@ -0,0 +1,119 @@
+-- Batch payment of due recurring transactions.
+-- The sweep worker reads a batch of due rows and works out in Python (data/cadence.py) how many runs each one owes
+-- and when it runs next, counted from anchor_time so that late payments do not move the schedule. It then calls
+-- query.rpc('pay_recurring_runs', {'p_now': ..., 'p_runs': [{id, expected, runs, next_run_time}, ...]}).
+-- One call locks the rows that still have the expected next_run_time (skipping rows another worker holds),
+-- pays them with one bulk balance update and one bulk insert into transactions, and moves their next_run_time
+-- with one bulk update. runs > 1 is a catch-up of runs missed while the app was down, runs = 0 only moves the row.
+-- run_times lists when each run was due, its transaction is dated then.
+-- A sender's rows are taken in due order and each one is paid if it fits what is left of the balance after
+-- the rows paid before it; a row that does not fit is marked failed like before and does not hold up the
+-- sender's later rows. Rows with a NULL next_run_time (an invalid recurring_time) are marked failed too.
+-- next_runs lists [id, next_run_time] of the paid rows so the caller can schedule their next run,
+-- payments lists [sender_id, receiver_id, runs] of the paid rows for the frequent recipients (recipient_scores.sql).
+-- data/local_client.py has the SQLite version used in tests.
+
+ALTER TABLE recurring_transactions ADD COLUMN IF NOT EXISTS anchor_time timestamptz;
+UPDATE recurring_transactions SET anchor_time = next_run_time WHERE anchor_time IS NULL;
+
+CREATE INDEX IF NOT EXISTS recurring_transactions_due
+    ON recurring_transactions (next_run_time, id) WHERE status = 'approved';
+
+-- replaced by pay_recurring_runs, monthly is now a calendar month instead of 4 weeks
+DROP FUNCTION IF EXISTS sweep_recurring_transactions(timestamptz, integer, bigint[], boolean);
+DROP FUNCTION IF EXISTS recurring_interval(text);
+
+
+CREATE OR REPLACE FUNCTION pay_recurring_runs(p_now timestamptz, p_runs jsonb) RETURNS jsonb
+LANGUAGE sql
+AS $$
+    WITH RECURSIVE planned AS (
+        SELECT *
+        FROM jsonb_to_recordset(p_runs)
+            AS p(id bigint, expected timestamptz, runs integer, run_times jsonb, next_run_time timestamptz)
+    ),
+    due AS (
+        SELECT r.id, r.sender_id, r.receiver_id, r.amount, r.next_run_time, p.runs, p.run_times,
+               p.next_run_time AS following_run_time
+        FROM recurring_transactions r
+        JOIN planned p ON p.id = r.id
+        WHERE r.status = 'approved' AND r.next_run_time = p.expected
+        ORDER BY r.next_run_time, r.id
+        FOR UPDATE OF r SKIP LOCKED
+    ),
+    -- every account of the batch, locked in id order like move_money
+    accounts AS (
+        SELECT u.id, u.amount
+        FROM users u
+        WHERE u.id IN (SELECT sender_id FROM due UNION SELECT receiver_id FROM due)
+        ORDER BY u.id
+        FOR UPDATE
+    ),
+    ranked AS (
+        SELECT d.*, s.amount AS balance,
+               row_number() OVER (PARTITION BY d.sender_id ORDER BY d.next_run_time, d.id) AS position
+        FROM due d
+        JOIN accounts s ON s.id = d.sender_id
+        JOIN accounts r ON r.id = d.receiver_id
+    ),
+    -- walks each sender's rows in due order, spent is what the rows paid so far took from the balance
+    greedy AS (
+        SELECT k.*, f.pays, CASE WHEN f.pays THEN k.amount * k.runs ELSE 0 END AS spent
+        FROM ranked k
+        CROSS JOIN LATERAL (SELECT k.following_run_time IS NOT NULL
+                                   AND (k.runs = 0 OR k.amount * k.runs <= k.balance) AS pays) f
+        WHERE k.position = 1
+        UNION ALL
+        SELECT k.*, f.pays, g.spent + CASE WHEN f.pays THEN k.amount * k.runs ELSE 0 END
+        FROM greedy g
+        JOIN ranked k ON k.sender_id = g.sender_id AND k.position = g.position + 1
+        CROSS JOIN LATERAL (SELECT k.following_run_time IS NOT NULL
+                                   AND (k.runs = 0 OR g.spent + k.amount * k.runs <= k.balance) AS pays) f
+    ),
+    paid AS (
+        SELECT * FROM greedy WHERE pays
+    ),
+    deltas AS (
+        SELECT user_id, sum(delta) AS delta
+        FROM (SELECT sender_id AS user_id, -amount * runs AS delta FROM paid
+              UNION ALL
+              SELECT receiver_id, amount * runs FROM paid) moves
+        GROUP BY user_id
+        HAVING sum(delta) <> 0
+    ),
+    balances AS (
+        UPDATE users u SET amount = u.amount + d.delta
+        FROM deltas d
+        WHERE u.id = d.user_id
+        RETURNING u.id
+    ),
+    inserted AS (
+        INSERT INTO transactions (sender_id, receiver_id, amount, status, category, created_at)
+        SELECT p.sender_id, p.receiver_id, p.amount, 'confirmed', 'recurring', t.run_time::timestamptz
+        FROM paid p, jsonb_array_elements_text(p.run_times) AS t(run_time)
+        RETURNING id
+    ),
+    advanced AS (
+        UPDATE recurring_transactions r
+        SET next_run_time = p.following_run_time
+        FROM paid p
+        WHERE r.id = p.id
+        RETURNING r.id, r.next_run_time
+    ),
+    failed AS (
+        UPDATE recurring_transactions r SET status = 'failed'
+        FROM due d
+        WHERE r.id = d.id AND d.id NOT IN (SELECT id FROM paid)
+        RETURNING r.id
+    )
+    SELECT jsonb_build_object(
+        'due', (SELECT count(*) FROM due),
+        'processed', (SELECT count(*) FROM inserted),
+        'failed', (SELECT count(*) FROM failed),
+        'oldest_due', (SELECT min(next_run_time) FROM due),
+        'user_ids', (SELECT coalesce(jsonb_agg(id), '[]'::jsonb) FROM balances),
+        'next_runs', (SELECT coalesce(jsonb_agg(jsonb_build_array(id, next_run_time)), '[]'::jsonb) FROM advanced),
+        'payments', (SELECT coalesce(jsonb_agg(jsonb_build_array(sender_id, receiver_id, runs)), '[]'::jsonb)
+                     FROM paid WHERE runs > 0)
+    );
+$$;
@@ -0,0 +1,16 @@
+-- Shared token revocations, see data/revocation_store.py (TOKEN_REVOCATION_STORE=database).
+-- One row per revocation: key is jti:<token id> for a logout or user:<user id> when every token the user was
+-- issued before revoked_at is rejected (block). Times are epoch seconds. A row can be deleted after expires_at,
+-- the tokens it rejects have expired by then; the app deletes them when it revokes another token.
+-- Workers read the rows revoked since their last sync into a Bloom filter and only query a key the filter holds.
+-- data/local_client.py creates the same table in SQLite.
+
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    key text NOT NULL,
+    revoked_at double precision NOT NULL,
+    expires_at double precision NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS revoked_tokens_key ON revoked_tokens (key);
+CREATE INDEX IF NOT EXISTS revoked_tokens_revoked_at ON revoked_tokens (revoked_at);
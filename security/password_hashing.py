@@ -1,19 +1,131 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from decouple import config
 from passlib.context import CryptContext
+from passlib.hash import scrypt
+
+from data.helpers import PASSWORD_HASHING_BUSY_ERROR
+
+# hashes run on this many threads, scrypt releases the GIL so they use separate cores
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 1, cast=int)
+# hashes queued or running at once, more are turned away with a 503 instead of waiting behind a login storm
+PASSWORD_HASH_MAX_PENDING = config('PASSWORD_HASH_MAX_PENDING', default=4 * PASSWORD_HASH_WORKERS, cast=int)
+# log2 of the scrypt work factor, memory per hash is 1 KiB * 2 ** rounds;
+# 0 picks the most rounds that hash within PASSWORD_HASH_TARGET_MS at startup
+PASSWORD_HASH_ROUNDS = config('PASSWORD_HASH_ROUNDS', default=0, cast=int)
+PASSWORD_HASH_TARGET_MS = config('PASSWORD_HASH_TARGET_MS', default=100, cast=int)
+# memory the hashes running on all workers may take together, calibration picks no more rounds than
+# fit PASSWORD_HASH_MEMORY_MB / workers per hash
+PASSWORD_HASH_MEMORY_MB = config('PASSWORD_HASH_MEMORY_MB', default=512, cast=int)
+MIN_HASH_ROUNDS = 14
+MAX_HASH_ROUNDS = 20
+
+# hashing algo, passwords stored as unsalted SHA-256 hex digests are still accepted and rehashed on login
+pwd_context = CryptContext(schemes=["scrypt", "hex_sha256"], deprecated=["hex_sha256"],
+                           scrypt__rounds=PASSWORD_HASH_ROUNDS or MIN_HASH_ROUNDS,
+                           scrypt__min_rounds=PASSWORD_HASH_ROUNDS or MIN_HASH_ROUNDS)
+
+
+class PasswordHasher:
+    '''Runs password hashing on a bounded thread pool, off the event loop. At most max_pending hashes are
+    admitted at once, the rest are rejected right away with PASSWORD_HASHING_BUSY_ERROR.'''
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hashing')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.rejected = 0
+
+    def submit(self, function, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PASSWORD_HASHING_BUSY_ERROR
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, function, *args):
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def run_sync(self, function, *args):
+        # for the sync services, which run on the threadpool already
+        return self.submit(function, *args).result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
 
-# hashing algo
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher()
 
 
-def verify_password(plain_password, hashed_password):
-    new_hashed_pass = get_password_hash(plain_password)
-    return new_hashed_pass == hashed_password
+def _verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except ValueError:
+        # not a hash this context knows
+        return False, None
+
+
+def verify_password(plain_password, hashed_password) -> bool:
+    return password_hasher.run_sync(_verify_and_update, plain_password, hashed_password)[0]
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    '''Checks the password, the second value is a new hash to store when the stored one is a legacy
+    SHA-256 digest or was made with fewer rounds, None otherwise.'''
+    return password_hasher.run_sync(_verify_and_update, plain_password, hashed_password)
+
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return await password_hasher.run(_verify_and_update, plain_password, hashed_password)
 
 
 def get_password_hash(password):
-    password = _hash_password(password)
-    return password
+    return password_hasher.run_sync(pwd_context.hash, password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_hasher.run(pwd_context.hash, password)
+
+
+def memory_rounds(memory_mb: int = PASSWORD_HASH_MEMORY_MB, workers: int = None) -> int:
+    '''The most scrypt rounds whose hashes fit memory_mb when every worker hashes at once, 1 KiB * 2 ** rounds
+    each, between MIN_HASH_ROUNDS and MAX_HASH_ROUNDS.'''
+    per_hash_kib = memory_mb * 1024 // max(workers or password_hasher.workers, 1)
+    return max(MIN_HASH_ROUNDS, min(MAX_HASH_ROUNDS, per_hash_kib.bit_length() - 1))
+
+
+def calibrate(target_ms: int = PASSWORD_HASH_TARGET_MS, memory_mb: int = PASSWORD_HASH_MEMORY_MB,
+              workers: int = None) -> int:
+    '''The most scrypt rounds which hash within target_ms on this machine and fit the memory budget,
+    at least MIN_HASH_ROUNDS.'''
+    rounds, limit = MIN_HASH_ROUNDS, memory_rounds(memory_mb, workers)
+    while rounds < limit:
+        started = time.perf_counter()
+        scrypt.using(rounds=rounds + 1).hash('calibration')
+        if (time.perf_counter() - started) * 1000 > target_ms:
+            break
+        rounds += 1
+    return rounds
 
 
-def _hash_password(password: str):
-    from hashlib import sha256
-    return sha256(password.encode('utf-8')).hexdigest()
+def configure_password_hashing():
+    '''Sets the cost of new hashes at startup: PASSWORD_HASH_ROUNDS when it is set, calibrated otherwise.
+    Stored hashes with fewer rounds are rehashed on the next login.'''
+    rounds = PASSWORD_HASH_ROUNDS or calibrate()
+    if rounds > memory_rounds():
+        logging.warning('Password hashing: %s rounds take %s MiB on each of %s threads, more than '
+                        'PASSWORD_HASH_MEMORY_MB=%s', rounds, 2 ** rounds // 1024, password_hasher.workers,
+                        PASSWORD_HASH_MEMORY_MB)
+    pwd_context.update(scrypt__rounds=rounds, scrypt__min_rounds=rounds)
+    logging.info('Password hashing: scrypt with %s rounds on %s threads', rounds, password_hasher.workers)
+    return rounds
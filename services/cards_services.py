@@ -1,4 +1,9 @@
 from data.connection import query as supabase
+from data.helpers import decode_cursor, encode_cursor
+
+CARDS_PAGE_SIZE = 20
+MAX_CARDS_PAGE_SIZE = 100
+CARD_COLUMNS = ('id', 'user_id', 'type', 'expiration_date', 'cvv', 'number')
 
 def create_card(card_data: dict):
     print("Creating card with data:", card_data)
@@ -9,35 +14,32 @@ def create_card(card_data: dict):
         raise Exception(response.json())
     return response.data[0]
 
-def get_all_cards():
-    response = supabase.table('cards').select('*').execute()
-    if not response.data:
-        print("Error fetching cards:", response)
-        raise Exception(response.json())
-    return response.data
+def get_user_cards(user_id: int, cursor: str = None, limit: int = CARDS_PAGE_SIZE) -> tuple[list[dict], str | None]:
+    """One page of the user's cards in id order, read through the cards_user_id index (script/indexes.sql).
+    Returns the page and the cursor of the next page, None on the last page."""
+    cards_query = supabase.table('cards').select(*CARD_COLUMNS).eq('user_id', user_id)
+    if cursor:
+        cards_query = cards_query.gt('id', decode_cursor(cursor)[1])
+    # one extra row tells whether there is a next page
+    cards = cards_query.order('id').limit(limit + 1).execute().data
+    if len(cards) > limit:
+        cards = cards[:limit]
+        return cards, encode_cursor(cards[-1], 'id')
+    return cards, None
 
-def get_card_by_id(card_id: int):
-    response = supabase.table('cards').select('*').eq('id', card_id).execute()
-    if not response.data:
-        print("Error fetching card by id:", response)
-        raise Exception(response.json())
-    data = response.data
+def get_card_by_id(card_id: int, user_id: int):
+    """The card if it belongs to the user, None otherwise; the owner is checked in the same query."""
+    data = supabase.table('cards').select(*CARD_COLUMNS).eq('id', card_id).eq('user_id', user_id).execute().data
     return data[0] if data else None
 
-def update_card(card_id: int, card_data: dict):
-    print("Updating card with id:", card_id, "with data:", card_data)
-    response = supabase.table('cards').update(card_data).eq('id', card_id).execute()
-    print("Supabase response:", response)
-    if not response.data:
-        print("Error updating card:", response)
-        raise Exception(response.json())
-    return response.data[0]
+def update_card(card_id: int, user_id: int, card_data: dict):
+    """Updates the card if it belongs to the user and returns it, None otherwise."""
+    if not card_data:
+        return get_card_by_id(card_id, user_id)
+    response = supabase.table('cards').update(card_data).eq('id', card_id).eq('user_id', user_id).execute()
+    return response.data[0] if response.data else None
 
-def delete_card(card_id: int):
-    print("Deleting card with id:", card_id)
-    response = supabase.table('cards').delete().eq('id', card_id).execute()
-    print("Supabase response:", response)
-    if not response.data:
-        print("Error deleting card:", response)
-        raise Exception(response.json())
+def delete_card(card_id: int, user_id: int):
+    """Deletes the card if it belongs to the user and returns it, None otherwise."""
+    response = supabase.table('cards').delete().eq('id', card_id).eq('user_id', user_id).execute()
     return response.data[0] if response.data else None
@@ -1,25 +1,75 @@
+from datetime import datetime
 from data.connection import query
+from data.contact_cache import ContactList, contact_cache
+from data.helpers import decode_cursor, encode_cursor, CURSOR_ERROR
+from data.recipient_ranking import recipient_ranking, TOP_RECIPIENTS_LIMIT, MAX_TOP_RECIPIENTS_LIMIT
+from data.user_loader import get_user_loader
 from fastapi import HTTPException, status
 
-def get_contacts_of_user(logged_user_id:int):
-    '''Retrieve contact details for a given user.'''
-    all_contacts = query.table('contacts').select('*').eq('current_user',logged_user_id).execute()
-    contacts_details = []
-    if all_contacts.data:
-        for contact in all_contacts.data:
-            
-            contact_name_id = contact['contact_name_id']
-            contacts_details.append(query.table('users')
-                                    .select('username', 'email', 'phone_number')
-                                    .eq('id',contact_name_id)
-                                    .execute().data[0])
-            
-        return contacts_details
-        
-    else: 
+CONTACTS_PAGE_SIZE = 50
+MAX_CONTACTS_PAGE_SIZE = 500
+CONTACT_SEARCH_LIMIT = 10
+MAX_CONTACT_SEARCH_LIMIT = 50
+# users read per query, keeps the in_ filter of a long contact list well inside URL length limits
+RESOLVE_BATCH_SIZE = 200
+# the type of each sort column's values, a cursor of another column cannot be compared with them
+CONTACT_SORT_TYPES = {'id': int, 'username': str, 'email': str, 'phone_number': str}
+
+
+def get_contacts_of_user(logged_user_id: int, sort_by: str = 'username', order: str = 'asc', cursor: str = None,
+                         limit: int = CONTACTS_PAGE_SIZE) -> tuple[list[dict], str | None]:
+    '''Retrieve contact details for a given user, one page in (sort_by, id) order.
+    Returns the page and the cursor of the next page, None on the last page.'''
+    contacts = resolve_contacts(logged_user_id)
+    if not contacts.contacts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No contacts found!')
-    
-    
+
+    after = decode_cursor(cursor) if cursor else None
+    if after and not isinstance(after[0], CONTACT_SORT_TYPES[sort_by]):
+        raise CURSOR_ERROR
+    page, has_more = contacts.page(sort_by, order == 'desc', after, limit)
+    next_cursor = encode_cursor(page[-1], sort_by) if has_more and page else None
+    return page, next_cursor
+
+
+def resolve_contacts(logged_user_id: int) -> ContactList:
+    '''The user's contacts with their details, from contact_cache or read with one contacts query and one
+    users query per RESOLVE_BATCH_SIZE contacts.'''
+    contacts = contact_cache.get(logged_user_id)
+    if contacts is not None:
+        return contacts
+
+    contact_ids = list(dict.fromkeys(contact['contact_name_id'] for contact in query.table('contacts')
+                                     .select('contact_name_id').eq('current_user', logged_user_id).execute().data))
+    users = []
+    for start in range(0, len(contact_ids), RESOLVE_BATCH_SIZE):
+        users.extend(query.table('users')
+                     .select('id', 'username', 'email', 'phone_number')
+                     .in_('id', contact_ids[start:start + RESOLVE_BATCH_SIZE])
+                     .execute().data)
+
+    contacts = ContactList(users)
+    contact_cache.put(logged_user_id, contacts)
+    return contacts
+
+
+def search_contacts(logged_user_id: int, text: str, limit: int = CONTACT_SEARCH_LIMIT) -> list[dict]:
+    '''Type-ahead search of the user's contacts by username, email or phone number: prefix matches first,
+    then substring matches, then matches with a typo. Answered from the in-memory index of the contacts.'''
+    return resolve_contacts(logged_user_id).search_index().search(text, limit)
+
+
+def get_top_recipients(logged_user_id: int, limit: int = TOP_RECIPIENTS_LIMIT) -> list[dict]:
+    '''The people the user pays most often and most recently, by transfers and recurring payments, best first.
+    The ranking is kept in memory, the recipients' details come from the user cache.'''
+    ranked = recipient_ranking.top(logged_user_id, limit)
+    users = get_user_loader().load_many([recipient['id'] for recipient in ranked])
+    return [{'id': user.id, 'username': user.username, 'email': user.email, 'phone_number': user.phone_number,
+             'score': round(recipient['score'], 4),
+             'last_paid_at': datetime.fromtimestamp(recipient['last_paid_at']).isoformat()}
+            for recipient, user in zip(ranked, users) if user]
+
+
 def find_contact_by_attribute(logged_user_id: int, search_by_criteria: str, value: str):
     '''Find a user's contact by a specific attribute (phone number, username, or email).'''
     # Map the attribute to the corresponding column name in the 'users' table
@@ -30,18 +80,7 @@ def find_contact_by_attribute(logged_user_id: int, search_by_criteria: str, valu
     }
     column_name = column_map.get(search_by_criteria)
     if column_name:
-        # Search for the contact using the specified attribute and value
-        contact = query.table('contacts') \
-            .select('contact_name_id') \
-            .eq('current_user', logged_user_id) \
-            .execute()
-        
-        if contact.data:
-            contact_name_ids = [c['contact_name_id'] for c in contact.data]
-            user = query.table('users') \
-                .select('id', 'username', 'email', 'phone_number') \
-                .in_('id', contact_name_ids) \
-                .eq(column_name, value) \
-                .execute().data
-            return user[0] if user else None
-    return None
\ No newline at end of file
+        # the contacts and their details come from the same cached list as the listing and the search
+        contacts = resolve_contacts(logged_user_id).search_index().exact(column_name, value)
+        return contacts[0] if contacts else None
+    return None
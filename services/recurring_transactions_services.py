@@ -1,93 +1,246 @@
 # services/recurring_transactions_services.py
-from datetime import datetime, timedelta
-from data.scheduler import scheduler  # Import the scheduler
+import threading
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+from decouple import config
+from data.cadence import parse_cadence, first_run, next_run
+from data.forecast import Schedule, daily_flows
+from data.payment_scheduler import PaymentScheduler
+from data.leader_election import LeaderElector
 from data.connection import query
-from data.models import RecurringTransaction
+from data.recipient_ranking import recipient_ranking
+from data.user_loader import get_user_loader
 from fastapi import HTTPException, status
-from data.schemas import CreateRecurringTransaction, UpdateRecurringTransaction
+from data.schemas import CreateRecurringTransaction, UpdateRecurringTransaction, BalanceForecast
+from data.helpers import RECURRING_TIME_ERROR, ID_ERROR, find_user_by_id
 import logging
 
+# due rows are paid in batches by the pay function, see script/recurring_sweep.sql
+PAY_PROCEDURE = 'pay_recurring_runs'
+# the leader pays the rows it has scheduled on time and sweeps for the others, e.g. created by another worker
+SWEEP_INTERVAL_SECONDS = 10
+SWEEP_BATCH_SIZE = 500
+SCHEDULE_LOAD_PAGE_SIZE = 5000
+# runs missed while the app was down: all pays every one of them, latest pays one, skip pays none,
+# a run is missed when a later one is due too or it is more than MISSED_RUN_GRACE_SECONDS late
+CATCH_UP_POLICIES = ('all', 'latest', 'skip')
+CATCH_UP_POLICY = config('RECURRING_CATCH_UP', default='all')
+MISSED_RUN_GRACE_SECONDS = 300
+# a longer backlog of one row is paid over several batches
+MAX_CATCH_UP_RUNS = 1000
+# balance forecasts reach up to five years ahead
+DEFAULT_FORECAST_DAYS = 365
+MAX_FORECAST_DAYS = 5 * 366
+# only the worker holding this lease runs the sweep, see data/leader_election.py
+RECURRING_LEADER_NAME = 'recurring-processor'
+
+if CATCH_UP_POLICY not in CATCH_UP_POLICIES:
+    raise ValueError(f'Unknown recurring catch-up policy: {CATCH_UP_POLICY}, expected one of {CATCH_UP_POLICIES}')
+
+
+class SweepMetrics:
+    '''Throughput and lag counters of the recurring transaction sweep, lag is how late the oldest due row was paid.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sweeps = 0
+        self.batches = 0
+        self.processed = 0
+        self.failed = 0
+        self.last_sweep_at = None
+        self.last_sweep_seconds = 0.0
+        self.last_sweep_processed = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+
+    def record(self, swept_at: datetime, seconds: float, batches: int, processed: int, failed: int,
+               lag_seconds: float):
+        with self._lock:
+            self.sweeps += 1
+            self.batches += batches
+            self.processed += processed
+            self.failed += failed
+            self.last_sweep_at = swept_at
+            self.last_sweep_seconds = seconds
+            self.last_sweep_processed = processed
+            self.last_lag_seconds = lag_seconds
+            self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'sweeps': self.sweeps,
+                'batches': self.batches,
+                'processed': self.processed,
+                'failed': self.failed,
+                'last_sweep_at': self.last_sweep_at.isoformat() if self.last_sweep_at else None,
+                'last_sweep_seconds': self.last_sweep_seconds,
+                'last_sweep_per_second': self.last_sweep_processed / self.last_sweep_seconds
+                if self.last_sweep_seconds else 0.0,
+                'last_lag_seconds': self.last_lag_seconds,
+                'max_lag_seconds': self.max_lag_seconds,
+            }
+
+
+sweep_metrics = SweepMetrics()
+
+
 def get_all_recurring_transactions(sender_id:int):
     '''Retrieve all recurring transactions initiated by a given sender'''
     all_transactions = query.table('recurring_transactions').select('receiver_id', 'amount', 'created_at', 'recurring_time').eq('sender_id', sender_id).execute()
     return all_transactions
 
 logging.basicConfig(level=logging.DEBUG)
-def process_recurring_transaction(transaction_id: int):
-    ''' Process a recurring transaction and schedule the next run based on its recurring time.'''
+def process_recurring_transaction(transaction_id: int) -> dict:
+    ''' Process a recurring transaction now, even if it is not due yet, and move its next run.'''
     
     logging.info(f"Processing recurring transaction: {transaction_id}")
-    transaction_data = query.table('recurring_transactions').select('*').eq('id', transaction_id).execute().data
-    if not transaction_data:
-        logging.error(f"No transaction data found for ID: {transaction_id}")
-        return
+    return sweep_due_recurring_transactions(ids=[transaction_id], due_only=False)
+
+
+def sweep_due_recurring_transactions(now: datetime = None, ids: list[int] = None, due_only: bool = True) -> dict:
+    '''Pays every recurring transaction whose next run time has passed, SWEEP_BATCH_SIZE rows per batch.
+    A batch is read with one query and paid with one database call, which pays the runs each row owes
+    with bulk balance updates and inserts and moves the next runs in one update.'''
+    now = now or datetime.now()
+    started = time.perf_counter()
+    batches = processed = failed = 0
+    lag_seconds = 0.0
+
+    while True:
+        rows = _due_rows(now, ids, due_only)
+        if not rows:
+            break
+        batch = query.rpc(PAY_PROCEDURE, {'p_now': now.isoformat(),
+                                          'p_runs': [plan_runs(row, now) for row in rows]}).execute().data
+        batches += 1
+        processed += batch['processed']
+        failed += batch['failed']
+        if batches == 1 and batch['oldest_due']:
+            # batches are taken in next_run_time order, the first one holds the oldest due row
+            lag_seconds = _lag_seconds(now, batch['oldest_due'])
+
+        for user_id in batch['user_ids']:
+            get_user_loader().forget(user_id)
+        # missing until script/recurring_sweep.sql is run again
+        for sender_id, receiver_id, runs in batch.get('payments', ()):
+            recipient_ranking.record(sender_id, receiver_id, runs, now.timestamp())
+        if recurring_schedule.running:
+            recurring_schedule.schedule_many((row_id, _run_at(next_run)) for row_id, next_run in batch['next_runs'])
+
+        # paid rows move to a later next_run_time and failed rows leave the sweep, so a short batch is the last one,
+        # rows that are not due yet are only processed once
+        if not due_only or len(rows) < SWEEP_BATCH_SIZE or not batch['due']:
+            break
+
+    seconds = time.perf_counter() - started
+    sweep_metrics.record(now, seconds, batches, processed, failed, lag_seconds)
+    if processed or failed:
+        logging.info(f"Swept recurring transactions: {processed} paid, {failed} failed in {seconds:.2f} s, "
+                     f"lag {lag_seconds:.1f} s")
+    return {'batches': batches, 'processed': processed, 'failed': failed, 'lag_seconds': lag_seconds}
+
+
+def _due_rows(now: datetime, ids: list[int] | None, due_only: bool) -> list[dict]:
+    rows_query = query.table('recurring_transactions').select('id', 'recurring_time', 'next_run_time', 'anchor_time') \
+        .eq('status', 'approved')
+    if due_only:
+        rows_query = rows_query.lte('next_run_time', now.isoformat())
+    if ids is not None:
+        rows_query = rows_query.in_('id', ids)
+    return rows_query.order('next_run_time').limit(SWEEP_BATCH_SIZE).execute().data
+
+
+def plan_runs(row: dict, now: datetime, policy: str = None) -> dict:
+    '''How many runs a row owes at now, when each of them was due and when it runs next, in the form the pay
+    function takes. Runs are counted from the row's anchor, a row that is not due yet (processed by hand) pays
+    its upcoming run now. A row with an invalid recurring_time gets no next run and is marked failed.'''
+    policy = policy or CATCH_UP_POLICY
+    plan = {'id': row['id'], 'expected': row['next_run_time'], 'runs': 0, 'run_times': [], 'next_run_time': None}
+    try:
+        cadence = parse_cadence(row['recurring_time'])
+    except ValueError:
+        logging.warning(f"Recurring transaction {row['id']} has an invalid recurring time: {row['recurring_time']}")
+        return plan
+
+    scheduled = datetime.fromisoformat(row['next_run_time'])
+    anchor = datetime.fromisoformat(row['anchor_time']) if row.get('anchor_time') else scheduled
+    now = _in_zone_of(now, scheduled)
+
+    if scheduled > now:
+        plan.update(runs=1, run_times=[now.isoformat()],
+                    next_run_time=next_run(cadence, anchor, scheduled).isoformat())
+        return plan
+
+    # only all needs the whole count, the others only need to know whether a run was missed
+    limit = MAX_CATCH_UP_RUNS if policy == 'all' else 2
+    run_times, following = [], scheduled
+    while following <= now and len(run_times) < limit:
+        run_times.append(following)
+        following = next_run(cadence, anchor, following)
+
+    missed = len(run_times) > 1 or (now - scheduled).total_seconds() > MISSED_RUN_GRACE_SECONDS
+    if missed and policy == 'latest':
+        # one payment now for the runs that were missed
+        run_times = [now]
+    elif missed and policy == 'skip':
+        run_times = []
+    if policy != 'all' and following <= now:
+        following = next_run(cadence, anchor, now)
+
+    # the transactions of the runs are dated when the runs were due, so a catch-up lands on the right days
+    plan.update(runs=len(run_times), run_times=[run_time.isoformat() for run_time in run_times],
+                next_run_time=following.isoformat())
+    return plan
+
+
+def _in_zone_of(now: datetime, moment: datetime) -> datetime:
+    if moment.tzinfo is not None and now.tzinfo is None:
+        # now is local time
+        return now.astimezone(moment.tzinfo)
+    return now
+
+
+def _lag_seconds(now: datetime, oldest_due: str) -> float:
+    oldest_due = datetime.fromisoformat(oldest_due)
+    return max((_in_zone_of(now, oldest_due) - oldest_due).total_seconds(), 0.0)
+
+
+def _run_at(next_run_time: str) -> float:
+    # naive timestamps are local time, like datetime.now()
+    return datetime.fromisoformat(next_run_time).timestamp()
+
+
+def pay_scheduled_transactions(ids: list[int]):
+    '''Executor of the payment scheduler. Rows moved or deleted since they were scheduled are not due and are skipped.'''
+    sweep_due_recurring_transactions(ids=ids)
+
+
+recurring_schedule = PaymentScheduler(pay_scheduled_transactions, sweep=sweep_due_recurring_transactions,
+                                      sweep_seconds=SWEEP_INTERVAL_SECONDS, batch_size=SWEEP_BATCH_SIZE)
 
-    transaction = RecurringTransaction.from_query_result(**transaction_data[0])
-    
-    sender_balance_data = query.table('users').select('amount').eq('id', transaction.sender_id).execute().data
-    receiver_balance_data = query.table('users').select('amount').eq('id', transaction.receiver_id).execute().data
-    
-    if not sender_balance_data or not receiver_balance_data:
-        logging.error(f"No balance data found for sender or receiver.")
-        return
-    
-    sender_balance = sender_balance_data[0]['amount']
-    receiver_balance = receiver_balance_data[0]['amount']
-    
-    if sender_balance < transaction.amount:
-        query.table('recurring_transactions').update({'status': 'failed'}).eq('id', transaction_id).execute()
-        logging.info(f"Transaction {transaction_id} failed due to insufficient balance.")
-        return
-    
-    new_sender_balance = sender_balance - transaction.amount
-    new_receiver_balance = receiver_balance + transaction.amount
-    
-    query.table('users').update({'amount': new_sender_balance}).eq('id', transaction.sender_id).execute()
-    query.table('users').update({'amount': new_receiver_balance}).eq('id', transaction.receiver_id).execute()
-    
-    query.table('transactions').insert({
-        'sender_id': transaction.sender_id,
-        'receiver_id': transaction.receiver_id,
-        'amount': transaction.amount,
-        'status': 'confirmed',
-        'category': 'recurring',
-        'created_at': datetime.now().isoformat()  # Convert to string
-    }).execute()
-    
-    if transaction.recurring_time == 'daily':
-        next_run_time = datetime.now() + timedelta(days=1)
-    elif transaction.recurring_time == 'weekly':
-        next_run_time = datetime.now() + timedelta(weeks=1)
-    elif transaction.recurring_time == 'monthly':
-        next_run_time = datetime.now() + timedelta(weeks=4)
-    elif transaction.recurring_time == 'minutely':
-        next_run_time = datetime.now() + timedelta(minutes=1)
-    else:
-        logging.error(f"Invalid recurring time: {transaction.recurring_time}")
-        return
-    
-    if next_run_time:
-        query.table('recurring_transactions').update({'created_at': next_run_time.isoformat()}).eq('id', transaction_id).execute()  # Convert to string
-        scheduler.add_job(process_recurring_transaction, 'date', run_date=next_run_time, args=[transaction_id])
-        logging.info(f"Scheduled next run for transaction {transaction_id} at {next_run_time.isoformat()}")
 
 def create_recurring_transaction(sender_id: int, transaction: CreateRecurringTransaction) -> str:
-    '''Create a recurring transaction in the system and schedule it for processing.'''
+    '''Create a recurring transaction in the system, its runs are counted from now.'''
     
-    next_run_time = datetime.now()
+    anchor_time, next_run_time = _new_schedule(transaction.recurring_time)
 
     transaction_data = {
         'sender_id': sender_id,
         'receiver_id': transaction.receiver_id,
         'amount': transaction.amount,
-        'created_at': next_run_time.isoformat(),  # Convert to string
+        'created_at': anchor_time.isoformat(),  # Convert to string
+        'anchor_time': anchor_time.isoformat(),
+        'next_run_time': next_run_time.isoformat(),
         'recurring_time': transaction.recurring_time,
         'status': 'approved'
     }
     result = query.table('recurring_transactions').insert(transaction_data).execute()
     transaction_id = result.data[0]['id']
+    if recurring_schedule.running:
+        recurring_schedule.schedule(transaction_id, next_run_time.timestamp())
     
-    scheduler.add_job(process_recurring_transaction, 'date', run_date=next_run_time, args=[transaction_id])
     logging.info(f"Created and scheduled recurring transaction {transaction_id} to run at {next_run_time.isoformat()}")
     return 'Recurring transaction created successfully'
 
@@ -103,7 +256,9 @@ def update_recurring_transaction(transaction_id:int, user_id:id, update_transact
     
     if transaction['sender_id'] != user_id:
         return False
-    
+
+    # an invalid recurring_time is rejected before anything is written
+    _cadence(update_transaction.recurring_time)
     update_data = {
         'receiver_id':update_transaction.receiver_id,
         'amount':update_transaction.amount,
@@ -111,35 +266,41 @@ def update_recurring_transaction(transaction_id:int, user_id:id, update_transact
         'status': update_transaction.status,
         'created_at': datetime.now().isoformat()
     }
+
+    # a new cadence or a reactivated transaction starts a new schedule from now, otherwise the runs stay where they are
+    next_run_time = None
+    if update_transaction.recurring_time != transaction['recurring_time'] or transaction.get('status') != 'approved':
+        anchor_time, next_run_time = _new_schedule(update_transaction.recurring_time)
+        update_data.update(anchor_time=anchor_time.isoformat(), next_run_time=next_run_time.isoformat())
     
     # Update the transaction details
     query.table('recurring_transactions').update(update_data).eq('id', transaction_id).execute()
     logging.info(f'Updated recurring transaction {transaction_id}')
-    
-    # Check if the job exists in the scheduler before removing it
-    if scheduler.get_job(str(transaction_id)):
-        # Job exists, so remove it
-        scheduler.remove_job(str(transaction_id))
-        logging.info(f'Removed job for transaction {transaction_id}')
-    
-    # Calculate the next run time based on the updated transaction details
-    next_run_time = datetime.now()
-    if update_transaction.recurring_time == 'daily':
-        next_run_time += timedelta(days=1)
-    elif update_transaction.recurring_time == 'weekly':
-        next_run_time += timedelta(weeks=1)
-    elif update_transaction.recurring_time == 'monthly':
-        next_run_time += timedelta(weeks=4)
-    elif update_transaction.recurring_time == 'minutely':
-        next_run_time += timedelta(minutes=1)
-    
-    # Add a new job with the updated details and reschedule it
-    scheduler.add_job(process_recurring_transaction, 'date', run_date=next_run_time, args=[transaction_id])
-    logging.info(f"Rescheduled next run for transaction {transaction_id} at {next_run_time.isoformat()}")
+
+    if recurring_schedule.running:
+        if update_transaction.status != 'approved':
+            recurring_schedule.cancel(transaction_id)
+        elif next_run_time:
+            recurring_schedule.schedule(transaction_id, next_run_time.timestamp())
+    if next_run_time:
+        logging.info(f"Rescheduled next run for transaction {transaction_id} at {next_run_time.isoformat()}")
     
     return True
 
 
+def _new_schedule(recurring_time: str) -> tuple[datetime, datetime]:
+    '''Anchor and first run of a schedule starting now, for created transactions and edited schedules alike.'''
+    anchor_time = datetime.now()
+    return anchor_time, first_run(_cadence(recurring_time), anchor_time)
+
+
+def _cadence(recurring_time: str):
+    try:
+        return parse_cadence(recurring_time)
+    except ValueError:
+        raise RECURRING_TIME_ERROR
+
+
 def delete_recurring_transaction(recurring_transaction_id: int, user_id: int) -> bool:
     ''' Delete a recurring transaction from the database if the user has permission.'''
     
@@ -152,7 +313,99 @@ def delete_recurring_transaction(recurring_transaction_id: int, user_id: int) ->
         return False
 
     query.table('recurring_transactions').delete().eq('id', recurring_transaction_id).execute()
+    recurring_schedule.cancel(recurring_transaction_id)
     logging.info(f"Deleted recurring transaction {recurring_transaction_id}")
     
 
-    return True 
\ No newline at end of file
+    return True
+
+
+def forecast_balance(user_id: int, days: int = DEFAULT_FORECAST_DAYS) -> BalanceForecast:
+    '''Projects the user's balance at the end of each of the next days from their approved recurring transactions,
+    outgoing and incoming, and flags the first day it goes negative, when a payment would fail.'''
+    user = find_user_by_id(user_id)
+    if not user:
+        raise ID_ERROR
+
+    rows = query.table('recurring_transactions') \
+        .select('sender_id', 'receiver_id', 'amount', 'recurring_time', 'next_run_time', 'anchor_time') \
+        .eq('status', 'approved').or_(f'sender_id.eq.{user_id},receiver_id.eq.{user_id}').execute().data
+    schedules = [schedule for schedule in (_forecast_schedule(row, user_id) for row in rows) if schedule]
+
+    start = date.today()
+    balances = user.amount + np.cumsum(daily_flows(schedules, start, days))
+    negative_days = np.flatnonzero(balances < 0)
+    lowest_day = int(balances.argmin())
+    return BalanceForecast(start_date=start, balance=user.amount, balances=balances.round(2).tolist(),
+                           first_negative_date=start + timedelta(days=int(negative_days[0]))
+                           if negative_days.size else None,
+                           lowest_balance=round(float(balances[lowest_day]), 2),
+                           lowest_balance_date=start + timedelta(days=lowest_day))
+
+
+def _forecast_schedule(row: dict, user_id: int) -> Schedule | None:
+    if row['sender_id'] == row['receiver_id'] or not row['next_run_time']:
+        return None
+    try:
+        cadence = parse_cadence(row['recurring_time'])
+    except ValueError:
+        # the sweep marks it failed, it never pays
+        return None
+    next_run_time = _local_time(row['next_run_time'])
+    anchor_time = _local_time(row['anchor_time']) if row.get('anchor_time') else next_run_time
+    amount = -row['amount'] if row['sender_id'] == user_id else row['amount']
+    return Schedule(amount, cadence, anchor_time, next_run_time)
+
+
+def _local_time(value: str) -> datetime:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+recurring_leader: LeaderElector | None = None
+
+
+def start_recurring_scheduler():
+    '''Called on app startup by every worker. The workers elect one leader, only the leader runs the scheduler,
+    when it dies or cannot renew its lease another worker takes over.'''
+    global recurring_leader
+    recurring_leader = LeaderElector(RECURRING_LEADER_NAME, on_elected=_lead_recurring_processing,
+                                     on_demoted=_stop_recurring_processing)
+    recurring_leader.start()
+
+
+def stop_recurring_scheduler():
+    if recurring_leader:
+        recurring_leader.stop()
+    recurring_schedule.stop()
+
+
+def load_recurring_schedule():
+    '''Yields (id, run_at) of every approved recurring transaction, read in pages of SCHEDULE_LOAD_PAGE_SIZE.'''
+    last_id = 0
+    while True:
+        rows = query.table('recurring_transactions').select('id', 'next_run_time').eq('status', 'approved') \
+            .gt('id', last_id).order('id').limit(SCHEDULE_LOAD_PAGE_SIZE).execute().data
+        for row in rows:
+            if row['next_run_time']:
+                yield row['id'], _run_at(row['next_run_time'])
+        if len(rows) < SCHEDULE_LOAD_PAGE_SIZE:
+            return
+        last_id = rows[-1]['id']
+
+
+def _lead_recurring_processing():
+    '''Rebuilds the schedule from the table, the source of truth, and starts paying it.
+    The scheduler thread loads the schedule in pages, so the elector thread which called this keeps renewing
+    the lease during a long load. Nothing is paid before the load ends, so it never overwrites a run the first sweep
+    has moved.'''
+    recurring_schedule.clear()
+    recurring_schedule.start(load=load_recurring_schedule)
+
+
+def _stop_recurring_processing():
+    # a batch already running finishes, the rows it holds are locked so a new leader skips them
+    recurring_schedule.stop()
+    recurring_schedule.clear()
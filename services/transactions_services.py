@@ -1,293 +1,134 @@
+import csv
+import io
+import json
 from data.connection import query
 from fastapi import HTTPException, status
-from typing import Optional, List
-from services.user_services import get_account_balance
-from data.schemas import AmountOut
+from typing import Optional, List, Iterator
+from data.schemas import AmountOut, CategoryTotal
 from datetime import date, datetime, time
 from data.models import Transaction
-from data.helpers import find_user_by_id, ADMIN_ERROR, is_admin, pagination_offset, update_transaction, get_transaction, \
-    TRANSACTION_ERROR
+from data.user_loader import get_user_loader
+from data.contact_writer import contact_writer
+from data.recipient_ranking import recipient_ranking
+from data.helpers import ADMIN_ERROR, is_admin, update_transaction, get_transaction, \
+    TRANSACTION_ERROR, encode_cursor, keyset_filter
+
+# server-side procedure, see script/move_money.sql
+MOVE_MONEY_PROCEDURE = 'move_money'
+TRANSACTIONS_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# rows read per query when exporting, the export holds at most one chunk in memory
+EXPORT_CHUNK_SIZE = 500
+EXPORT_COLUMNS = ('id', 'created_at', 'amount', 'sender_id', 'receiver_id', 'status', 'category', 'acceptation')
+EXPORT_MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
 
 
 def get_logged_user_transactions(user_id: int, transaction_type: str = None, sort_by: Optional[str] = 'created_at',
-                                 order: Optional[str] = 'desc', transaction_status: str = 'all') -> List[
-                                                                                                        object] | HTTPException:
-    """Retrieves all transactions for a user by sender ID, including sent, received, and filtered by transaction status.
-    Ensures no duplicate transactions by checking for deposits where sender_id and receiver_id are the same. Raises a 404
-    HTTP exception if no transactions are found."""
+                                 order: Optional[str] = 'desc', transaction_status: str = 'all', cursor: str = None,
+                                 limit: int = TRANSACTIONS_PAGE_SIZE) -> tuple[list[dict], str | None]:
+    """Retrieves one page of the user's transactions, sent, received or both, optionally filtered by status.
+    The filters, the (sort_by, id) order and the cursor are applied by the database in a single query,
+    a deposit or withdrawal, where the user is both sender and receiver, is returned once.
+    Returns the page and the cursor of the next page, None on the last page. Raises a 404
+    HTTP exception if the user has no matching transactions."""
 
     if is_admin(user_id):
         raise ADMIN_ERROR
 
-    transactions = []
+    sort_by = sort_by or 'created_at'
 
-    # if all query params are default, this will be the output data
-    sender_data = query.table('transactions').select('*').eq('sender_id', user_id).execute()
-    receiver_data = query.table('transactions').select('*').eq('receiver_id', user_id).execute()
-    transactions.extend(sender_data.data)
-    transactions.extend(receiver_data.data)
-
-    # get transactions if the logged user is sender of the transaction
-    if transaction_type == 'sent':
-        transactions.clear()
-        transactions.extend(sender_data.data)
-
-    # get transactions if the logged user is receiver of the transaction
-    elif transaction_type == 'received':
-        transactions.clear()
-        transactions.extend(receiver_data.data)
-
-    # get transaction status of the transactions which logged user SENT
+    conditions = _user_conditions(user_id, transaction_type)
     if transaction_status in ['confirmed', 'pending', 'declined']:
-        transactions.clear()
-        transactions_data = query.table('transactions').select('*').eq('status', transaction_status).eq(
-            'sender_id',
-            user_id).execute()
-        transactions.extend(transactions_data.data)
+        conditions.append(f'status.eq.{transaction_status}')
 
-    if not transactions:
+    transactions, next_cursor, _ = _keyset_page(query.table('transactions').select('*'), conditions, sort_by,
+                                                order != 'asc', cursor, limit)
+
+    if not transactions and not cursor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f'User with id {user_id} has no {transaction_status} transactions!')
 
-    # Here we check if transactions list has duplicate transactions.
-    # If this check does not exist when retrieving transactions from the ATM,
-    # duplicates will occur. Our logic is to retrieve transactions using sender_
-    # id and receiver_id, but when there is a deposit from the ATM, both sender_id
-    # and receiver_id will be the same.
-    unique_transactions = []
-
-    # set does not allow to have multiple values in it
-    transaction_ids = set()
-    for transaction in transactions:
-        # here we check if transaction id exists in the set
-        if transaction['id'] not in transaction_ids:
-            # if this transaction id is not in the set, we can append the transaction to unique_transactions
-            unique_transactions.append(transaction)
-            # and add the id in the set
-            transaction_ids.add(transaction['id'])
-
-    transactions = unique_transactions
-
-    if sort_by:
-        reverse = (order == "desc")
-        transactions.sort(key=lambda x: x[sort_by], reverse=reverse)
-
-    return transactions
-
-
-def transfer_money(sender_id: int, receiver_id: int, amount: float, category: str):
-    sender = find_user_by_id(sender_id)
-    if not sender:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Sender with id: {sender_id} not found!')
-    if sender.is_admin:
-        raise ADMIN_ERROR
+    return transactions, next_cursor
 
-    if sender.is_blocked:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail='You are blocked! You cannot make transactions!')
-
-    receiver = find_user_by_id(receiver_id)
-
-    if not sender:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Sender with id: {sender_id} not found!')
-
-    if not receiver:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Receiver with id: {receiver_id} not found!')
-
-    sender_balance = sender.amount
-    receiver_balance = receiver.amount
-
-    if sender_balance < amount:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail='Insufficient balance')
-
-    new_sender_balance = sender_balance - amount
-
-    query.table('users').update({'amount': new_sender_balance}).eq(
-        'id', sender_id).execute()
-
-    transaction_data = {
-        'id': sender_id,
-        'receiver_id': receiver_id,
-        'amount': amount,
-        'status': "pending",
-        'category': category,
-        'created_at': datetime.now()
-    }
-    
-    save_contact = {
-        'contact_name_id': receiver_id,
-        'current_user': sender_id
-    }
-    
-    existing_contact = query.table('contacts').select('id', 'receiver_id').eq('id',sender_id).eq('receiver_id', receiver_id).execute()
-    if existing_contact.data:
-        insert_transaction = query.table('transactions').insert(transaction_data).execute()
-    else:
-        insert_transaction = query.table('transactions').insert(transaction_data).execute()
-        query.table('contacts').insert(save_contact).execute()
-    
-    return 'Successful', insert_transaction
 
+def move_money(operation: str, user_id: int, counterparty_id: int = None, amount: float = None,
+               category: str = None, transaction_id: int = None, action: str = None) -> dict:
+    """Runs the move_money procedure (script/move_money.sql), which validates, debits, credits and writes the
+    transaction row in one database transaction and one round trip. Validation errors come back in the result
+    and are raised here as HTTPException."""
 
-def deposit_money(deposit_amount: float, logged_user_id: int) -> AmountOut:
-    """The deposit_money function is designed to update the account balance of a logged-in user
-    by adding a specified deposit amount to their current balance."""
+    result = query.rpc(MOVE_MONEY_PROCEDURE, {
+        'p_operation': operation,
+        'p_user_id': user_id,
+        'p_counterparty_id': counterparty_id,
+        'p_amount': amount,
+        'p_category': category,
+        'p_transaction_id': transaction_id,
+        'p_action': action
+    }).execute().data
 
-    if is_admin(logged_user_id):
+    if result.get('error') == 'admin':
         raise ADMIN_ERROR
+    if result.get('error'):
+        raise HTTPException(status_code=result['status'], detail=result['detail'])
 
-    user_balance_data = get_account_balance(logged_user_id)
-
-    user_balance = user_balance_data.balance
-
-    if deposit_amount <= 0:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail='The deposit sum has to be a positive number!')
+    # balances of both sides may have changed, cached copies of them are stale now
+    user_loader = get_user_loader()
+    user_loader.forget(result['transaction']['sender_id'])
+    user_loader.forget(result['transaction']['receiver_id'])
 
-    new_balance = user_balance + deposit_amount
+    return result
 
-    # update the balance of the user
-    update_balance_data = query.table('users').update({"amount": new_balance}).eq('id', logged_user_id).execute()
 
-    # get the user amount, because we need it for make a record in transactions table
-    update_balance_list = update_balance_data.data
-    update_balance = update_balance_list[0]["amount"]
-
-    # transaction category
-    category = 'atm'
-
-    # make a transaction record
-    query.table('transactions').insert(
-        {'amount': deposit_amount, "sender_id": logged_user_id, "receiver_id": logged_user_id, "status": "confirmed",
-         "category": category, "acceptation": 'accept'}).execute()
-
-    return AmountOut(message="Balance updated!", old_balance=user_balance, new_balance=new_balance)
+def transfer_money(sender_id: int, receiver_id: int, amount: float, category: str):
+    """Sends money to another user. The sender is debited right away, the transaction stays pending
+    until the sender confirms it and the receiver accepts it."""
 
+    result = move_money('transfer', sender_id, counterparty_id=receiver_id, amount=amount, category=category)
+    # the receiver becomes one of the sender's contacts, written in the background
+    contact_writer.add(sender_id, receiver_id)
+    recipient_ranking.record(sender_id, receiver_id)
 
-def withdraw_money(withdraw_sum: float, logged_user_id: int):
+    return 'Successful', result['transaction']
 
-    if is_admin(logged_user_id):
-        raise ADMIN_ERROR
 
-    user_balance_data = get_account_balance(logged_user_id)
-
-    user_balance = user_balance_data.balance
+def deposit_money(deposit_amount: float, logged_user_id: int) -> AmountOut:
+    """The deposit_money function is designed to update the account balance of a logged-in user
+    by adding a specified deposit amount to their current balance."""
 
-    if withdraw_sum <= 0:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='The sum has to be a positive number')
+    result = move_money('deposit', logged_user_id, amount=deposit_amount)
 
-    if user_balance < withdraw_sum:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Insufficient balance')
+    return AmountOut(message="Balance updated!", old_balance=result['old_balance'], new_balance=result['new_balance'])
 
-    new_balance = user_balance - withdraw_sum
 
-    update_result_data = query.table('users').update({'amount': new_balance}).eq('id', logged_user_id).execute()
-    update_result = update_result_data.data[0]['amount']
-    category = 'atm'
-    query.table('transactions').insert(
-        {'amount': withdraw_sum, "sender_id": logged_user_id, "receiver_id": logged_user_id, "status": "confirmed",
-         "category": category, "acceptation": 'accepted'}).execute()
+def withdraw_money(withdraw_sum: float, logged_user_id: int):
+    result = move_money('withdraw', logged_user_id, amount=withdraw_sum)
 
-    return AmountOut(message="Balance updated!", old_balance=user_balance, new_balance=new_balance)
+    return AmountOut(message="Balance updated!", old_balance=result['old_balance'], new_balance=result['new_balance'])
 
 
 def confirm_transaction(confirm_or_decline: str, transaction_id: int, logged_user_id: int):
-    if is_admin(logged_user_id):
-        raise ADMIN_ERROR
-
-    transaction_data = query.table('transactions').select('*').eq('id', transaction_id).eq('sender_id',
-                                                                                           logged_user_id).eq('status',
-                                                                                                              'pending').execute()
-
-    if not transaction_data.data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f'Transaction with id: {transaction_id} is not found! You can confirm only pending '
-                                   f'transactions!')
-
-    transaction = transaction_data.data[0]
-    transaction_amount = transaction['amount']
-    sender_id = transaction['sender_id']
-
-    sender_account_balance = get_account_balance(sender_id).balance
-
-    confirm_or_deny_list = ['confirm', 'deny']
+    """The sender confirms a pending transaction or denies it, which gives the money back to the sender."""
 
-    if confirm_or_decline not in confirm_or_deny_list:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail='You can only "confirm" or "deny" the transaction!')
+    move_money('confirm', logged_user_id, transaction_id=transaction_id, action=confirm_or_decline)
 
-    if confirm_or_decline == 'decline':
-        new_sender_account_balance = sender_account_balance + transaction_amount
-        query.table('users').update({'amount': new_sender_account_balance}).eq('id', sender_id).execute()
-        query.table('transactions').update({'status': 'declined'}).eq('id', transaction_id).execute()
-        return f'Transaction with id: {transaction_id} was DECLINED!'
-    elif confirm_or_decline == 'confirm':
-        query.table('transactions').update({'status': 'confirmed'}).eq('id', transaction_id).execute()
+    if confirm_or_decline == 'confirm':
         return f'Transaction with id: {transaction_id} was CONFIRMED!'
+    return f'Transaction with id: {transaction_id} was DECLINED!'
 
 
 def accept_transaction(transaction_id: int, acceptation: str, logged_user_id: int) -> str:
-    if is_admin(logged_user_id):
-        raise ADMIN_ERROR
-
     """Handles the acceptance or decline of a transaction for a logged-in user.
        If the transaction is confirmed and pending, it updates the transaction's
        acceptation status and adjusts user balances accordingly. Raises HTTP
        exceptions if the transaction is not found, already accepted, not confirmed
        by the sender, or if the acceptation status is invalid."""
 
-    transaction_data = (query.table('transactions').select('*')
-                        .eq('id', transaction_id)
-                        .eq('receiver_id', logged_user_id)
-                        .eq('acceptation', 'pending')
-                        .execute())
-
-    if not transaction_data.data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f'Transaction with id: {transaction_id} not found or is already accepted!')
-
-    transaction_status = transaction_data.data[0]['status']
-    transaction_amount = transaction_data.data[0]['amount']
-    transaction_sender_id = transaction_data.data[0]['sender_id']
-    transaction_acceptation = transaction_data.data[0]['acceptation']
-
-    # here we get the logged user amount
-    logged_user_balance = get_account_balance(logged_user_id).balance
-
-    # we can make acceptation ONLY if transaction is CONFIRMED by the SENDER!
-    if transaction_status != 'confirmed':
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=f'Transaction with id: {transaction_id} is NOT CONFIRMED by the sender!')
-
-    # acceptation can be only "accept", "pending" or "decline"!
-    if acceptation not in ['accept', 'pending', 'decline']:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail='Acceptation could be only accept, pending, decline!'
-                            )
-
-    # here we check if acceptation is chosen to "accept", the logged user get amount of confirmed transaction
-    if transaction_status == 'confirmed' and transaction_acceptation == 'pending' and acceptation == 'accept':
-        new_logged_user_balance = transaction_amount + logged_user_balance
-
-        query.table('users').update({'amount': new_logged_user_balance}).eq('id', logged_user_id).execute()
-
-        query.table('transactions').update({'acceptation': 'accepted'}).eq('id', transaction_id).execute()
+    move_money('accept', logged_user_id, transaction_id=transaction_id, action=acceptation)
 
+    if acceptation == 'accept':
         return f'Transaction with id: {transaction_id} successfully accepted!'
-
-    # here we check if acceptation is chosen to "decline" the logged user do NOT get amount of confirmed transaction
-    elif transaction_status == 'confirmed' and transaction_acceptation == 'pending' and acceptation == 'decline':
-        transaction_sender_amount_data = query.table('users').select('*').eq('id', transaction_sender_id).execute()
-
-        old_transaction_sender_amount = transaction_sender_amount_data.data[0]['amount']
-
-        new_transaction_sender_amount = old_transaction_sender_amount + transaction_amount
-
-        query.table('users').update({'amount': new_transaction_sender_amount}).eq('id', transaction_sender_id).execute()
-
-        query.table('transactions').update({'acceptation': 'declined'}).eq('id', transaction_id).execute()
-
+    if acceptation == 'decline':
         return f'Transaction with id: {transaction_id} successfully declined!'
 
     # if acceptation is chosen to "pending":
@@ -359,17 +200,42 @@ def accept_transaction(transaction_id: int, acceptation: str, logged_user_id: in
 
 
 
-def get_all_transactions(user_id, logged_user_id, page, sent_or_received, start_date,
-                         end_date, direction, sort, order: str = 'desc'):
+def get_all_transactions(user_id, logged_user_id, sent_or_received=None, start_date=None, end_date=None,
+                         direction=None, sort: str = 'created_at', order: str = 'desc', cursor: str = None,
+                         page_size: int = TRANSACTIONS_PAGE_SIZE, with_count: bool = False) -> dict:
+    """Admin view of the transactions, one page in (sort, id) order sorted by the database.
+    Pass the returned next_cursor as cursor for the next page, with_count adds the estimated number
+    of matching transactions, which the database takes from its statistics instead of counting the rows."""
     if not is_admin(logged_user_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Only ADMIN users can do this!')
 
-    records_per_page = 3
-    page_offset = pagination_offset(page, records_per_page)
-
     # Initialize the query
-    query_obj = query.table('transactions').select('*')
+    query_obj = query.table('transactions').select('*', count='estimated' if with_count else None)
+    query_obj = _filter_all_transactions(query_obj, user_id, sent_or_received, start_date, end_date, direction)
+
+    transactions, next_cursor, estimated_total = _keyset_page(query_obj, [], sort or 'created_at', order != 'asc',
+                                                              cursor, page_size)
+
+    if not transactions and not cursor:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No transactions!')
+
+    result = {'transactions': transactions, 'next_cursor': next_cursor}
+    if with_count:
+        result['estimated_total'] = estimated_total
+    return result
+
 
+def _user_conditions(user_id: int, transaction_type: str = None) -> list[str]:
+    # a deposit or withdrawal has the user as both sender and receiver and matches once
+    if transaction_type == 'sent':
+        return [f'sender_id.eq.{user_id}']
+    if transaction_type == 'received':
+        return [f'receiver_id.eq.{user_id}']
+    return [f'or(sender_id.eq.{user_id},receiver_id.eq.{user_id})']
+
+
+def _filter_all_transactions(query_obj, user_id, sent_or_received=None, start_date=None, end_date=None, direction=None,
+                             category: str = None):
     if sent_or_received == 'sent':
         query_obj = query_obj.eq('sender_id', user_id)
 
@@ -389,18 +255,98 @@ def get_all_transactions(user_id, logged_user_id, page, sent_or_received, start_
         elif direction == 'outgoing':
             query_obj = query_obj.eq('sender_id', user_id)
 
-    # Paginate the query
-    transactions_data = query_obj.range(page_offset, page_offset + records_per_page - 1).execute()
-    transactions = transactions_data.data
+    if category:
+        query_obj = query_obj.eq('category', category)
 
-    if not transactions:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No transactions!')
+    return query_obj
 
-    if sort in ['amount', 'created_at']:
-        reverse = (order == "desc")
-        transactions.sort(key=lambda x: x[sort], reverse=reverse)
 
-    return transactions
+def _keyset_page(rows_query, conditions: list[str], sort_by: str, descending: bool, cursor: str | None,
+                 limit: int) -> tuple[list[dict], str | None, int | None]:
+    """Runs rows_query for the page after cursor in (sort_by, id) order, conditions are PostgREST filters
+    which must all match. Returns the rows, the cursor of the next page or None and the response count."""
+    if cursor:
+        conditions = [*conditions, keyset_filter(cursor, sort_by, descending)]
+    if conditions:
+        rows_query = rows_query.or_(f'and({",".join(conditions)})')
+
+    # one extra row tells whether there is a next page
+    response = rows_query.order(sort_by, desc=descending).order('id', desc=descending).limit(limit + 1).execute()
+    rows = response.data
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], sort_by)
+
+    return rows, next_cursor, response.count
+
+
+def export_user_transactions(user_id: int, export_format: str = 'csv', transaction_type: str = None,
+                             start_date: Optional[date] = None, end_date: Optional[date] = None,
+                             category: str = None) -> Iterator[str]:
+    """Statement of the user's transactions as CSV or NDJSON text chunks, oldest first.
+    The transactions are read EXPORT_CHUNK_SIZE at a time, so memory use does not grow with the history."""
+    if is_admin(user_id):
+        raise ADMIN_ERROR
+
+    conditions = _user_conditions(user_id, transaction_type)
+
+    def transactions_query():
+        query_obj = query.table('transactions').select(*EXPORT_COLUMNS)
+        return _filter_all_transactions(query_obj, user_id, start_date=_export_start(start_date),
+                                        end_date=_export_end(end_date), category=category)
+
+    return _export_chunks(transactions_query, conditions, export_format)
+
+
+def export_all_transactions(user_id: int, logged_user_id: int, export_format: str = 'csv', sent_or_received=None,
+                            start_date: Optional[date] = None, end_date: Optional[date] = None, direction=None,
+                            category: str = None) -> Iterator[str]:
+    """Admin export with the filters of get_all_transactions, streamed like export_user_transactions."""
+    if not is_admin(logged_user_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Only ADMIN users can do this!')
+
+    def transactions_query():
+        query_obj = query.table('transactions').select(*EXPORT_COLUMNS)
+        return _filter_all_transactions(query_obj, user_id, sent_or_received, _export_start(start_date),
+                                        _export_end(end_date), direction, category)
+
+    return _export_chunks(transactions_query, [], export_format)
+
+
+def _export_start(start_date: Optional[date]) -> str | None:
+    return start_date.isoformat() if start_date else None
+
+
+def _export_end(end_date: Optional[date]) -> str | None:
+    # the whole end day is included
+    return datetime.combine(end_date, time.max).isoformat() if end_date else None
+
+
+def _export_chunks(transactions_query, conditions: list[str], export_format: str) -> Iterator[str]:
+    """Pages through the query in created_at order, one text chunk per page.
+    transactions_query builds a fresh query for every page."""
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        yield buffer.getvalue()
+
+    cursor = None
+    while True:
+        transactions, cursor, _ = _keyset_page(transactions_query(), conditions, 'created_at', False, cursor,
+                                               EXPORT_CHUNK_SIZE)
+        if export_format == 'csv':
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(transactions)
+            yield buffer.getvalue()
+        else:
+            yield ''.join(json.dumps(transaction) + '\n' for transaction in transactions)
+
+        if cursor is None:
+            return
 
 
 def deny_transaction(transaction_id, logged_user_id) -> str | HTTPException:
@@ -444,7 +390,6 @@ def edit_category(transaction_id: int, category_name: str, logged_user_id: int):
 def get_category_report(order: str, category_name: str, logged_user_id: int,
                         start_date: Optional[date] = None, end_date: Optional[date] = None):
 
-    sort = 'created_at'
     data = query.table('transactions').select('*').eq('category', category_name).eq('sender_id', logged_user_id)
 
     if start_date:
@@ -452,16 +397,40 @@ def get_category_report(order: str, category_name: str, logged_user_id: int,
     if end_date:
         data = data.lte('created_at', end_date.isoformat())
 
-    transactions = data.execute().data
+    transactions = data.order('created_at', desc=(order == 'desc')).execute().data
 
     if not transactions:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='Something is wrong! May category with this name does not exist or dates are '
                                    'invalid!')
 
-    for transaction in transactions:
-        transaction['created_at'] = datetime.fromisoformat(transaction['created_at'])
+    return transactions
 
-    transactions.sort(key=lambda x: x[sort], reverse=(order == 'desc'))
 
-    return transactions
+def get_category_totals(logged_user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                        category_name: str = None) -> List[CategoryTotal]:
+    """Spending of the user per category between start_date and end_date, both included, largest total first.
+    It reads the daily rollups kept by script/category_rollups.sql, one row per category and day,
+    so the cost depends on the number of days and not on the number of transactions."""
+    data = (query.table('category_rollups').select('category', 'total', 'count', 'min_amount', 'max_amount')
+            .eq('user_id', logged_user_id))
+
+    if start_date:
+        data = data.gte('day', start_date.isoformat())
+    if end_date:
+        data = data.lte('day', end_date.isoformat())
+    if category_name is not None:
+        data = data.eq('category', category_name)
+
+    totals = {}
+    for day in data.execute().data:
+        category = totals.get(day['category'])
+        if category is None:
+            totals[day['category']] = CategoryTotal(**day)
+            continue
+        category.total += day['total']
+        category.count += day['count']
+        category.min_amount = min(category.min_amount, day['min_amount'])
+        category.max_amount = max(category.max_amount, day['max_amount'])
+
+    return sorted(totals.values(), key=lambda category: category.total, reverse=True)
@@ -1,11 +1,15 @@
 from data.connection import query
-from data.schemas import UserOut
+from data.schemas import UserOut, GetUser
+from data.async_connection import get_async_query
 from fastapi import HTTPException, status
-from security.password_hashing import get_password_hash
+from security.password_hashing import get_password_hash, verify_password, verify_and_update, \
+    verify_and_update_async
 from data.helpers import get_account_balance, find_user_by_email, find_user_by_id, find_user_by_username, \
     find_user_by_phone_number, \
     PHONE_NUMBER_ERROR, EMAIL_ERROR, USERNAME_ERROR, ID_ERROR, pagination_offset, is_admin, is_valid_email, \
-    is_valid_password
+    is_valid_password, get_account_balance_async, find_user_by_email_async, find_user_by_id_async, is_admin_async
+from data.user_loader import get_user_loader
+from common.authorization import revoke_user_tokens
 
 
 def get_user_balance(logged_user_id):
@@ -13,6 +17,10 @@ def get_user_balance(logged_user_id):
     return user_balance
 
 
+async def get_user_balance_async(logged_user_id):
+    return await get_account_balance_async(logged_user_id)
+
+
 def create(username: str, password: str, email: str, phone_number: str) -> UserOut | HTTPException:
     """This function creates a new user with the specified username, password, email, and phone number.
     It validates the input data and raises HTTP exceptions if any validation fails."""
@@ -77,6 +85,33 @@ def try_login(email: str, password: str) -> UserOut | HTTPException:
     it raises an HTTP exception with a 401 Unauthorized status code."""
 
     user = find_user_by_email(email)
+    _check_user(user)
+
+    verified, new_hash = verify_and_update(password, user.password)
+    _check_password(verified)
+    if new_hash:
+        query.table('users').update({'password': new_hash}).eq('id', user.id).execute()
+        get_user_loader().forget(user.id)
+
+    return _user_out(user)
+
+
+async def try_login_async(email: str, password: str) -> UserOut | HTTPException:
+    """Async version of try_login for async routes, the password is hashed on the hashing pool."""
+
+    user = await find_user_by_email_async(email)
+    _check_user(user)
+
+    verified, new_hash = await verify_and_update_async(password, user.password)
+    _check_password(verified)
+    if new_hash:
+        await get_async_query().table('users').update({'password': new_hash}).eq('id', user.id).execute()
+        get_user_loader().forget(user.id)
+
+    return _user_out(user)
+
+
+def _check_user(user: GetUser | None):
     if not user:
         raise EMAIL_ERROR
 
@@ -85,12 +120,15 @@ def try_login(email: str, password: str) -> UserOut | HTTPException:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail='User registration is not confirmed already by Admin, try again later!')
 
-    hashed_password = get_password_hash(password)
 
+def _check_password(verified: bool):
     # check if password of current user is invalid, raise exception
-    if user.password != hashed_password:
+    # a legacy SHA-256 hash that matches is replaced by a salted one by the caller
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Please, enter a valid password!')
 
+
+def _user_out(user: GetUser) -> UserOut:
     return UserOut(id=user.id, username=user.username, email=user.email, phone_number=user.phone_number,
                    created_at=user.created_at)
 
@@ -110,8 +148,6 @@ def update_profile(password: str, email: str, phone_number: str, logged_user_id:
     current_user_email = current_user.email
     current_user_phone_number = current_user.phone_number
 
-    hashed_pass = get_password_hash(password)
-
     # validation step
     is_valid_pass = is_valid_password(password)
     is_valid_email_data = is_valid_email(email)
@@ -126,10 +162,11 @@ def update_profile(password: str, email: str, phone_number: str, logged_user_id:
     # here we will put the credentials to update, and we use it in the update method from query
     change_credentials_dict = {}
 
-    # here we check if current password is different from new password
-    if current_user_password != hashed_pass:
+    # here we check if current password is different from new password, hashes are salted so the stored one is
+    # verified instead of compared
+    if not verify_password(password, current_user_password):
         # if is different, we add the new password to the dict
-        change_credentials_dict.update(password=hashed_pass)
+        change_credentials_dict.update(password=get_password_hash(password))
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Choose different password! ')
 
@@ -147,6 +184,7 @@ def update_profile(password: str, email: str, phone_number: str, logged_user_id:
 
     # and finally, we pass our change_credentials_dict to query method update
     (query.table('users').update(change_credentials_dict).eq('id', logged_user_id).execute())
+    get_user_loader().forget(logged_user_id)
 
     return 'Credentials updated!'
 
@@ -160,16 +198,43 @@ def get_logged_user(logged_user_id: int) -> UserOut | HTTPException:
                    phone_number=logged_user.phone_number, created_at=logged_user.created_at)
 
 
+async def get_logged_user_async(logged_user_id: int) -> UserOut | HTTPException:
+    """Async version of get_logged_user for async routes."""
+    logged_user = await find_user_by_id_async(logged_user_id)
+
+    return UserOut(id=logged_user.id, username=logged_user.username, email=logged_user.email,
+                   phone_number=logged_user.phone_number, created_at=logged_user.created_at)
+
+
 def get_all_users(logged_user_id: int, username: str = None, email: str = None, phone_number: str = None,
                   registered: bool = None, page: int = 1):
-    records_per_page = 3
-    page_offset = pagination_offset(page, records_per_page)
-
     if not is_admin(logged_user_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail='Only ADMIN users can get information for all users!')
 
-    query_builder = query.table('users').select('*').range(page_offset, page_offset + records_per_page - 1).order('id')
+    users_data = _all_users_query(query, username, email, phone_number, registered, page).execute()
+    users = users_data.data
+
+    return users
+
+
+async def get_all_users_async(logged_user_id: int, username: str = None, email: str = None,
+                              phone_number: str = None, registered: bool = None, page: int = 1):
+    """Async version of get_all_users for async routes."""
+    if not await is_admin_async(logged_user_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail='Only ADMIN users can get information for all users!')
+
+    users_data = await _all_users_query(get_async_query(), username, email, phone_number, registered,
+                                        page).execute()
+    return users_data.data
+
+
+def _all_users_query(client, username: str, email: str, phone_number: str, registered: bool, page: int):
+    records_per_page = 3
+    page_offset = pagination_offset(page, records_per_page)
+
+    query_builder = client.table('users').select('*').range(page_offset, page_offset + records_per_page - 1).order('id')
 
     if phone_number:
         query_builder = query_builder.eq('phone_number', phone_number)
@@ -180,10 +245,7 @@ def get_all_users(logged_user_id: int, username: str = None, email: str = None,
     if registered is not None:
         query_builder = query_builder.eq('is_registered', registered)
 
-    users_data = query_builder.execute()
-    users = users_data.data
-
-    return users
+    return query_builder
 
 
 def confirm_user_registration(confirmation: bool, user_email: str, logged_user_id: int):
@@ -209,12 +271,16 @@ def confirm_user_registration(confirmation: bool, user_email: str, logged_user_i
 
     if confirmation is True:
         query.table('users').update({'is_registered': confirmation}).eq('id', user.id).execute()
+        get_user_loader().forget(user.id)
         return 'Confirmation for this user is successful!'
 
     return 'Confirmation for this user is NOT successful!'
 
 
 def block_user(block_status: bool, user_id: int, logged_user_id: int):
+    # the admin check and the blocked user lookup are resolved by one users query
+    get_user_loader().prime(logged_user_id, user_id)
+
     if not is_admin(logged_user_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Only ADMIN users can block user!')
 
@@ -227,5 +293,8 @@ def block_user(block_status: bool, user_id: int, logged_user_id: int):
             query.table('users').update({'is_blocked': block_status}).eq('id', user_id).execute()
         else:
             query.table('users').update({'is_blocked': block_status}).eq('id', user_id).execute()
+        get_user_loader().forget(user_id)
+        # tokens carry the blocked claim, the user has to log in again to get one with the new status
+        revoke_user_tokens(user_id)
 
     return f'Block status: {block_status} set successfully!'
@@ -0,0 +1,162 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.testclient import TestClient
+from jose import jwt
+
+import common.authorization
+from common.authorization import create_user_token, verify_access_token, revoke_user_tokens, SECRET_KEY, ALGORITHM, \
+    TokenCache
+from data.helpers import is_admin
+from data.revocation_store import MemoryRevocationStore
+from data.schemas import GetUser
+from data.user_loader import user_loader_scope
+
+CREDENTIALS_ERROR = HTTPException(status_code=401, detail='Could not validate credentials')
+
+
+def make_user(is_admin=False, is_blocked=False) -> GetUser:
+    return GetUser(id=1, username='test', password='x', email='test@test.com', phone_number='1234567890',
+                   is_admin=is_admin, amount=0.0, is_registered=True, is_blocked=is_blocked)
+
+
+def verify(token: str):
+    return verify_access_token(HTTPAuthorizationCredentials(scheme='Bearer', credentials=token), CREDENTIALS_ERROR)
+
+
+@pytest.fixture(autouse=True)
+def no_revocations():
+    with patch.object(common.authorization, 'revocations', MemoryRevocationStore()), \
+            patch.object(common.authorization, 'verified_tokens', TokenCache()):
+        yield
+
+
+def count_decodes():
+    return patch('common.authorization.jwt.decode', side_effect=jwt.decode)
+
+
+def test_token_carries_claims():
+    principal = verify(create_user_token(make_user(is_admin=True, is_blocked=True)))
+
+    assert principal.user_id == 1
+    assert principal.is_admin is True
+    assert principal.is_blocked is True
+    assert principal.is_registered is True
+    assert principal.claims_expired is False
+
+
+def test_token_without_claims_has_expired_claims():
+    token = jwt.encode({'user_id': 1, 'exp': datetime.utcnow() + timedelta(minutes=5)}, SECRET_KEY,
+                       algorithm=ALGORITHM)
+
+    principal = verify(token)
+
+    assert principal.user_id == 1
+    assert principal.claims_expired is True
+
+
+def test_revoked_token_is_rejected():
+    token = create_user_token(make_user())
+
+    revoke_user_tokens(1)
+
+    with pytest.raises(HTTPException):
+        verify(token)
+
+
+def test_admin_check_is_answered_from_claims():
+    principal = verify(create_user_token(make_user(is_admin=True)))
+
+    with patch('data.user_loader.query') as mock_query, user_loader_scope() as user_loader:
+        user_loader.remember(principal)
+
+        assert is_admin(1) is True
+        mock_query.table.assert_not_called()
+
+
+def test_admin_check_with_expired_claims_reads_the_user():
+    principal = verify(create_user_token(make_user(is_admin=True)))
+    principal.claims_expire_at = datetime.utcnow() - timedelta(seconds=1)
+
+    with patch('data.helpers.find_user_by_id', return_value=MagicMock(is_admin=False)) as mock_find_user_by_id, \
+            user_loader_scope() as user_loader:
+        user_loader.remember(principal)
+
+        assert is_admin(1) is False
+        mock_find_user_by_id.assert_called_once_with(1)
+
+
+def test_token_is_decoded_once():
+    token = create_user_token(make_user())
+
+    with count_decodes() as decode:
+        first, second = verify(token), verify(token)
+
+    assert decode.call_count == 1
+    assert first == second
+    assert first is not second
+
+
+def test_cached_token_is_still_revoked():
+    token = create_user_token(make_user())
+    verify(token)
+
+    revoke_user_tokens(1)
+
+    with pytest.raises(HTTPException):
+        verify(token)
+
+
+def test_expired_token_leaves_the_cache():
+    cache = TokenCache()
+    cache.put('token', {'user_id': 1}, None, expires_at=0)
+
+    assert cache.get('token') is None
+
+
+def test_cache_drops_the_least_recently_used_token():
+    cache = TokenCache(max_size=2)
+    for token in ('a', 'b'):
+        cache.put(token, {'user_id': 1}, None, expires_at=float('inf'))
+    cache.get('a')
+    cache.put('c', {'user_id': 1}, None, expires_at=float('inf'))
+
+    assert (cache.get('a'), cache.get('b')) == (({'user_id': 1}, None), None)
+
+
+def test_request_verifies_its_token_once():
+    from main import app
+    token = create_user_token(make_user(is_admin=True))
+    client = TestClient(app)
+
+    with count_decodes() as decode:
+        response = client.get('/recurring_transactions/metrics', headers={'Authorization': f'Bearer {token}'},
+                              cookies={'access_token': token})
+        static = client.get('/static/styles.css', cookies={'access_token': token})
+
+    assert (response.status_code, static.status_code) == (200, 200)
+    assert decode.call_count == 1
+
+
+def test_logout_revokes_only_that_token():
+    from common.authorization import logout_user
+    token, other = create_user_token(make_user()), create_user_token(make_user())
+
+    logout_user(HTTPAuthorizationCredentials(scheme='Bearer', credentials=token))
+
+    with pytest.raises(HTTPException):
+        verify(token)
+    assert verify(other).user_id == 1
+
+
+def test_token_without_jti_can_be_logged_out():
+    from common.authorization import logout_user
+    token = jwt.encode({'user_id': 1, 'exp': datetime.utcnow() + timedelta(minutes=5)}, SECRET_KEY,
+                       algorithm=ALGORITHM)
+
+    logout_user(HTTPAuthorizationCredentials(scheme='Bearer', credentials=token))
+
+    with pytest.raises(HTTPException):
+        verify(token)
@@ -0,0 +1,63 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from data.cadence import parse_cadence, first_run, next_run
+
+ANCHOR = datetime(2024, 1, 31, 9, 30)
+
+
+def runs(recurring_time, anchor=ANCHOR, count=4):
+    cadence = parse_cadence(recurring_time)
+    moments = [first_run(cadence, anchor)]
+    while len(moments) < count:
+        moments.append(next_run(cadence, anchor, moments[-1]))
+    return moments
+
+
+def test_interval_runs_are_counted_from_the_anchor():
+    cadence = parse_cadence('daily')
+
+    # a run paid late does not move the following ones
+    assert next_run(cadence, ANCHOR, datetime(2024, 2, 3, 17, 0)) == datetime(2024, 2, 4, 9, 30)
+    assert runs('weekly', count=2) == [ANCHOR, datetime(2024, 2, 7, 9, 30)]
+
+
+def test_monthly_keeps_the_anchor_day_after_short_months():
+    assert runs('monthly') == [ANCHOR, datetime(2024, 2, 29, 9, 30), datetime(2024, 3, 31, 9, 30),
+                               datetime(2024, 4, 30, 9, 30)]
+
+
+def test_monthly_on_a_day_of_month():
+    assert runs('monthly:15', count=2) == [datetime(2024, 2, 15, 9, 30), datetime(2024, 3, 15, 9, 30)]
+
+
+def test_cron_expression():
+    # 9:00 and 17:00 on weekdays, January 31st 2024 is a Wednesday
+    assert runs('cron:0 9,17 * * 1-5') == [datetime(2024, 1, 31, 17, 0), datetime(2024, 2, 1, 9, 0),
+                                           datetime(2024, 2, 1, 17, 0), datetime(2024, 2, 2, 9, 0)]
+    assert runs('cron:*/20 * * * *', count=2) == [datetime(2024, 1, 31, 9, 40), datetime(2024, 1, 31, 10, 0)]
+
+
+def test_cron_day_of_month_or_day_of_week():
+    # like cron, the 1st of the month or any Sunday
+    assert runs('cron:0 0 1 * 0', count=3) == [datetime(2024, 2, 1), datetime(2024, 2, 4), datetime(2024, 2, 11)]
+
+
+def test_runs_keep_the_anchor_timezone():
+    anchor = datetime(2024, 1, 31, 9, 30, tzinfo=timezone.utc)
+
+    assert next_run(parse_cadence('monthly'), anchor, anchor) == datetime(2024, 2, 29, 9, 30, tzinfo=timezone.utc)
+
+
+def test_far_catch_up_is_computed_directly():
+    cadence = parse_cadence('minutely')
+
+    assert next_run(cadence, ANCHOR, ANCHOR + timedelta(days=365, seconds=1)) == \
+           ANCHOR + timedelta(days=365, minutes=1)
+
+
+@pytest.mark.parametrize('recurring_time', ['yearly', 'monthly:32', 'cron:0 9 * *', 'cron:61 * * * *',
+                                            'cron:0 0 30 2 *'])
+def test_invalid_recurring_times(recurring_time):
+    with pytest.raises(ValueError):
+        parse_cadence(recurring_time)
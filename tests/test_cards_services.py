@@ -1,7 +1,12 @@
 import pytest
 from unittest.mock import MagicMock, patch
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from common.authorization import get_current_user
 from data.connection import query as supabase
-from services.cards_services import create_card, get_all_cards, get_card_by_id, update_card, delete_card
+from data.local_client import LocalClient
+from routers.cards import cards_router
+from services.cards_services import create_card, get_user_cards, get_card_by_id, update_card, delete_card
 
 def test_create_card():
     with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
@@ -20,70 +25,94 @@ def test_create_card_empty_data():
         with pytest.raises(Exception):
             create_card({})
 
-def test_get_all_cards():
-    with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
-        mock_response = MagicMock()
-        mock_response.data = [{'id': 1, 'name': 'Test Card'}]
-        mock_table.return_value.select.return_value.execute.return_value = mock_response
-        result = get_all_cards()
-        assert result == [{'id': 1, 'name': 'Test Card'}]
+CARD = {'type': 'debit', 'expiration_date': '1228', 'cvv': 123, 'number': '1234567812345678'}
 
-def test_get_all_cards_empty():
-    with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
-        mock_response = MagicMock()
-        mock_response.data = None
-        mock_response.json.return_value = {'error': 'No cards found'}
-        mock_table.return_value.select.return_value.execute.return_value = mock_response
-        with pytest.raises(Exception):
-            get_all_cards()
 
-def test_get_card_by_id():
-    with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
-        mock_response = MagicMock()
-        mock_response.data = [{'id': 1, 'name': 'Test Card'}]
-        mock_table.return_value.select.return_value.eq.return_value.execute.return_value = mock_response
-        result = get_card_by_id(1)
-        assert result == {'id': 1, 'name': 'Test Card'}
+@pytest.fixture
+def local_cards():
+    client = LocalClient()
+    client.table('cards').insert([{**CARD, 'user_id': user_id, 'number': f'{card_id:016d}'}
+                                  for card_id, user_id in enumerate((1, 2, 1, 1, 2, 1, 1), start=1)]).execute()
+    with patch('services.cards_services.supabase', client):
+        client.round_trips = 0
+        yield client
 
-def test_get_card_by_id_invalid():
-    with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
-        mock_response = MagicMock()
-        mock_response.data = []
-        mock_response.json.return_value = {'error': 'Card not found'}
-        mock_table.return_value.select.return_value.eq.return_value.execute.return_value = mock_response
-        with pytest.raises(Exception):
-            get_card_by_id(999)
 
-def test_update_card():
-    with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
-        mock_response = MagicMock()
-        mock_response.data = [{'id': 1, 'name': 'Updated Card'}]
-        mock_table.return_value.update.return_value.eq.return_value.execute.return_value = mock_response
-        result = update_card(1, {'name': 'Updated Card'})
-        assert result == {'id': 1, 'name': 'Updated Card'}
+def test_get_user_cards_pages_only_the_users_cards(local_cards):
+    cards, cursor = get_user_cards(1, limit=2)
+    assert [card['id'] for card in cards] == [1, 3]
 
-def test_update_card_invalid():
-    with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
-        mock_response = MagicMock()
-        mock_response.data = None
-        mock_response.json.return_value = {'error': 'Update error'}
-        mock_table.return_value.update.return_value.eq.return_value.execute.return_value = mock_response
-        with pytest.raises(Exception):
-            update_card(999, {'name': 'Invalid Update'})
+    pages = [cards]
+    while cursor:
+        cards, cursor = get_user_cards(1, cursor=cursor, limit=2)
+        pages.append(cards)
 
-def test_delete_card():
-    with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
-        mock_response = MagicMock()
-        mock_response.data = [{'id': 1, 'name': 'Deleted Card'}]
-        mock_table.return_value.delete.return_value.eq.return_value.execute.return_value = mock_response
-        result = delete_card(1)
-        assert result == {'id': 1, 'name': 'Deleted Card'}
+    assert [[card['id'] for card in page] for page in pages] == [[1, 3], [4, 6], [7]]
+    assert local_cards.round_trips == 3
+    assert get_user_cards(3) == ([], None)
 
-def test_delete_card_invalid():
-    with patch.object(supabase, 'table', return_value=MagicMock()) as mock_table:
-        mock_response = MagicMock()
-        mock_response.data = None
-        mock_response.json.return_value = {'error': 'Delete error'}
-        mock_table.return_value.delete.return_value.eq.return_value.execute.return_value = mock_response
-        with pytest.raises(Exception):
-            delete_card(999)
+
+def test_get_user_cards_rejects_an_invalid_cursor(local_cards):
+    with pytest.raises(HTTPException) as error:
+        get_user_cards(1, cursor='nope')
+
+    assert error.value.status_code == 400
+
+
+def test_get_card_by_id(local_cards):
+    assert get_card_by_id(2, 2)['number'] == '0000000000000002'
+    # another user's card is not found, in one query
+    assert get_card_by_id(2, 1) is None
+    assert get_card_by_id(999, 1) is None
+    assert local_cards.round_trips == 3
+
+
+def test_update_card(local_cards):
+    assert update_card(1, 1, {'cvv': 456})['cvv'] == 456
+    assert update_card(1, 1, {})['cvv'] == 456
+
+
+def test_update_card_of_another_user(local_cards):
+    assert update_card(1, 2, {'cvv': 456}) is None
+    assert get_card_by_id(1, 1)['cvv'] == 123
+
+
+def test_delete_card(local_cards):
+    assert delete_card(1, 1)['id'] == 1
+    assert get_card_by_id(1, 1) is None
+
+
+def test_delete_card_of_another_user(local_cards):
+    assert delete_card(1, 2) is None
+    assert get_card_by_id(1, 1) is not None
+
+
+@pytest.fixture
+def cards_api(local_cards):
+    app = FastAPI()
+    app.include_router(cards_router)
+    app.dependency_overrides[get_current_user] = lambda: 1
+    return TestClient(app)
+
+
+def test_read_cards_is_conditional(cards_api, local_cards):
+    response = cards_api.get('/cards/', params={'limit': 10})
+    etag = response.headers['etag']
+
+    assert [card['id'] for card in response.json()['cards']] == [1, 3, 4, 6, 7]
+    assert response.json()['next_cursor'] is None
+
+    not_modified = cards_api.get('/cards/', params={'limit': 10}, headers={'If-None-Match': etag})
+    assert (not_modified.status_code, not_modified.content, not_modified.headers['etag']) == (304, b'', etag)
+
+    local_cards.table('cards').update({'cvv': 456}).eq('id', 4).execute()
+    changed = cards_api.get('/cards/', params={'limit': 10}, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['etag'] != etag
+
+
+def test_card_of_another_user_is_not_found(cards_api):
+    assert cards_api.get('/cards/2').status_code == 404
+    assert cards_api.put('/cards/2', json={'cvv': 456}).status_code == 404
+    assert cards_api.delete('/cards/2').status_code == 404
+    assert cards_api.delete('/cards/1').status_code == 204
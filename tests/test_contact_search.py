@@ -0,0 +1,69 @@
+from data.contact_cache import ContactCache, ContactList
+from data.contact_search import ContactSearchIndex, _prefix_distance
+
+CONTACTS = [
+    {'id': 1, 'username': 'Johnny', 'email': 'johnny@mail.com', 'phone_number': '0888123456'},
+    {'id': 2, 'username': 'john', 'email': 'jj@work.org', 'phone_number': '0899000111'},
+    {'id': 3, 'username': 'maria', 'email': 'maria.johnson@mail.com', 'phone_number': '0877555123'},
+    {'id': 4, 'username': 'peter', 'email': 'pete@mail.com', 'phone_number': '0866777888'},
+]
+
+
+def ids(contacts: list[dict]) -> list[int]:
+    return [contact['id'] for contact in contacts]
+
+
+def test_prefix_matches_come_first():
+    index = ContactSearchIndex(CONTACTS)
+
+    # john and johnny by username, maria by the johnson of her email
+    assert ids(index.search('joh')) == [2, 1, 3]
+    # 0888... by prefix, the other numbers start with one digit off
+    assert ids(index.search('088'))[0] == 1
+
+
+def test_substring_matches():
+    index = ContactSearchIndex(CONTACTS)
+
+    assert ids(index.search('@work')) == [2]
+    assert ids(index.search('555')) == [3]
+
+
+def test_typo_is_forgiven():
+    index = ContactSearchIndex(CONTACTS)
+
+    assert ids(index.search('pster')) == [4]
+    assert ids(index.search('maroa')) == [3]
+    # a swap of two letters is two typos
+    assert ids(index.search('mraia')) == []
+
+
+def test_exact_match_ignores_case():
+    index = ContactSearchIndex(CONTACTS)
+
+    assert ids(index.exact('username', 'JOHNNY')) == [1]
+    assert index.exact('email', 'nobody@mail.com') == []
+
+
+def test_added_contact_is_found():
+    index = ContactSearchIndex(CONTACTS)
+    index.add({'id': 5, 'username': 'joanna', 'email': 'jo@mail.com', 'phone_number': '0811111111'})
+
+    assert ids(index.search('joa'))[0] == 5
+
+
+def test_prefix_distance():
+    assert _prefix_distance('jonny', 'johnny.b', 1) == 1
+    assert _prefix_distance('abc', 'abcdef', 1) == 0
+    assert _prefix_distance('abc', 'xyz', 1) == 2
+
+
+def test_cache_evicts_cold_users_beyond_its_contacts_budget():
+    cache = ContactCache(max_contacts=6)
+    cache.put(1, ContactList(CONTACTS[:3]))
+    cache.put(2, ContactList(CONTACTS[:2]))
+    cache.get(1)
+    cache.put(3, ContactList(CONTACTS[:2]))
+
+    assert (cache.get(1) is not None, cache.get(2), cache.get(3) is not None) == (True, None, True)
+    assert cache.stats()['contacts'] == 5
@@ -0,0 +1,161 @@
+import threading
+
+import pytest
+from unittest.mock import patch
+
+from data.contact_cache import ContactCache, ContactList
+from data.contact_writer import ContactWriter
+from data.local_client import LocalClient
+
+
+@pytest.fixture
+def client():
+    client = LocalClient()
+    client.table('users').insert([{'username': f'user{number}', 'password': 'x', 'email': f'{number}@test.com',
+                                   'phone_number': f'{number:010d}'} for number in range(1, 6)]).execute()
+    with patch('data.user_loader.query', client):
+        client.round_trips = 0
+        yield client
+
+
+def pairs_of(client) -> list[tuple[int, int]]:
+    return [(row['current_user'], row['contact_name_id'])
+            for row in client.table('contacts').select('*').order('id').execute().data]
+
+
+def test_queued_pairs_are_written_once_in_batches(client):
+    writer = ContactWriter(client, ContactCache(), interval=None, batch_size=2)
+    for user_id, contact_id in ((1, 2), (1, 3), (1, 2), (2, 1), (1, 3)):
+        writer.add(user_id, contact_id)
+
+    assert writer.flush() == 3
+    assert client.round_trips == 2
+    assert pairs_of(client) == [(1, 2), (1, 3), (2, 1)]
+    assert writer.coalesced == 2
+
+
+def test_pairs_already_in_the_table_are_skipped(client):
+    client.table('contacts').insert({'current_user': 1, 'contact_name_id': 2}).execute()
+    writer = ContactWriter(client, ContactCache(), interval=None)
+    writer.add(1, 2)
+    writer.add(1, 4)
+
+    assert writer.flush() == 2
+    assert pairs_of(client) == [(1, 2), (1, 4)]
+
+
+def test_recently_written_pairs_are_not_queued_again(client):
+    writer = ContactWriter(client, ContactCache(), interval=None, memo_size=1)
+    writer.add(1, 2)
+    writer.flush()
+    writer.add(1, 2)
+    assert writer.pending() == 0
+
+    writer.add(1, 3)
+    writer.flush()
+    # forgotten, the upsert skips it
+    writer.add(1, 2)
+    assert (writer.pending(), writer.flush()) == (1, 1)
+    assert pairs_of(client) == [(1, 2), (1, 3)]
+
+
+def test_a_failed_batch_stays_queued(client):
+    writer = ContactWriter(client, ContactCache(), interval=None)
+    writer.add(1, 2)
+    writer.client = None
+
+    with pytest.raises(AttributeError):
+        writer.flush()
+
+    writer.client = client
+    assert (writer.pending(), writer.flush()) == (1, 1)
+    assert pairs_of(client) == [(1, 2)]
+
+
+def test_written_contacts_are_added_to_cached_lists(client):
+    cache = ContactCache()
+    cache.put(1, ContactList([]))
+    writer = ContactWriter(client, cache, interval=None)
+    writer.add(1, 3)
+    writer.add(2, 3)
+
+    writer.flush()
+
+    assert cache.get(1).contacts == [{'id': 3, 'username': 'user3', 'email': '3@test.com',
+                                      'phone_number': '0000000003'}]
+    assert cache.get(2) is None
+
+
+def test_a_full_batch_wakes_the_writer(client):
+    writer = ContactWriter(client, ContactCache(), interval=60, batch_size=2)
+    written = threading.Event()
+    flush = writer.flush
+    writer.flush = lambda: (flush(), written.set())
+
+    writer.add(1, 2)
+    writer.add(1, 3)
+
+    assert written.wait(5)
+    assert pairs_of(client) == [(1, 2), (1, 3)]
+
+
+def test_stop_writes_the_queue(client):
+    writer = ContactWriter(client, ContactCache(), interval=60)
+    writer.add(1, 2)
+
+    writer.stop()
+
+    assert pairs_of(client) == [(1, 2)]
+
+
+class RejectingClient:
+    '''Fails every upsert which holds the rejected pair, like a constraint violation would.'''
+
+    def __init__(self, client, rejected: tuple[int, int]):
+        self.client = client
+        self.rejected = rejected
+        self.upserts = 0
+
+    def table(self, name):
+        table = self.client.table(name)
+        upsert = table.upsert
+
+        def checked_upsert(rows, **kwargs):
+            self.upserts += 1
+            if {'current_user': self.rejected[0], 'contact_name_id': self.rejected[1]} in rows:
+                raise ValueError('rejected')
+            return upsert(rows, **kwargs)
+
+        table.upsert = checked_upsert
+        return table
+
+
+def test_a_bad_pair_does_not_hold_up_the_queue(client):
+    rejecting = RejectingClient(client, rejected=(1, 3))
+    writer = ContactWriter(rejecting, ContactCache(), interval=None, max_attempts=3)
+    for contact_id in (2, 3, 4):
+        writer.add(1, contact_id)
+
+    with pytest.raises(ValueError):
+        writer.flush()
+    writer.add(1, 5)
+    # the failed batch is retried one pair at a time, the bad pair goes behind the others
+    with pytest.raises(ValueError):
+        writer.flush()
+    assert pairs_of(client) == [(1, 2)]
+
+    # and is dropped after its third failure
+    with pytest.raises(ValueError):
+        writer.flush()
+    assert pairs_of(client) == [(1, 2), (1, 4), (1, 5)]
+    assert (writer.pending(), writer.flush(), rejecting.upserts) == (0, 0, 6)
+
+
+def test_new_pairs_are_dropped_while_the_queue_is_full(client):
+    writer = ContactWriter(client, ContactCache(), interval=None, max_pending=2)
+    for contact_id in (2, 3, 4):
+        writer.add(1, contact_id)
+
+    assert (writer.pending(), writer.dropped) == (2, 1)
+    assert writer.flush() == 2
+    assert pairs_of(client) == [(1, 2), (1, 3)]
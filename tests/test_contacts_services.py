@@ -0,0 +1,137 @@
+import pytest
+import services.transactions_services
+from unittest.mock import patch
+from fastapi import HTTPException
+
+from data.contact_cache import ContactCache
+from data.local_client import LocalClient
+from data.recipient_ranking import RecipientRanking
+from data.contact_writer import ContactWriter
+from services.contacts_services import get_contacts_of_user, search_contacts, find_contact_by_attribute, \
+    get_top_recipients, RESOLVE_BATCH_SIZE
+from services.transactions_services import transfer_money
+
+CONTACTS = 250
+
+
+@pytest.fixture
+def local_query():
+    client = LocalClient()
+    client.table('users').insert(
+        [{'username': 'owner', 'password': 'x', 'email': 'owner@test.com', 'phone_number': '0000000000',
+          'amount': 100.0}] +
+        [{'username': f'user{number:03d}', 'password': 'x', 'email': f'{1000 - number}@test.com',
+          'phone_number': f'{number:010d}'} for number in range(1, CONTACTS + 2)]).execute()
+    # the last user is not a contact yet
+    client.table('contacts').insert([{'current_user': 1, 'contact_name_id': contact_id}
+                                     for contact_id in range(2, CONTACTS + 2)]).execute()
+    cache = ContactCache()
+    ranking = RecipientRanking(client, flush_seconds=None)
+    with patch('services.contacts_services.recipient_ranking', ranking), \
+            patch('services.transactions_services.contact_writer', ContactWriter(client, cache, interval=None)), \
+            patch('services.transactions_services.recipient_ranking', ranking), \
+            patch('services.contacts_services.query', client), \
+            patch('services.transactions_services.query', client), \
+            patch('data.user_loader.query', client), \
+            patch('services.contacts_services.contact_cache', cache):
+        client.round_trips = 0
+        yield client
+
+
+def all_pages(**kwargs) -> list[dict]:
+    contacts, cursor = get_contacts_of_user(1, limit=60, **kwargs)
+    while cursor:
+        page, cursor = get_contacts_of_user(1, cursor=cursor, limit=60, **kwargs)
+        contacts += page
+    return contacts
+
+
+def test_contacts_are_resolved_in_batches(local_query):
+    contacts, _ = get_contacts_of_user(1)
+
+    assert contacts[0] == {'id': 2, 'username': 'user001', 'email': '999@test.com', 'phone_number': '0000000001'}
+    assert local_query.round_trips == 1 + -(-CONTACTS // RESOLVE_BATCH_SIZE)
+
+
+def test_pages_cover_every_contact_once(local_query):
+    by_username = all_pages()
+    by_email = all_pages(sort_by='email', order='desc')
+
+    assert [contact['username'] for contact in by_username] == [f'user{number:03d}' for number in range(1, 251)]
+    assert [contact['email'] for contact in by_email] == sorted((contact['email'] for contact in by_username),
+                                                              reverse=True)
+
+
+def test_cursor_of_another_sort_column_is_rejected(local_query):
+    _, username_cursor = get_contacts_of_user(1, limit=60)
+    _, id_cursor = get_contacts_of_user(1, sort_by='id', limit=60)
+
+    for cursor, sort_by in ((username_cursor, 'id'), (id_cursor, 'email')):
+        with pytest.raises(HTTPException) as error:
+            get_contacts_of_user(1, sort_by=sort_by, cursor=cursor)
+        assert error.value.status_code == 400
+
+
+def test_pages_are_served_from_the_cache(local_query):
+    all_pages()
+    round_trips = local_query.round_trips
+
+    all_pages(sort_by='id')
+
+    assert local_query.round_trips == round_trips
+
+
+def test_transfer_to_a_new_contact_updates_the_cache(local_query):
+    get_contacts_of_user(1)
+    search_contacts(1, 'user')
+
+    transfer_money(1, 2, 1.0, 'General')
+    assert len(all_pages()) == CONTACTS
+
+    transfer_money(1, CONTACTS + 2, 1.0, 'General')
+    assert len(all_pages()) == CONTACTS
+    services.transactions_services.contact_writer.flush()
+    round_trips = local_query.round_trips
+    assert len(all_pages()) == CONTACTS + 1
+    assert search_contacts(1, 'user251')[0] == {'id': CONTACTS + 2, 'username': 'user251', 'email': '749@test.com',
+                                                  'phone_number': '0000000251'}
+    assert local_query.round_trips == round_trips
+
+
+def test_search_matches_prefix_substring_and_typos(local_query):
+    assert [contact['username'] for contact in search_contacts(1, 'USER00', limit=3)] == \
+        ['user001', 'user002', 'user003']
+    # the phone number 0000000123 and the email 877@test.com of user123
+    assert search_contacts(1, '0123')[0]['id'] == 124
+    assert search_contacts(1, '877@')[0]['id'] == 124
+    assert search_contacts(1, 'usr123')[0]['username'] == 'user123'
+    assert search_contacts(1, 'nobody') == []
+
+
+def test_find_contact_by_attribute_uses_the_cached_contacts(local_query):
+    assert find_contact_by_attribute(1, 'email', '950@test.com')['username'] == 'user050'
+    round_trips = local_query.round_trips
+
+    assert find_contact_by_attribute(1, 'phone_number', '0000000007')['id'] == 8
+    assert find_contact_by_attribute(1, 'username', 'user251') is None
+    assert local_query.round_trips == round_trips
+
+
+def test_top_recipients_follow_the_transfers(local_query):
+    for receiver_id in (3, 2, 3):
+        transfer_money(1, receiver_id, 1.0, 'General')
+
+    top = get_top_recipients(1)
+
+    assert [(recipient['id'], recipient['username']) for recipient in top] == [(3, 'user002'), (2, 'user001')]
+    assert round(top[0]['score']) == 2
+    assert get_top_recipients(2) == []
+
+
+def test_user_without_contacts():
+    with patch('services.contacts_services.query', LocalClient()), \
+            patch('services.contacts_services.contact_cache', ContactCache()):
+        with pytest.raises(HTTPException) as error:
+            get_contacts_of_user(1)
+
+    assert error.value.status_code == 404
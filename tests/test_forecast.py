@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from datetime import date, datetime, timedelta
+from unittest.mock import MagicMock
+
+from data.cadence import parse_cadence, next_run
+from data.forecast import Schedule, daily_flows
+from data.local_client import LocalClient
+from data.user_cache import UserCache
+from services.recurring_transactions_services import forecast_balance
+
+START = date(2024, 1, 30)
+
+
+def schedule(recurring_time, amount, next_run_time, anchor_time=None):
+    next_run_time = datetime.fromisoformat(next_run_time)
+    anchor_time = datetime.fromisoformat(anchor_time) if anchor_time else next_run_time
+    return Schedule(amount, parse_cadence(recurring_time), anchor_time, next_run_time)
+
+
+def walked_flows(schedules, start, days):
+    '''The flows of the schedules found by walking every run.'''
+    flows = np.zeros(days)
+    end = datetime.combine(start + timedelta(days=days), datetime.min.time())
+    for item in schedules:
+        moment = item.next_run
+        while moment < end:
+            flows[max((moment.date() - start).days, 0)] += item.amount
+            moment = next_run(item.cadence, item.anchor, moment)
+    return flows
+
+
+@pytest.mark.parametrize('recurring_time, next_run_time, anchor_time', [
+    ('daily', '2024-02-02T08:00:00', None),
+    ('daily', '2024-01-27T08:00:00', None),
+    ('weekly', '2024-01-20T23:30:00', None),
+    ('minutely', '2024-01-30T23:58:30', None),
+    ('minutely', '2024-01-29T23:00:00', None),
+    ('minutely', '2024-02-03T12:00:00', None),
+    ('monthly', '2024-02-29T09:00:00', '2024-01-31T09:00:00'),
+    ('monthly', '2023-11-30T09:00:00', '2023-10-31T09:00:00'),
+    ('monthly:15', '2024-03-15T09:00:00', None),
+    ('cron:0 9,17 * * 1-5', '2024-01-30T17:00:00', '2024-01-01T00:00:00'),
+    ('cron:30 6 1 * 0', '2024-01-28T06:30:00', '2024-01-01T00:00:00'),
+])
+def test_flows_match_the_runs_of_the_cadence(recurring_time, next_run_time, anchor_time):
+    schedules = [schedule(recurring_time, -10.0, next_run_time, anchor_time)]
+
+    assert np.allclose(daily_flows(schedules, START, 120), walked_flows(schedules, START, 120))
+
+
+def test_flows_of_many_schedules_add_up():
+    schedules = [schedule('daily', -1.0, '2024-01-31T08:00:00'), schedule('weekly', 25.0, '2024-02-01T08:00:00'),
+                 schedule('monthly', -300.0, '2024-02-01T08:00:00'), schedule('daily', -2.0, '2024-02-10T08:00:00')]
+
+    assert np.allclose(daily_flows(schedules, START, 400), walked_flows(schedules, START, 400))
+
+
+@pytest.fixture
+def forecast_client(monkeypatch):
+    client = LocalClient()
+    client.table('users').insert([
+        {'username': 'payer', 'password': 'x', 'email': 'payer@test.com', 'phone_number': '1111111111', 'amount': 100.0},
+        {'username': 'payee', 'password': 'x', 'email': 'payee@test.com', 'phone_number': '2222222222', 'amount': 0.0},
+    ]).execute()
+    monkeypatch.setattr('services.recurring_transactions_services.query', client)
+    monkeypatch.setattr('data.user_loader.query', client)
+    monkeypatch.setattr('data.user_loader.user_cache', UserCache())
+    return client
+
+
+def test_forecast_flags_the_first_negative_day(forecast_client):
+    tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time()).replace(hour=9)
+    forecast_client.table('recurring_transactions').insert([
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 30.0, 'recurring_time': 'daily',
+         'next_run_time': tomorrow.isoformat()},
+        {'sender_id': 2, 'receiver_id': 1, 'amount': 5.0, 'recurring_time': 'daily',
+         'next_run_time': tomorrow.isoformat()},
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 1000.0, 'recurring_time': 'daily',
+         'next_run_time': tomorrow.isoformat(), 'status': 'failed'},
+    ]).execute()
+
+    forecast = forecast_balance(1, days=10)
+
+    # 100 - 25 a day from tomorrow
+    assert forecast.balances[:6] == [100.0, 75.0, 50.0, 25.0, 0.0, -25.0]
+    assert forecast.first_negative_date == date.today() + timedelta(days=5)
+    assert forecast.lowest_balance == -125.0
+    assert forecast_balance(2, days=10).first_negative_date is None
@@ -0,0 +1,87 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+from data.leader_election import FileLease, DatabaseLease, LeaderElector
+from data.local_client import LocalClient
+
+
+@pytest.fixture
+def local_query():
+    client = LocalClient()
+    with patch('data.leader_election.query', client):
+        yield client
+
+
+def elector(lease, ttl_seconds=30):
+    return LeaderElector('recurring-processor', on_elected=MagicMock(), on_demoted=MagicMock(), lease=lease,
+                         ttl_seconds=ttl_seconds)
+
+
+def test_file_lease_has_one_holder(tmp_path):
+    first, second = FileLease('leader', str(tmp_path)), FileLease('leader', str(tmp_path))
+
+    assert first.acquire() is True
+    assert second.acquire() is False
+
+    first.release()
+
+    assert second.acquire() is True
+    second.release()
+
+
+def test_database_lease_is_renewed_by_its_holder_only(local_query):
+    first, second = DatabaseLease('leader', 'first'), DatabaseLease('leader', 'second')
+
+    assert first.acquire() is True
+    assert second.acquire() is False
+    assert first.acquire() is True
+
+
+def test_expired_database_lease_is_taken_over(local_query):
+    first, second = DatabaseLease('leader', 'first', ttl_seconds=0), DatabaseLease('leader', 'second')
+    first.acquire()
+
+    assert second.acquire() is True
+    assert first.acquire() is False
+
+
+def test_leader_fails_over_when_it_stops(local_query):
+    first = elector(DatabaseLease('leader', 'first'))
+    second = elector(DatabaseLease('leader', 'second'))
+
+    first.campaign()
+    second.campaign()
+
+    assert (first.is_leader, second.is_leader) == (True, False)
+    first._on_elected.assert_called_once()
+
+    first.stop()
+    second.campaign()
+
+    first._on_demoted.assert_called_once()
+    assert second.is_leader is True
+    second._on_elected.assert_called_once()
+
+
+def test_leader_is_demoted_when_the_lease_cannot_be_renewed():
+    lease = MagicMock()
+    leader = elector(lease, ttl_seconds=0)
+    leader.campaign()
+
+    lease.acquire.side_effect = ConnectionError
+    leader.campaign()
+
+    assert leader.is_leader is False
+    leader._on_demoted.assert_called_once()
+
+
+def test_renewal_error_keeps_leader_within_the_lease():
+    lease = MagicMock()
+    leader = elector(lease, ttl_seconds=30)
+    leader.campaign()
+
+    lease.acquire.side_effect = ConnectionError
+    leader.campaign()
+
+    assert leader.is_leader is True
+    leader._on_demoted.assert_not_called()
@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch, AsyncMock
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+import common.authorization
+from common.authorization import TokenCache, authenticate, create_user_token, revoke_token
+from common.middleware import AuthMiddleware
+from data.revocation_store import MemoryRevocationStore
+from data.schemas import GetUser
+
+USER = GetUser(id=1, username='test', password='x', email='test@test.com', phone_number='1234567890',
+               is_admin=False, amount=0.0, is_registered=True, is_blocked=False)
+
+app = FastAPI()
+app.add_middleware(AuthMiddleware)
+
+
+@app.get('/me')
+def me(request: Request):
+    return {'user_id': request.state.user_id}
+
+
+@app.get('/login')
+def login():
+    response = JSONResponse({})
+    response.set_cookie(key='access_token', value='from-login')
+    return response
+
+
+@app.get('/stream')
+def stream():
+    return StreamingResponse(iter([b'a', b'b', b'c']))
+
+
+@app.get('/static/file')
+def static_file(request: Request):
+    return {'has_user': hasattr(request.state, 'user_id')}
+
+
+@pytest.fixture(autouse=True)
+def fresh_tokens():
+    with patch.object(common.authorization, 'revocations', MemoryRevocationStore()), \
+            patch.object(common.authorization, 'verified_tokens', TokenCache()):
+        yield
+
+
+def client_with(token: str) -> TestClient:
+    client = TestClient(app)
+    client.cookies.set('access_token', token)
+    return client
+
+
+def expired_claims_token() -> str:
+    with patch('common.authorization.CLAIMS_EXPIRE_MINUTES', -1):
+        return create_user_token(USER)
+
+
+def test_user_is_resolved_from_the_cookie():
+    assert client_with(create_user_token(USER)).get('/me').json() == {'user_id': 1}
+    assert TestClient(app).get('/me').json() == {'user_id': None}
+
+
+def test_expired_claims_get_a_refreshed_cookie():
+    with patch('common.middleware.find_user_by_id_async', AsyncMock(return_value=USER)):
+        response = client_with(expired_claims_token()).get('/me')
+
+    assert response.json() == {'user_id': 1}
+    assert response.cookies.get('access_token')
+
+
+def test_refreshed_token_expires_with_the_old_one():
+    token = expired_claims_token()
+    with patch('common.middleware.find_user_by_id_async', AsyncMock(return_value=USER)):
+        refreshed_token = client_with(token).get('/me').cookies.get('access_token')
+    original, refreshed = authenticate(token), authenticate(refreshed_token)
+
+    assert not refreshed.claims_expired
+    assert (refreshed.jti, refreshed.expires_at) == (original.jti, original.expires_at)
+
+    # logging out with either token ends the session
+    revoke_token(original)
+    assert authenticate(token) is None
+    assert authenticate(refreshed_token) is None
+
+
+class DatabaseStore(MemoryRevocationStore):
+    '''Records whether each check ran on the event loop.'''
+    blocking = True
+
+    def __init__(self):
+        super().__init__()
+        self.on_event_loop = []
+
+    def revoked_at(self, key: str):
+        try:
+            asyncio.get_running_loop()
+            self.on_event_loop.append(True)
+        except RuntimeError:
+            self.on_event_loop.append(False)
+        return super().revoked_at(key)
+
+
+def test_database_revocation_checks_run_off_the_event_loop():
+    store = DatabaseStore()
+    with patch.object(common.authorization, 'revocations', store), \
+            patch('common.middleware.find_user_by_id_async', AsyncMock(return_value=USER)):
+        assert client_with(expired_claims_token()).get('/me').json() == {'user_id': 1}
+
+    # the token and the refreshed one, each checked by jti and by user
+    assert store.on_event_loop == [False] * 4
+
+
+def test_cookie_set_by_the_route_is_kept():
+    with patch('common.middleware.find_user_by_id_async', AsyncMock(return_value=USER)):
+        response = client_with(expired_claims_token()).get('/login')
+
+    assert response.headers.get_list('set-cookie') == ['access_token=from-login; Path=/; SameSite=lax']
+
+
+def test_streamed_response_passes_through():
+    assert client_with(create_user_token(USER)).get('/stream').content == b'abc'
+
+
+def test_public_paths_skip_authentication():
+    assert client_with(create_user_token(USER)).get('/static/file').json() == {'has_user': False}
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from security.password_hashing import PasswordHasher, calibrate, memory_rounds, get_password_hash, \
+    verify_and_update, verify_and_update_async, MIN_HASH_ROUNDS
+
+
+def test_hash_is_salted():
+    first, second = get_password_hash('Password1!'), get_password_hash('Password1!')
+
+    assert first != second
+    assert verify_and_update('Password1!', first) == (True, None)
+    assert verify_and_update('Password2!', first) == (False, None)
+
+
+def test_legacy_hash_is_upgraded():
+    verified, new_hash = verify_and_update('Password1!', hashlib.sha256(b'Password1!').hexdigest())
+
+    assert verified is True
+    assert new_hash.startswith('$scrypt$')
+    assert verify_and_update('Password1!', new_hash) == (True, None)
+
+
+def test_weaker_hash_is_upgraded():
+    from passlib.hash import scrypt
+    weak = scrypt.using(rounds=MIN_HASH_ROUNDS - 2).hash('Password1!')
+
+    verified, new_hash = verify_and_update('Password1!', weak)
+
+    assert verified is True
+    assert new_hash is not None
+
+
+def test_unknown_hash_does_not_match():
+    assert verify_and_update('test123', 'test123') == (False, None)
+
+
+def test_async_verify_runs_off_the_event_loop():
+    hashed = get_password_hash('Password1!')
+    loop_thread = threading.get_ident()
+
+    async def verify():
+        return await verify_and_update_async('Password1!', hashed)
+
+    assert asyncio.run(verify()) == (True, None)
+
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    assert asyncio.run(hasher.run(threading.get_ident)) != loop_thread
+
+
+def test_admission_control_rejects_when_full():
+    hasher = PasswordHasher(workers=1, max_pending=2)
+    release = threading.Event()
+    running = [hasher.submit(release.wait), hasher.submit(release.wait)]
+
+    with pytest.raises(HTTPException) as error:
+        hasher.submit(release.wait)
+
+    assert error.value.status_code == 503
+    assert hasher.rejected == 1
+    release.set()
+    for future in running:
+        future.result()
+    # the worker runs the done callbacks, which free the slots, before its next task
+    hasher._executor.submit(lambda: None).result()
+    assert hasher.submit(lambda: 1).result() == 1
+
+
+def test_calibration_stays_within_bounds():
+    assert calibrate(target_ms=0) == MIN_HASH_ROUNDS
+
+
+def test_calibration_fits_the_memory_budget():
+    # 64 MiB for 4 concurrent hashes is 16 MiB, 2 ** 14 KiB, per hash
+    assert memory_rounds(memory_mb=64, workers=4) == 14
+    assert memory_rounds(memory_mb=4096, workers=2) == 20
+    assert memory_rounds(memory_mb=1, workers=64) == MIN_HASH_ROUNDS
+    assert calibrate(target_ms=10 ** 6, memory_mb=64, workers=4) == 14
@@ -0,0 +1,124 @@
+import threading
+import time
+
+from unittest.mock import patch
+
+from data.payment_scheduler import PaymentScheduler, ScheduledPayment
+
+
+def scheduler(**kwargs):
+    return PaymentScheduler(execute=lambda ids: None, **kwargs)
+
+
+def test_entries_only_hold_the_run():
+    entry = ScheduledPayment(1.0, 7)
+
+    assert not hasattr(entry, '__dict__')
+
+
+def test_due_returns_ids_in_run_order():
+    payments = scheduler()
+    payments.schedule_many([(1, 30.0), (2, 10.0), (3, 20.0), (4, 99.0)])
+
+    assert payments.due(50.0) == [2, 3, 1]
+    assert payments.due(50.0) == []
+    assert len(payments) == 1
+
+
+def test_due_is_bounded_by_the_batch_size():
+    payments = scheduler(batch_size=2)
+    payments.schedule_many((recurring_id, float(recurring_id)) for recurring_id in range(5))
+
+    assert payments.due(10.0) == [0, 1]
+    assert payments.due(10.0) == [2, 3]
+
+
+def test_rescheduled_and_cancelled_runs_are_skipped():
+    payments = scheduler()
+    payments.schedule_many([(1, 10.0), (2, 20.0), (3, 30.0)])
+    payments.schedule(1, 100.0)
+    payments.cancel(2)
+
+    assert payments.due(50.0) == [3]
+    assert payments.due(100.0) == [1]
+
+
+def test_stale_entries_are_compacted():
+    payments = scheduler(batch_size=1)
+    for run_at in range(10):
+        payments.schedule(1, float(run_at))
+
+    assert len(payments._heap) <= 3
+    assert payments.due(100.0) == [1]
+
+
+def test_thread_hands_due_ids_to_the_executor():
+    executed = []
+    done = threading.Event()
+
+    def execute(ids):
+        executed.extend(ids)
+        done.set()
+
+    payments = PaymentScheduler(execute, clock=lambda: 100.0)
+    payments.schedule_many([(1, 50.0), (2, 60.0), (3, 500.0)])
+    payments.start()
+    try:
+        assert done.wait(2)
+    finally:
+        payments.stop()
+
+    assert executed == [1, 2]
+    assert len(payments) == 1
+
+
+def test_thread_loads_the_schedule_before_dispatching():
+    executed = []
+    done = threading.Event()
+    release = threading.Event()
+
+    def load():
+        # start has returned before the first run is read
+        assert release.wait(2)
+        yield from ((recurring_id, float(recurring_id)) for recurring_id in range(1, 6))
+
+    def execute(ids):
+        executed.extend(ids)
+        done.set()
+
+    payments = PaymentScheduler(execute, clock=lambda: 100.0)
+    with patch('data.payment_scheduler.LOAD_CHUNK_SIZE', 2):
+        payments.start(load=load)
+        release.set()
+        try:
+            assert done.wait(2)
+        finally:
+            payments.stop()
+
+    assert executed == [1, 2, 3, 4, 5]
+    stats = payments.load_stats()
+    assert (stats['schedule_loading'], stats['schedule_loaded']) == (False, 5)
+    assert stats['schedule_load_seconds'] > 0
+
+
+def test_stop_interrupts_a_load():
+    read = []
+    payments = scheduler(clock=lambda: 100.0)
+
+    def load():
+        for recurring_id in range(1000):
+            read.append(recurring_id)
+            yield recurring_id, 500.0
+            # the rest of the load is read after stop
+            while payments.running:
+                time.sleep(0.001)
+
+    with patch('data.payment_scheduler.LOAD_CHUNK_SIZE', 1):
+        payments.start(load=load)
+        while not read:
+            time.sleep(0.001)
+        payments.stop()
+
+    # the chunk being read when stop came is the last one
+    assert read == [0, 1]
+    assert len(payments) == 2
@@ -0,0 +1,142 @@
+import json
+
+import pytest
+
+from data.local_client import LocalClient
+from data.recipient_ranking import RecipientRanking, SCORE_HALF_LIFE_SECONDS, RECIPIENT_SCORES_TABLE
+from test_storage import PsycopgConnection, postgres_client
+
+NOW = 1_718_000_000.0
+DAY = 24 * 3600
+
+
+class Clock:
+    def __init__(self, now: float = NOW):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def client():
+    return LocalClient()
+
+
+def ranking_of(client, clock, **kwargs) -> RecipientRanking:
+    return RecipientRanking(client, flush_seconds=None, clock=clock, **kwargs)
+
+
+def ids(top) -> list[int]:
+    return [recipient['id'] for recipient in top]
+
+
+def test_frequent_and_recent_recipients_rank_first(client, clock):
+    ranking = ranking_of(client, clock)
+    ranking.record(1, 2, at=NOW - 3 * SCORE_HALF_LIFE_SECONDS)
+    ranking.record(1, 2, at=NOW - 3 * SCORE_HALF_LIFE_SECONDS)
+    ranking.record(1, 3, at=NOW - DAY)
+    ranking.record(1, 4, payments=3, at=NOW - SCORE_HALF_LIFE_SECONDS)
+
+    top = ranking.top(1)
+
+    # two payments three half-lives ago are worth a quarter of one payment yesterday
+    assert ids(top) == [4, 3, 2]
+    assert top[0]['score'] == pytest.approx(1.5)
+    assert top[2]['score'] == pytest.approx(0.25)
+    assert ranking.top(1, limit=1) == top[:1]
+
+
+def test_own_transfers_are_not_counted(client, clock):
+    ranking = ranking_of(client, clock)
+    ranking.record(1, 1)
+
+    assert ranking.top(1) == []
+
+
+def test_flush_adds_the_scores_of_every_worker(client, clock):
+    first, second = ranking_of(client, clock), ranking_of(client, clock)
+    first.record(1, 2)
+    second.record(1, 2)
+    second.record(1, 3, at=NOW + 1)
+
+    assert (first.flush(), second.flush(), second.flush()) == (1, 2, 0)
+
+    rows = client.table(RECIPIENT_SCORES_TABLE).select('*').order('recipient_id').execute().data
+    assert [(row['recipient_id'], row['last_paid_at']) for row in rows] == [(2, NOW), (3, NOW + 1)]
+    # a third worker reads the sum
+    top = ranking_of(client, clock).top(1)
+    assert [(recipient['id'], round(recipient['score'], 6)) for recipient in top] == [(2, 2.0), (3, 1.0)]
+
+
+def test_scores_not_flushed_yet_are_merged_into_a_load(client, clock):
+    ranking = ranking_of(client, clock)
+    ranking.record(1, 2)
+    ranking.flush()
+    ranking.record(1, 2)
+    ranking.record(1, 3)
+
+    assert [round(recipient['score']) for recipient in ranking.top(1)] == [2, 1]
+    assert ranking.loads == 1
+
+
+def test_scores_of_cached_users_are_updated_in_memory(client, clock):
+    ranking = ranking_of(client, clock)
+    ranking.top(1)
+    ranking.record(1, 2)
+
+    assert ids(ranking.top(1)) == [2]
+    assert ranking.loads == 1
+
+    # another worker's scores are read after the ttl
+    ranking.flush()
+    other = ranking_of(client, clock)
+    other.record(1, 3, payments=5)
+    other.flush()
+    assert ids(ranking.top(1)) == [2]
+    clock.now += ranking.ttl
+    assert ids(ranking.top(1)) == [3, 2]
+
+
+def test_a_failed_flush_is_retried(client, clock):
+    ranking = ranking_of(client, clock)
+    ranking.record(1, 2)
+    ranking.client = None
+
+    with pytest.raises(AttributeError):
+        ranking.flush()
+
+    ranking.client = client
+    ranking.record(1, 2)
+    assert ranking.flush() == 1
+    assert client.table(RECIPIENT_SCORES_TABLE).select('score').execute().data[0]['score'] == \
+        pytest.approx(2 * ranking.weight(NOW))
+
+
+def test_memory_is_bounded(client, clock):
+    ranking = ranking_of(client, clock, tracked=3, max_users=2)
+    for user_id in (1, 2, 3):
+        ranking.top(user_id)
+    for recipient_id, payments in ((10, 4), (11, 1), (12, 3), (13, 2)):
+        ranking.record(3, recipient_id, payments)
+
+    assert ids(ranking.top(3)) == [10, 12, 13]
+    assert list(ranking._users) == [2, 3]
+
+
+def test_flush_sends_the_scores_to_postgres(clock):
+    connection = PsycopgConnection()
+    ranking = ranking_of(postgres_client(connection), clock)
+    ranking.record(1, 2)
+
+    assert ranking.flush() == 1
+
+    sent = connection.queries[0]
+    assert sent.query == b'SELECT "add_recipient_scores"("p_scores" => $1) AS result'
+    assert json.loads(bytes(sent.params[0])) == [{'user_id': 1, 'recipient_id': 2, 'score': ranking.weight(NOW),
+                                                  'last_paid_at': NOW}]
@@ -1,16 +1,22 @@
+import threading
 import pytest
 from unittest.mock import MagicMock
-from services.recurring_transactions_services import create_recurring_transaction, update_recurring_transaction, delete_recurring_transaction
+from services.recurring_transactions_services import create_recurring_transaction, update_recurring_transaction, delete_recurring_transaction, \
+    sweep_due_recurring_transactions, process_recurring_transaction, plan_runs, SweepMetrics
+from fastapi import HTTPException
+from data.local_client import LocalClient
+from data.user_cache import UserCache
+from data.recipient_ranking import RecipientRanking
 from datetime import datetime, timedelta
 from data.schemas import CreateRecurringTransaction, UpdateRecurringTransaction
 
 
 def test_create_recurring_transaction(monkeypatch):
     mock_query = MagicMock()
-    mock_scheduler = MagicMock()
+    mock_schedule = MagicMock(running=True)
     
     monkeypatch.setattr('services.recurring_transactions_services.query', mock_query)
-    monkeypatch.setattr('services.recurring_transactions_services.scheduler', mock_scheduler)
+    monkeypatch.setattr('services.recurring_transactions_services.recurring_schedule', mock_schedule)
     
     mock_query.table.return_value.insert.return_value.execute.return_value.data = [{'id': 1}]
     
@@ -25,20 +31,21 @@ def test_create_recurring_transaction(monkeypatch):
     
     assert result == 'Recurring transaction created successfully'
     mock_query.table.assert_called_with('recurring_transactions')
-    mock_scheduler.add_job.assert_called()
+    assert mock_query.table.return_value.insert.call_args.args[0]['next_run_time']
+    assert mock_schedule.schedule.call_args.args[0] == 1
     
 @pytest.fixture
 def setup_mocks(monkeypatch):
     mock_query = MagicMock()
     monkeypatch.setattr('services.recurring_transactions_services.query', mock_query)
     
-    mock_scheduler = MagicMock()
-    monkeypatch.setattr('services.recurring_transactions_services.scheduler', mock_scheduler)
+    mock_schedule = MagicMock(running=True)
+    monkeypatch.setattr('services.recurring_transactions_services.recurring_schedule', mock_schedule)
     
-    return mock_query, mock_scheduler
+    return mock_query, mock_schedule
 
 def test_update_recurring_transaction_success(setup_mocks):
-    mock_query, mock_scheduler = setup_mocks
+    mock_query, mock_schedule = setup_mocks
     mock_query.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
         {'id': 1, 'sender_id': 1, 'receiver_id': 2, 'amount': 100, 'recurring_time': 'daily'}
     ]
@@ -56,7 +63,25 @@ def test_update_recurring_transaction_success(setup_mocks):
     
     assert result == True
     mock_query.table.return_value.update.assert_called()
-    mock_scheduler.add_job.assert_called()
+    next_run_time = datetime.fromisoformat(mock_query.table.return_value.update.call_args.args[0]['next_run_time'])
+    mock_schedule.schedule.assert_called_once_with(1, next_run_time.timestamp())
+
+def test_created_and_edited_schedules_start_alike(setup_mocks):
+    mock_query, _ = setup_mocks
+    mock_query.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
+        {'id': 1, 'sender_id': 1, 'receiver_id': 2, 'amount': 100, 'recurring_time': 'daily'}
+    ]
+
+    create_recurring_transaction(1, CreateRecurringTransaction(receiver_id=2, amount=100, recurring_time='weekly'))
+    update_recurring_transaction(1, 1, UpdateRecurringTransaction(receiver_id=2, amount=100, recurring_time='weekly',
+                                                                  status='approved'))
+
+    created = mock_query.table.return_value.insert.call_args.args[0]
+    updated = mock_query.table.return_value.update.call_args.args[0]
+    # the first run of an interval schedule is due right away in both cases
+    assert created['next_run_time'] == created['anchor_time']
+    assert updated['next_run_time'] == updated['anchor_time']
+
 
 def test_update_recurring_transaction_no_permission(setup_mocks):
     mock_query, _ = setup_mocks
@@ -109,4 +134,241 @@ def test_delete_recurring_transaction_no_permission(monkeypatch):
     result = delete_recurring_transaction(recurring_transaction_id, user_id)
     
     assert result == False
-    mock_query.table.return_value.delete.assert_not_called()
\ No newline at end of file
+    mock_query.table.return_value.delete.assert_not_called()
+
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+@pytest.fixture
+def local_recurring(monkeypatch):
+    client = LocalClient()
+    client.table('users').insert([
+        {'username': 'sender', 'password': 'x', 'email': 'sender@test.com', 'phone_number': '1111111111',
+         'amount': 100.0},
+        {'username': 'receiver', 'password': 'x', 'email': 'receiver@test.com', 'phone_number': '2222222222',
+         'amount': 0.0},
+    ]).execute()
+    client.table('recurring_transactions').insert([
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 30.0, 'recurring_time': 'daily',
+         'next_run_time': '2024-06-01T11:00:00'},
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 50.0, 'recurring_time': 'weekly',
+         'next_run_time': '2024-06-01T11:30:00'},
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 40.0, 'recurring_time': 'daily',
+         'next_run_time': '2024-06-01T11:45:00'},
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 10.0, 'recurring_time': 'daily',
+         'next_run_time': '2024-06-02T12:00:00'},
+    ]).execute()
+    monkeypatch.setattr('services.recurring_transactions_services.query', client)
+    monkeypatch.setattr('services.recurring_transactions_services.sweep_metrics', SweepMetrics())
+    monkeypatch.setattr('data.user_loader.user_cache', UserCache())
+    monkeypatch.setattr('services.recurring_transactions_services.recipient_ranking',
+                        RecipientRanking(client, flush_seconds=None))
+    return client
+
+
+def rows_of(client, table):
+    return {row['id']: row for row in client.table(table).select('*').execute().data}
+
+
+def test_sweep_pays_due_rows_in_order(local_recurring):
+    result = sweep_due_recurring_transactions(NOW)
+
+    users = rows_of(local_recurring, 'users')
+    recurring = rows_of(local_recurring, 'recurring_transactions')
+    assert (result['processed'], result['failed']) == (2, 1)
+    assert (users[1]['amount'], users[2]['amount']) == (20.0, 80.0)
+    # the next runs are counted from the schedule, not from when the sweep paid them
+    assert recurring[1]['next_run_time'] == '2024-06-02T11:00:00'
+    assert recurring[2]['next_run_time'] == '2024-06-08T11:30:00'
+    # the third payment no longer fits the balance
+    assert recurring[3]['status'] == 'failed'
+    assert recurring[4]['next_run_time'] == '2024-06-02T12:00:00'
+    assert [t['category'] for t in local_recurring.table('transactions').select('*').execute().data] == \
+           ['recurring', 'recurring']
+
+
+def test_sweep_counts_the_payments_for_the_frequent_recipients(local_recurring):
+    from services import recurring_transactions_services
+
+    sweep_due_recurring_transactions(NOW)
+    top = recurring_transactions_services.recipient_ranking.top(1)
+
+    # two runs were paid, the failed one does not count
+    assert [recipient['id'] for recipient in top] == [2]
+    assert top[0]['last_paid_at'] == NOW.timestamp()
+
+
+def test_sweep_runs_bounded_batches(local_recurring, monkeypatch):
+    monkeypatch.setattr('services.recurring_transactions_services.SWEEP_BATCH_SIZE', 1)
+
+    result = sweep_due_recurring_transactions(NOW)
+
+    assert result['batches'] == 3
+    assert result['processed'] == 2
+
+
+def test_sweep_records_throughput_and_lag(local_recurring):
+    from services import recurring_transactions_services
+
+    sweep_due_recurring_transactions(NOW)
+    stats = recurring_transactions_services.sweep_metrics.stats()
+
+    assert (stats['sweeps'], stats['processed'], stats['failed']) == (1, 2, 1)
+    assert stats['last_lag_seconds'] == 3600.0
+    assert stats['last_sweep_per_second'] > 0
+
+
+def test_process_recurring_transaction_runs_before_it_is_due(local_recurring):
+    tomorrow = (datetime.now() + timedelta(days=1)).replace(microsecond=0)
+    local_recurring.table('recurring_transactions').update({'next_run_time': tomorrow.isoformat()}).eq('id', 4) \
+        .execute()
+
+    result = process_recurring_transaction(4)
+
+    assert result['processed'] == 1
+    assert rows_of(local_recurring, 'users')[1]['amount'] == 90.0
+    assert rows_of(local_recurring, 'recurring_transactions')[4]['next_run_time'] == \
+           (tomorrow + timedelta(days=1)).isoformat()
+
+
+def test_sweep_schedules_the_next_run_of_paid_rows(local_recurring, monkeypatch):
+    from services import recurring_transactions_services
+    schedule = MagicMock(running=True)
+    monkeypatch.setattr(recurring_transactions_services, 'recurring_schedule', schedule)
+
+    sweep_due_recurring_transactions(NOW)
+
+    scheduled = dict(schedule.schedule_many.call_args.args[0])
+    assert scheduled == {1: datetime(2024, 6, 2, 11, 0).timestamp(), 2: datetime(2024, 6, 8, 11, 30).timestamp()}
+
+
+def test_scheduled_ids_that_are_no_longer_due_are_skipped(local_recurring):
+    from services.recurring_transactions_services import pay_scheduled_transactions
+
+    # row 4 was moved after it had been scheduled
+    local_recurring.table('recurring_transactions').update({'next_run_time': '2999-01-01T00:00:00'}).eq('id', 4) \
+        .execute()
+    pay_scheduled_transactions([4])
+
+    assert rows_of(local_recurring, 'users')[1]['amount'] == 100.0
+
+
+def test_leader_loads_the_schedule_on_the_scheduler_thread(local_recurring, monkeypatch):
+    from services import recurring_transactions_services
+    from data.payment_scheduler import PaymentScheduler
+    # nothing is due on this clock, the loaded runs stay in the heap
+    schedule = PaymentScheduler(lambda ids: None, clock=lambda: 0.0)
+    monkeypatch.setattr(recurring_transactions_services, 'recurring_schedule', schedule)
+    loaded = threading.Event()
+    load = recurring_transactions_services.load_recurring_schedule
+
+    def slow_load():
+        # the elector thread has returned before the rows are read
+        assert elected.wait(2)
+        yield from load()
+        loaded.set()
+
+    monkeypatch.setattr(recurring_transactions_services, 'load_recurring_schedule', slow_load)
+    elected = threading.Event()
+    recurring_transactions_services._lead_recurring_processing()
+    elected.set()
+    try:
+        assert loaded.wait(2)
+    finally:
+        schedule.stop()
+
+    assert len(schedule) == 4
+
+
+def test_schedule_is_loaded_from_approved_rows(local_recurring, monkeypatch):
+    from services import recurring_transactions_services
+    monkeypatch.setattr(recurring_transactions_services, 'SCHEDULE_LOAD_PAGE_SIZE', 2)
+    local_recurring.table('recurring_transactions').update({'status': 'failed'}).eq('id', 3).execute()
+
+    loaded = dict(recurring_transactions_services.load_recurring_schedule())
+
+    assert sorted(loaded) == [1, 2, 4]
+    assert loaded[4] == datetime(2024, 6, 2, 12, 0).timestamp()
+
+
+@pytest.mark.parametrize('policy, run_times', [
+    ('all', ['2024-06-01T09:00:00', '2024-06-02T09:00:00', '2024-06-03T09:00:00', '2024-06-04T09:00:00']),
+    ('latest', ['2024-06-04T12:00:00']),
+    ('skip', []),
+])
+def test_missed_runs_follow_the_catch_up_policy(policy, run_times):
+    row = {'id': 1, 'recurring_time': 'daily', 'next_run_time': '2024-06-01T09:00:00',
+           'anchor_time': '2024-05-01T09:00:00'}
+
+    plan = plan_runs(row, datetime(2024, 6, 4, 12, 0), policy)
+
+    assert plan == {'id': 1, 'expected': '2024-06-01T09:00:00', 'runs': len(run_times), 'run_times': run_times,
+                    'next_run_time': '2024-06-05T09:00:00'}
+
+
+def test_run_paid_on_time_is_not_missed():
+    row = {'id': 1, 'recurring_time': 'monthly', 'next_run_time': '2024-02-29T09:00:00',
+           'anchor_time': '2024-01-31T09:00:00'}
+
+    plan = plan_runs(row, datetime(2024, 2, 29, 9, 0, 5), 'skip')
+
+    # the anchor's day of month comes back after a short month
+    assert (plan['runs'], plan['next_run_time']) == (1, '2024-03-31T09:00:00')
+
+
+def test_catch_up_is_bounded_per_batch(monkeypatch):
+    monkeypatch.setattr('services.recurring_transactions_services.MAX_CATCH_UP_RUNS', 10)
+    row = {'id': 1, 'recurring_time': 'minutely', 'next_run_time': '2024-06-01T09:00:00', 'anchor_time': None}
+
+    plan = plan_runs(row, datetime(2024, 6, 1, 12, 0), 'all')
+
+    # the rest of the backlog is still due and paid by the next batch
+    assert (plan['runs'], plan['next_run_time']) == (10, '2024-06-01T09:10:00')
+
+
+def test_invalid_recurring_time_fails_the_row(local_recurring):
+    local_recurring.table('recurring_transactions').update({'recurring_time': 'yearly'}).eq('id', 1).execute()
+
+    result = sweep_due_recurring_transactions(NOW)
+
+    assert rows_of(local_recurring, 'recurring_transactions')[1]['status'] == 'failed'
+    assert (result['processed'], result['failed']) == (2, 1)
+
+
+def test_sweep_pays_every_missed_run_at_once(local_recurring):
+    result = sweep_due_recurring_transactions(datetime(2024, 6, 2, 11, 40))
+
+    users = rows_of(local_recurring, 'users')
+    recurring = rows_of(local_recurring, 'recurring_transactions')
+    # row 1 owes two daily runs, then row 2 no longer fits the balance but row 3 still does
+    assert (result['processed'], result['failed']) == (3, 1)
+    assert users[1]['amount'] == 0.0
+    assert recurring[1]['next_run_time'] == '2024-06-03T11:00:00'
+    assert recurring[2]['status'] == 'failed'
+    # each run is dated when it was due
+    assert [(t['amount'], t['created_at']) for t in local_recurring.table('transactions').select('*').execute().data] \
+        == [(30.0, '2024-06-01T11:00:00'), (30.0, '2024-06-02T11:00:00'), (40.0, '2024-06-01T11:45:00')]
+
+
+def test_unaffordable_payment_does_not_fail_the_senders_later_ones(local_recurring):
+    local_recurring.table('recurring_transactions').update({'amount': 150.0}).eq('id', 1).execute()
+
+    result = sweep_due_recurring_transactions(NOW)
+
+    recurring = rows_of(local_recurring, 'recurring_transactions')
+    # 150 does not fit the balance of 100, the 50 and 40 due after it still do
+    assert (result['processed'], result['failed']) == (2, 1)
+    assert recurring[1]['status'] == 'failed'
+    assert (recurring[2]['status'], recurring[2]['next_run_time']) == ('approved', '2024-06-08T11:30:00')
+    assert (recurring[3]['status'], recurring[3]['next_run_time']) == ('approved', '2024-06-02T11:45:00')
+    assert rows_of(local_recurring, 'users')[1]['amount'] == 10.0
+
+
+def test_create_rejects_an_invalid_recurring_time(monkeypatch):
+    monkeypatch.setattr('services.recurring_transactions_services.query', MagicMock())
+
+    with pytest.raises(HTTPException) as error:
+        create_recurring_transaction(1, CreateRecurringTransaction(receiver_id=2, amount=10, recurring_time='yearly'))
+
+    assert error.value.status_code == 400
@@ -0,0 +1,119 @@
+from data.local_client import LocalClient
+from data.revocation_store import BloomFilter, MemoryRevocationStore, DatabaseRevocationStore
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for number in range(1000):
+        bloom.add(f'jti:{number}')
+
+    assert all(f'jti:{number}' in bloom for number in range(1000))
+    false_positives = sum(f'other:{number}' in bloom for number in range(10_000))
+    assert false_positives < 300
+
+
+def test_memory_store_forgets_expired_revocations():
+    clock = Clock()
+    store = MemoryRevocationStore(clock=clock)
+    store.revoke('jti:a', expires_at=1060)
+    store.revoke('jti:b', expires_at=2000)
+
+    assert store.revoked_at('jti:a') == 1000
+    clock.now = 1100
+    assert store.revoked_at('jti:a') is None
+
+    store.revoke('jti:c', expires_at=3000)
+    assert len(store) == 2
+
+
+def test_memory_store_moves_a_repeated_revocation():
+    clock = Clock()
+    store = MemoryRevocationStore(clock=clock)
+    store.revoke('user:1', expires_at=5000)
+    clock.now = 1500
+    store.revoke('user:1', expires_at=4000)
+
+    assert store.revoked_at('user:1') == 1500
+    clock.now = 4500
+    assert store.revoked_at('user:1') == 1500
+
+
+def test_database_store_is_shared_by_workers():
+    client, clock = LocalClient(), Clock()
+    first = DatabaseRevocationStore(client, capacity=100, sync_seconds=None, clock=clock)
+    second = DatabaseRevocationStore(client, capacity=100, sync_seconds=None, clock=clock)
+
+    assert second.revoked_at('jti:a') is None
+
+    first.revoke('jti:a', expires_at=2000)
+    assert first.revoked_at('jti:a') == 1000
+    assert second.revoked_at('jti:a') is None
+
+    second.sync()
+    assert second.revoked_at('jti:a') == 1000
+
+
+def test_database_store_syncs_before_the_first_check():
+    client, clock = LocalClient(), Clock()
+    DatabaseRevocationStore(client, capacity=100, sync_seconds=None, clock=clock).revoke('jti:a', expires_at=2000)
+
+    restarted = DatabaseRevocationStore(client, capacity=100, sync_seconds=None, clock=clock)
+
+    assert restarted.revoked_at('jti:a') == 1000
+    assert restarted.revoked_at('jti:b') is None
+
+
+def test_database_store_answers_unknown_keys_without_a_query():
+    client, clock = LocalClient(), Clock()
+    store = DatabaseRevocationStore(client, capacity=100, sync_seconds=None, clock=clock)
+    store.revoke('jti:a', expires_at=2000)
+
+    assert [store.revoked_at(f'jti:{number}') for number in range(500)] == [None] * 500
+    # only false positives of the filter are looked up, and each of them once
+    assert store.lookups < 20
+    lookups = store.lookups
+    for number in range(500):
+        store.revoked_at(f'jti:{number}')
+    assert store.lookups == lookups
+
+
+def test_database_store_deletes_expired_rows():
+    client, clock = LocalClient(), Clock()
+    store = DatabaseRevocationStore(client, capacity=100, sync_seconds=None, clock=clock)
+    store.revoke('jti:a', expires_at=1060)
+    clock.now = 1100
+    store.revoke('jti:b', expires_at=2000)
+
+    assert [row['key'] for row in client.table('revoked_tokens').select('key').execute().data] == ['jti:b']
+    assert store.revoked_at('jti:a') is None
+
+
+def test_database_store_rebuilds_a_full_filter():
+    client, clock = LocalClient(), Clock()
+    writer = DatabaseRevocationStore(client, capacity=100, sync_seconds=None, clock=clock)
+    reader = DatabaseRevocationStore(client, capacity=10, sync_seconds=None, clock=clock)
+    for number in range(30):
+        writer.revoke(f'jti:{number}', expires_at=2000)
+
+    reader.sync()
+
+    assert reader._filter.capacity == reader.capacity == 60
+    assert all(reader.revoked_at(f'jti:{number}') == 1000 for number in range(30))
+
+    rebuilt = reader._filter
+    writer.revoke('jti:30', expires_at=2000)
+    client.round_trips = 0
+    reader.sync()
+
+    # only the new revocations are read and added to the same filter
+    assert reader._filter is rebuilt
+    assert reader._filter.count == 31
+    assert client.round_trips == 1
@@ -0,0 +1,149 @@
+import json
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from psycopg._queries import PostgresQuery
+from psycopg.adapt import Transformer
+
+from data.connection import create_storage
+from data.helpers import _filter_value
+from data.local_client import LocalClient, SqlClient
+from data.postgres_client import PostgresClient, _Connection
+
+
+def test_sqlite_backend_keeps_data_in_the_file(tmp_path):
+    path = str(tmp_path / 'wallet.db')
+    with patch('data.connection.SQLITE_PATH', path):
+        storage = create_storage('sqlite')
+        storage.table('cards').insert({'user_id': 1, 'type': 'debit', 'expiration_date': '2030-01-01',
+                                       'cvv': 123, 'number': '4000000000000000'}).execute()
+        storage.close()
+
+        reopened = create_storage('sqlite')
+
+    assert isinstance(reopened, LocalClient)
+    assert reopened.table('cards').select('*').eq('user_id', 1).execute().data[0]['type'] == 'debit'
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_storage('mysql')
+
+
+def test_empty_in_filter_matches_nothing():
+    storage = LocalClient()
+    storage.table('contacts').insert({'current_user': 1, 'contact_name_id': 2}).execute()
+
+    assert storage.table('contacts').select('*').in_('contact_name_id', []).execute().data == []
+
+
+def test_postgres_connection_translates_placeholders():
+    connection = MagicMock()
+
+    _Connection(connection).execute('SELECT * FROM "users" WHERE "id" = ? AND "email" = ?', [1, 'a@b.com'])
+
+    connection.execute.assert_called_once_with('SELECT * FROM "users" WHERE "id" = %s AND "email" = %s',
+                                               [1, 'a@b.com'])
+
+
+def test_postgres_procedure_is_called_with_named_arguments():
+    connection = MagicMock()
+    connection.execute.return_value.fetchone.return_value = {'result': {'new_balance': 10.0}}
+    client = PostgresClient.__new__(PostgresClient)
+
+    result = client.call_procedure(connection, 'move_money', {'p_operation': 'deposit', 'p_user_id': 1})
+
+    assert result == {'new_balance': 10.0}
+    connection.execute.assert_called_once_with(
+        'SELECT "move_money"("p_operation" => ?, "p_user_id" => ?) AS result', ['deposit', 1])
+
+
+def test_postgres_rows_look_like_postgrest_json():
+    client = PostgresClient.__new__(PostgresClient)
+
+    record = client.to_record('transactions', {'id': 1, 'amount': Decimal('12.50'),
+                                               'created_at': datetime(2024, 6, 1, 12, 30)})
+
+    assert record == {'id': 1, 'amount': 12.5, 'created_at': '2024-06-01T12:30:00'}
+
+
+class PsycopgConnection:
+    '''Stands in for a psycopg connection without a server: every statement is converted with psycopg's own
+    query builder, which adapts the parameters like a real connection does.'''
+
+    def __init__(self, result=None):
+        self.result = result
+        self.queries = []
+
+    def execute(self, sql: str, params=()):
+        converted = PostgresQuery(Transformer())
+        converted.convert(sql, params)
+        self.queries.append(converted)
+        return MagicMock(fetchone=MagicMock(return_value={'result': self.result}))
+
+
+def postgres_client(connection: PsycopgConnection) -> PostgresClient:
+    client = PostgresClient.__new__(PostgresClient)
+    SqlClient.__init__(client)
+    client._run = lambda operation, transaction: operation(_Connection(connection))
+    return client
+
+
+def test_postgres_procedure_sends_json_parameters_as_jsonb():
+    connection = PsycopgConnection(result={'processed': 1})
+    client = postgres_client(connection)
+    runs = [{'id': 1, 'expected': '2024-06-01T11:00:00', 'runs': 1, 'next_run_time': '2024-06-02T11:00:00'}]
+
+    result = client.rpc('pay_recurring_runs', {'p_now': '2024-06-01T12:00:00', 'p_runs': runs}).execute().data
+
+    assert result == {'processed': 1}
+    sent = connection.queries[0]
+    assert sent.query == b'SELECT "pay_recurring_runs"("p_now" => $1, "p_runs" => $2) AS result'
+    assert json.loads(bytes(sent.params[1])) == runs
+
+
+def planner_connection(planned_rows: int, counted_rows: int) -> MagicMock:
+    connection = MagicMock()
+    connection.execute.return_value.fetchall.return_value = []
+    connection.execute.return_value.fetchone.side_effect = [{'QUERY PLAN': [{'Plan': {'Plan Rows': planned_rows}}]},
+                                                            {'count': counted_rows}]
+    return connection
+
+
+def test_postgres_estimated_count_comes_from_the_planner():
+    connection = planner_connection(250_000, 0)
+
+    response = postgres_client(connection).table('transactions').select('*', count='estimated') \
+        .eq('sender_id', 1).execute()
+
+    assert response.count == 250_000
+    assert connection.execute.call_args_list[1].args == (
+        'EXPLAIN (FORMAT JSON) SELECT 1 FROM "transactions" WHERE "sender_id" = %s', [1])
+    assert connection.execute.call_count == 2
+
+
+def test_postgres_estimated_count_of_few_rows_is_exact():
+    connection = planner_connection(12, 7)
+
+    response = postgres_client(connection).table('transactions').select('*', count='estimated') \
+        .eq('sender_id', 1).execute()
+
+    assert response.count == 7
+    assert connection.execute.call_args_list[2].args == (
+        'SELECT COUNT(*) AS count FROM "transactions" WHERE "sender_id" = %s', [1])
+
+
+def test_local_filters_read_escaped_quoted_values():
+    username = 'a\\b"c,d'
+    client = LocalClient()
+    client.table('users').insert([{'username': name, 'password': 'x', 'email': f'{number}@test.com',
+                                   'phone_number': f'{number:010d}'}
+                                  for number, name in enumerate((username, 'other'))]).execute()
+
+    rows = client.table('users').select('username').or_(f'username.eq.{_filter_value(username)},id.eq.0') \
+        .execute().data
+
+    # the comma inside the quotes does not split the filter list
+    assert rows == [{'username': username}]
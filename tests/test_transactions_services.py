@@ -1,12 +1,21 @@
+import csv
+import json
 import pytest
+from datetime import date
 from fastapi import HTTPException, status
 from unittest.mock import patch
-from services.transactions_services import get_logged_user_transactions, \
+from concurrent.futures import ThreadPoolExecutor
+from services.transactions_services import get_logged_user_transactions, get_all_transactions, \
+export_user_transactions, export_all_transactions, \
 transfer_money, deposit_money, withdraw_money, confirm_transaction, deny_transaction, \
-edit_category
-from data.helpers import ADMIN_ERROR, TRANSACTION_ERROR
+edit_category, accept_transaction, get_category_totals
+from data.local_client import LocalClient
+from data.recipient_ranking import RecipientRanking
+from data.contact_cache import ContactCache
+from data.contact_writer import ContactWriter
+from data.helpers import ADMIN_ERROR, TRANSACTION_ERROR, _filter_value, encode_cursor, keyset_filter
 from unittest.mock import patch, MagicMock
-from data.schemas import AmountOut
+from data.schemas import AmountOut, CategoryTotal
 
 
 class MockUser:
@@ -15,20 +24,6 @@ class MockUser:
         self.is_blocked = is_blocked
         self.amount = amount
 
-def test_get_logged_user_transactions_sent_transactions():
-    with patch('services.transactions_services.query') as mock_query:
-        mock_query.table().select().eq().execute.return_value.data = [{'id': 1, 'sender_id': 1, 'receiver_id': 2, 'created_at': '2024-06-05T12:00:00'}]
-        transactions = get_logged_user_transactions(user_id=1, transaction_type='sent')
-        assert isinstance(transactions, list)
-        assert len(transactions) == 1
-
-def test_get_logged_user_transactions_received_transactions():
-    with patch('services.transactions_services.query') as mock_query:
-        mock_query.table().select().eq().execute.return_value.data = [{'id': 1, 'sender_id': 2, 'receiver_id': 1, 'created_at': '2024-06-05T12:00:00'}]
-        transactions = get_logged_user_transactions(user_id=1, transaction_type='received')
-        assert isinstance(transactions, list)
-        assert len(transactions) == 1
-
 def test_get_logged_user_transactions_admin_error():
     with patch('services.transactions_services.is_admin') as mock_is_admin:
         mock_is_admin.return_value = True
@@ -37,286 +32,403 @@ def test_get_logged_user_transactions_admin_error():
         except HTTPException as e:
             assert e.status_code == status.HTTP_403_FORBIDDEN
 
+@pytest.fixture
+def local_query():
+    client = LocalClient()
+    client.table('users').insert([
+        {'username': 'sender', 'password': 'x', 'email': 'sender@test.com', 'phone_number': '1111111111',
+         'amount': 150.0, 'is_registered': True},
+        {'username': 'receiver', 'password': 'x', 'email': 'receiver@test.com', 'phone_number': '2222222222',
+         'amount': 50.0, 'is_registered': True},
+        {'username': 'admin', 'password': 'x', 'email': 'admin@test.com', 'phone_number': '3333333333',
+         'is_admin': True, 'is_registered': True},
+        {'username': 'blocked', 'password': 'x', 'email': 'blocked@test.com', 'phone_number': '4444444444',
+         'amount': 150.0, 'is_registered': True, 'is_blocked': True},
+    ]).execute()
+    with patch('services.transactions_services.query', client), \
+            patch('services.transactions_services.recipient_ranking', RecipientRanking(client, flush_seconds=None)), \
+            patch('services.transactions_services.contact_writer', ContactWriter(client, ContactCache(), interval=None)):
+        yield client
+
+
+def balance_of(client, user_id):
+    return client.table('users').select('amount').eq('id', user_id).execute().data[0]['amount']
+
+
+@pytest.fixture
+def history(local_query):
+    local_query.table('transactions').insert([
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 10.0, 'status': 'confirmed', 'created_at': '2024-06-01T10:00:00'},
+        {'sender_id': 2, 'receiver_id': 1, 'amount': 20.0, 'status': 'pending', 'created_at': '2024-06-02T10:00:00'},
+        {'sender_id': 1, 'receiver_id': 1, 'amount': 30.0, 'status': 'confirmed', 'created_at': '2024-06-03T10:00:00'},
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 40.0, 'status': 'pending', 'created_at': '2024-06-03T10:00:00'},
+        {'sender_id': 2, 'receiver_id': 4, 'amount': 50.0, 'status': 'confirmed', 'created_at': '2024-06-04T10:00:00'},
+    ]).execute()
+    with patch('services.transactions_services.is_admin', return_value=False):
+        yield local_query
+
+
+# get logged user transactions tests
+def test_get_logged_user_transactions_sent_transactions(history):
+    transactions, next_cursor = get_logged_user_transactions(user_id=1, transaction_type='sent')
+
+    assert [t['id'] for t in transactions] == [4, 3, 1]
+    assert next_cursor is None
+
+
+def test_get_logged_user_transactions_received_transactions(history):
+    transactions, _ = get_logged_user_transactions(user_id=1, transaction_type='received')
+
+    assert [t['id'] for t in transactions] == [3, 2]
+
+
+def test_get_logged_user_transactions_returns_atm_rows_once(history):
+    transactions, _ = get_logged_user_transactions(user_id=1)
+
+    assert [t['id'] for t in transactions] == [4, 3, 2, 1]
+
+
+def test_get_logged_user_transactions_type_and_status_filters_combine(history):
+    transactions, _ = get_logged_user_transactions(user_id=1, transaction_type='received',
+                                                   transaction_status='pending')
+
+    assert [t['id'] for t in transactions] == [2]
+
+
+def test_get_logged_user_transactions_pages_with_cursor(history):
+    pages, cursor = [], None
+    for _ in range(3):
+        transactions, cursor = get_logged_user_transactions(user_id=1, order='asc', cursor=cursor, limit=3)
+        pages.append([t['id'] for t in transactions])
+        if cursor is None:
+            break
+
+    assert pages == [[1, 2, 3], [4]]
+
+
+def test_get_logged_user_transactions_pages_by_amount(history):
+    first, cursor = get_logged_user_transactions(user_id=1, sort_by='amount', limit=2)
+    second, cursor = get_logged_user_transactions(user_id=1, sort_by='amount', cursor=cursor, limit=2)
+
+    assert [t['amount'] for t in first + second] == [40.0, 30.0, 20.0, 10.0]
+    assert cursor is None
+
+
+def test_get_logged_user_transactions_is_one_round_trip(history):
+    round_trips = history.round_trips
+
+    get_logged_user_transactions(user_id=1, transaction_type='sent', transaction_status='confirmed')
+
+    assert history.round_trips == round_trips + 1
+
+
+def test_get_logged_user_transactions_not_found(history):
+    with pytest.raises(HTTPException) as e:
+        get_logged_user_transactions(user_id=3)
+
+    assert e.value.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_get_logged_user_transactions_invalid_cursor(history):
+    with pytest.raises(HTTPException) as e:
+        get_logged_user_transactions(user_id=1, cursor='not-a-cursor')
+
+    assert e.value.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_cursor_of_another_sort_column_is_rejected(history):
+    _, created_at_cursor = get_logged_user_transactions(user_id=1, limit=2)
+    _, amount_cursor = get_logged_user_transactions(user_id=1, sort_by='amount', limit=2)
+    made_up = encode_cursor({'created_at': '2024-06-01") or true', 'id': 1}, 'created_at')
+
+    for cursor, sort_by in ((created_at_cursor, 'amount'), (amount_cursor, 'created_at'), (made_up, 'created_at')):
+        with pytest.raises(HTTPException) as e:
+            get_logged_user_transactions(user_id=1, sort_by=sort_by, cursor=cursor)
+        assert e.value.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_filter_values_escape_quotes_and_backslashes():
+    assert keyset_filter(encode_cursor({'amount': 1.5, 'id': 7}, 'amount'), 'amount', False) == \
+           'or(amount.gt."1.5",and(amount.eq."1.5",id.gt.7))'
+    assert _filter_value('a\\b"c') == '"a\\\\b\\"c"'
+
+
+# get all transactions tests
+def test_get_all_transactions_sorts_across_pages(history):
+    with patch('services.transactions_services.is_admin', return_value=True):
+        first = get_all_transactions(1, 3, sort='amount', order='asc', page_size=2)
+        second = get_all_transactions(1, 3, sort='amount', order='asc', page_size=2, cursor=first['next_cursor'])
+        last = get_all_transactions(1, 3, sort='amount', order='asc', page_size=2, cursor=second['next_cursor'])
+
+    assert [t['amount'] for t in first['transactions'] + second['transactions'] + last['transactions']] == \
+           [10.0, 20.0, 30.0, 40.0, 50.0]
+    assert last['next_cursor'] is None
+
+
+def test_get_all_transactions_breaks_ties_by_id(history):
+    with patch('services.transactions_services.is_admin', return_value=True):
+        first = get_all_transactions(1, 3, sent_or_received='sent', page_size=2)
+        second = get_all_transactions(1, 3, sent_or_received='sent', page_size=2, cursor=first['next_cursor'])
+
+    assert [t['id'] for t in first['transactions'] + second['transactions']] == [4, 3, 1]
+
+
+def test_get_all_transactions_with_count(history):
+    with patch('services.transactions_services.is_admin', return_value=True):
+        result = get_all_transactions(1, 3, direction='incoming', start_date='2024-06-02', with_count=True)
+
+    assert [t['id'] for t in result['transactions']] == [3, 2]
+    assert result['estimated_total'] == 2
+
+
+def test_get_all_transactions_not_admin(history):
+    with patch('services.transactions_services.is_admin', return_value=False), pytest.raises(HTTPException) as e:
+        get_all_transactions(1, 1)
+
+    assert e.value.status_code == status.HTTP_403_FORBIDDEN
+
+
+# export tests
+def test_export_user_transactions_csv_in_chunks(history):
+    with patch('services.transactions_services.EXPORT_CHUNK_SIZE', 2):
+        chunks = list(export_user_transactions(1))
+
+    rows = list(csv.DictReader(''.join(chunks).splitlines()))
+    assert [row['id'] for row in rows] == ['1', '2', '3', '4']
+    # header and one chunk per page of two rows
+    assert len(chunks) == 3
+
+
+def test_export_user_transactions_ndjson_with_filters(history):
+    history.table('transactions').update({'category': 'food'}).eq('id', 2).execute()
+
+    chunks = export_user_transactions(1, 'ndjson', start_date=date(2024, 6, 2), end_date=date(2024, 6, 2),
+                                      category='food')
+
+    assert [json.loads(line)['id'] for line in ''.join(chunks).splitlines()] == [2]
+
+
+def test_export_all_transactions_uses_admin_filters(history):
+    with patch('services.transactions_services.is_admin', return_value=True):
+        chunks = export_all_transactions(2, 3, 'ndjson', sent_or_received='sent')
+
+    assert [json.loads(line)['id'] for line in ''.join(chunks).splitlines()] == [2, 5]
+
+
+def test_export_all_transactions_checks_admin_before_streaming(history):
+    with patch('services.transactions_services.is_admin', return_value=False), pytest.raises(HTTPException) as e:
+        export_all_transactions(2, 1)
+
+    assert e.value.status_code == status.HTTP_403_FORBIDDEN
+
+
+
+
 #transfer money tests
-@pytest.mark.parametrize("sender_id, receiver_id, amount, category, expected_result", [
-    (1, 2, 100.0, "General", ('Successful', 'inserted_transaction_id')),
-])
-def test_transfer_money_successful(sender_id, receiver_id, amount, category, expected_result):
-    with patch('services.transactions_services.find_user_by_id') as mock_find_user_by_id, \
-         patch('services.transactions_services.query') as mock_query:
-        
-        # Create separate mock objects for sender and receiver
-        mock_sender = MagicMock()
-        mock_sender.is_admin = False
-        mock_sender.is_blocked = False
-        mock_sender.amount = 150.0
-        
-        mock_receiver = MagicMock()
-        mock_receiver.is_admin = False
-        mock_receiver.is_blocked = False
-        mock_receiver.amount = 50.0
-        
-        # Define the side effect function to return the correct mock object
-        def find_user_by_id_side_effect(user_id):
-            if user_id == sender_id:
-                return mock_sender
-            elif user_id == receiver_id:
-                return mock_receiver
-            return None
-        
-        mock_find_user_by_id.side_effect = find_user_by_id_side_effect
-        
-        # Mocking the query methods
-        mock_query.table().update().execute.return_value = None
-        mock_query.table().insert().execute.return_value = 'inserted_transaction_id'
-        mock_query.table().select().eq().execute.return_value.data = []
+def test_transfer_money_successful(local_query):
+    result = transfer_money(1, 2, 100.0, "General")
 
-        result = transfer_money(sender_id, receiver_id, amount, category)
-        
-        assert result == expected_result
+    assert result[0] == 'Successful'
+    assert result[1]['sender_id'] == 1
+    assert result[1]['receiver_id'] == 2
+    assert result[1]['status'] == 'pending'
+    assert balance_of(local_query, 1) == 50.0
+    assert balance_of(local_query, 2) == 50.0
+
+
+def test_transfer_money_is_one_round_trip(local_query):
+    round_trips = local_query.round_trips
+
+    transfer_money(1, 2, 100.0, "General")
+
+    assert local_query.round_trips - round_trips == 1
 
 # Sender is an admin
-def test_transfer_money_sender_admin():
-    with patch('services.transactions_services.find_user_by_id') as mock_find_user_by_id:
-        mock_sender = mock_find_user_by_id.return_value
-        mock_sender.is_admin = True
-        
-        with pytest.raises(HTTPException) as exc_info:
-            transfer_money(1, 2, 100.0, "General")
-        
-        assert exc_info.value == ADMIN_ERROR
+def test_transfer_money_sender_admin(local_query):
+    with pytest.raises(HTTPException) as exc_info:
+        transfer_money(3, 2, 100.0, "General")
+
+    assert exc_info.value == ADMIN_ERROR
 
 # Sender is blocked
-def test_transfer_money_sender_blocked():
-    with patch('services.transactions_services.find_user_by_id') as mock_find_user_by_id:
-        mock_sender = mock_find_user_by_id.return_value
-        mock_sender.is_admin = False
-        mock_sender.is_blocked = True
-        
-        with pytest.raises(HTTPException) as exc_info:
-            transfer_money(1, 2, 100.0, "General")
-        
-        assert exc_info.value.status_code == status.HTTP_403_FORBIDDEN
+def test_transfer_money_sender_blocked(local_query):
+    with pytest.raises(HTTPException) as exc_info:
+        transfer_money(4, 2, 100.0, "General")
+
+    assert exc_info.value.status_code == status.HTTP_403_FORBIDDEN
 
 # Sender not found
-def test_transfer_money_sender_not_found():
-    with patch('services.transactions_services.find_user_by_id') as mock_find_user_by_id:
-        mock_find_user_by_id.return_value = None
-        
-        with pytest.raises(HTTPException) as exc_info:
-            transfer_money(1, 2, 100.0, "General")
-        
-        assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+def test_transfer_money_sender_not_found(local_query):
+    with pytest.raises(HTTPException) as exc_info:
+        transfer_money(99, 2, 100.0, "General")
+
+    assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
 
 # Receiver not found
-def test_transfer_money_receiver_not_found():
-    with patch('services.transactions_services.find_user_by_id') as mock_find_user_by_id:
-        mock_find_user_by_id.side_effect = [MockUser(), None]
-        
-        with pytest.raises(HTTPException) as exc_info:
-            transfer_money(1, 2, 100.0, "General")
-        
-        assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+def test_transfer_money_receiver_not_found(local_query):
+    with pytest.raises(HTTPException) as exc_info:
+        transfer_money(1, 99, 100.0, "General")
+
+    assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+    assert balance_of(local_query, 1) == 150.0
 
 # Insufficient balance
-def test_transfer_money_insufficient_balance():
-    with patch('services.transactions_services.find_user_by_id') as mock_find_user_by_id:
-        mock_sender = mock_find_user_by_id.return_value
-        mock_sender.is_admin = False
-        mock_sender.is_blocked = False
-        mock_sender.amount = 50.0
-        
-        with pytest.raises(HTTPException) as exc_info:
-            transfer_money(1, 2, 100.0, "General")
-        
-        assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+def test_transfer_money_insufficient_balance(local_query):
+    with pytest.raises(HTTPException) as exc_info:
+        transfer_money(1, 2, 200.0, "General")
+
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    assert balance_of(local_query, 1) == 150.0
 
 # Contact already exists
-def test_transfer_money_contact_already_exists():
-    with patch('services.transactions_services.find_user_by_id') as mock_find_user_by_id, \
-         patch('services.transactions_services.query') as mock_query:
-        
-        # Create separate mock objects for sender and receiver
-        mock_sender = MagicMock()
-        mock_sender.is_admin = False
-        mock_sender.is_blocked = False
-        mock_sender.amount = 150.0
-        
-        mock_receiver = MagicMock()
-        mock_receiver.is_admin = False
-        mock_receiver.is_blocked = False
-        mock_receiver.amount = 50.0
-        
-        # Define the side effect function to return the correct mock object
-        def find_user_by_id_side_effect(user_id):
-            if user_id == 1:
-                return mock_sender
-            elif user_id == 2:
-                return mock_receiver
-            return None
-        
-        mock_find_user_by_id.side_effect = find_user_by_id_side_effect
-        
-        # Mock the query methods
-        mock_query.table().select().eq().execute.return_value.data = [{'current_user': 1, 'contact_name_id': 2}]
-        mock_query.table().update().execute.return_value = None
-        mock_query.table().insert().execute.return_value = 'inserted_transaction_id'
-        
-        result = transfer_money(1, 2, 100.0, "General")
-        
-        assert result == ('Successful', 'inserted_transaction_id')
+def test_transfer_money_contact_already_exists(local_query):
+    local_query.table('contacts').insert({'current_user': 1, 'contact_name_id': 2}).execute()
+
+    result = transfer_money(1, 2, 100.0, "General")
+    writer = contact_writer()
+
+    assert result[0] == 'Successful'
+    assert (writer.pending(), writer.flush()) == (1, 1)
+    assert len(local_query.table('contacts').select('*').eq('current_user', 1).execute().data) == 1
 
 # New contact
-def test_transfer_money_new_contact():
-    with patch('services.transactions_services.find_user_by_id') as mock_find_user_by_id, \
-         patch('services.transactions_services.query') as mock_query:
-        
-        # Create separate mock objects for sender and receiver
-        mock_sender = MagicMock()
-        mock_sender.is_admin = False
-        mock_sender.is_blocked = False
-        mock_sender.amount = 150.0
-        
-        mock_receiver = MagicMock()
-        mock_receiver.is_admin = False
-        mock_receiver.is_blocked = False
-        mock_receiver.amount = 50.0
-        
-        # Define the side effect function to return the correct mock object
-        def find_user_by_id_side_effect(user_id):
-            if user_id == 1:
-                return mock_sender
-            elif user_id == 2:
-                return mock_receiver
-            return None
-        
-        mock_find_user_by_id.side_effect = find_user_by_id_side_effect
-        
-        # Mock the query methods
-        mock_query.table().select().eq().execute.return_value.data = []
-        mock_query.table().update().execute.return_value = None
-        mock_query.table().insert().execute.return_value = 'inserted_transaction_id'
-        
-        result = transfer_money(1, 2, 100.0, "General")
-        
-        assert result == ('Successful', 'inserted_transaction_id')
-        
-        
+def test_transfer_money_new_contact(local_query):
+    result = transfer_money(1, 2, 100.0, "General")
+
+    assert result[0] == 'Successful'
+    # written after the transfer
+    assert local_query.table('contacts').select('*').execute().data == []
+    contact_writer().flush()
+    contacts = local_query.table('contacts').select('*').eq('current_user', 1).execute().data
+    assert [c['contact_name_id'] for c in contacts] == [2]
+
+
+def test_repeated_transfers_write_the_contact_once(local_query):
+    for _ in range(3):
+        transfer_money(1, 2, 10.0, "General")
+    writer = contact_writer()
+
+    assert (writer.flush(), writer.coalesced) == (1, 2)
+    transfer_money(1, 2, 10.0, "General")
+    assert writer.flush() == 0
+    assert len(local_query.table('contacts').select('*').execute().data) == 1
+
+
+def contact_writer() -> ContactWriter:
+    from services import transactions_services
+    return transactions_services.contact_writer
+
+
+def test_transfer_money_concurrent_requests_do_not_lose_updates(local_query):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: _try_transfer(1, 2, 10.0), range(20)))
+
+    assert results.count('Successful') == 15
+    assert balance_of(local_query, 1) == 0.0
+
+
+def _try_transfer(sender_id, receiver_id, amount):
+    try:
+        return transfer_money(sender_id, receiver_id, amount, "General")[0]
+    except HTTPException:
+        return 'Failed'
+
+
 #deposit money
-def test_deposit_money_admin_user():
-    with patch('services.transactions_services.is_admin') as mock_is_admin:
-        mock_is_admin.return_value = True
-        
-        with pytest.raises(Exception) as exc_info:
-            deposit_money(100.0, 1)
-        
-        assert exc_info.value == ADMIN_ERROR
-        
-def test_deposit_money_non_positive_amount():
-    with patch('services.transactions_services.is_admin') as mock_is_admin, \
-         patch('services.transactions_services.get_account_balance') as mock_get_account_balance:
-        mock_is_admin.return_value = False
-        mock_get_account_balance.return_value = MagicMock(balance=100.0)
-        
-        with pytest.raises(HTTPException) as exc_info:
-            deposit_money(0, 1)
-        
-        assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
-        assert exc_info.value.detail == 'The deposit sum has to be a positive number!'
+def test_deposit_money_admin_user(local_query):
+    with pytest.raises(Exception) as exc_info:
+        deposit_money(100.0, 3)
 
+    assert exc_info.value == ADMIN_ERROR
 
-def test_deposit_money_successful():
-    with patch('services.transactions_services.is_admin') as mock_is_admin, \
-         patch('services.transactions_services.get_account_balance') as mock_get_account_balance, \
-         patch('services.transactions_services.query') as mock_query:
-        
-        mock_is_admin.return_value = False
-        mock_get_account_balance.return_value = MagicMock(balance=100.0)
-        
-        mock_query.table().update().eq().execute.return_value.data = [{"amount": 200.0}]
-        mock_query.table().insert().execute.return_value = None
-        
-        result = deposit_money(100.0, 1)
-        
-        assert result == AmountOut(message="Balance updated!", old_balance=100.0, new_balance=200.0)
+def test_deposit_money_non_positive_amount(local_query):
+    with pytest.raises(HTTPException) as exc_info:
+        deposit_money(0, 1)
+
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    assert exc_info.value.detail == 'The deposit sum has to be a positive number!'
+
+
+def test_deposit_money_successful(local_query):
+    result = deposit_money(100.0, 1)
+
+    assert result == AmountOut(message="Balance updated!", old_balance=150.0, new_balance=250.0)
+    atm = local_query.table('transactions').select('*').eq('category', 'atm').execute().data
+    assert len(atm) == 1 and atm[0]['sender_id'] == atm[0]['receiver_id'] == 1
 
 
 #withdraw money
 
-def test_withdraw_money_admin_user():
-    with patch('services.transactions_services.is_admin') as mock_is_admin:
-        mock_is_admin.return_value = True
-        
-        with pytest.raises(Exception) as exc_info:
-            withdraw_money(100.0, 1)
-        
-        assert exc_info.value == ADMIN_ERROR
+def test_withdraw_money_admin_user(local_query):
+    with pytest.raises(Exception) as exc_info:
+        withdraw_money(100.0, 3)
 
-def test_withdraw_money_non_positive_amount():
-    with patch('services.transactions_services.is_admin') as mock_is_admin, \
-         patch('services.transactions_services.get_account_balance') as mock_get_account_balance:
-        mock_is_admin.return_value = False
-        mock_get_account_balance.return_value = MagicMock(balance=100.0)
-        
-        with pytest.raises(HTTPException) as exc_info:
-            withdraw_money(0, 1)
-        
-        assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
-        assert exc_info.value.detail == 'The sum has to be a positive number'
+    assert exc_info.value == ADMIN_ERROR
 
-def test_withdraw_money_insufficient_balance():
-    with patch('services.transactions_services.is_admin') as mock_is_admin, \
-         patch('services.transactions_services.get_account_balance') as mock_get_account_balance:
-        mock_is_admin.return_value = False
-        mock_get_account_balance.return_value = MagicMock(balance=50.0)
-        
-        with pytest.raises(HTTPException) as exc_info:
-            withdraw_money(100.0, 1)
-        
-        assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
-        assert exc_info.value.detail == 'Insufficient balance'
+def test_withdraw_money_non_positive_amount(local_query):
+    with pytest.raises(HTTPException) as exc_info:
+        withdraw_money(0, 1)
 
-def test_withdraw_money_successful():
-    with patch('services.transactions_services.is_admin') as mock_is_admin, \
-         patch('services.transactions_services.get_account_balance') as mock_get_account_balance, \
-         patch('services.transactions_services.query') as mock_query:
-        
-        mock_is_admin.return_value = False
-        mock_get_account_balance.return_value = MagicMock(balance=150.0)
-        
-        mock_query.table().update().eq().execute.return_value.data = [{"amount": 50.0}]
-        mock_query.table().insert().execute.return_value = None
-        
-        result = withdraw_money(100.0, 1)
-        
-        assert result == AmountOut(message="Balance updated!", old_balance=150.0, new_balance=50.0)
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    assert exc_info.value.detail == 'The sum has to be a positive number'
+
+def test_withdraw_money_insufficient_balance(local_query):
+    with pytest.raises(HTTPException) as exc_info:
+        withdraw_money(200.0, 1)
+
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    assert exc_info.value.detail == 'Insufficient balance'
+
+def test_withdraw_money_successful(local_query):
+    result = withdraw_money(100.0, 1)
+
+    assert result == AmountOut(message="Balance updated!", old_balance=150.0, new_balance=50.0)
 
 #confirm transactions
 
-def test_confirm_transaction_admin_user():
-    with patch('services.transactions_services.is_admin') as mock_is_admin:
-        mock_is_admin.return_value = True
-        
-        with pytest.raises(Exception) as exc_info:
-            confirm_transaction("confirm", 1, 1)
-        
-        assert exc_info.value == ADMIN_ERROR
+def test_confirm_transaction_admin_user(local_query):
+    with pytest.raises(Exception) as exc_info:
+        confirm_transaction("confirm", 1, 3)
 
+    assert exc_info.value == ADMIN_ERROR
 
-def test_confirm_transaction_confirm():
-    with patch('services.transactions_services.is_admin') as mock_is_admin, \
-         patch('services.transactions_services.query') as mock_query, \
-         patch('services.transactions_services.get_account_balance') as mock_get_account_balance:
-        
-        mock_is_admin.return_value = False
-        mock_query.table().select().execute.return_value.data = [{'status': 'pending', 'amount': 100.0, 'sender_id': 1}]
-        mock_get_account_balance.return_value = MagicMock(balance=200.0)
-        
-        mock_query.table().update().eq().execute.return_value = None
-        
-        result = confirm_transaction("confirm", 1, 1)
-        
-        assert result == 'Transaction with id: 1 was CONFIRMED!'
+
+def test_confirm_transaction_confirm(local_query):
+    transaction_id = transfer_money(1, 2, 100.0, "General")[1]['id']
+
+    result = confirm_transaction("confirm", transaction_id, 1)
+
+    assert result == f'Transaction with id: {transaction_id} was CONFIRMED!'
+
+
+def test_confirm_transaction_deny_refunds_sender(local_query):
+    transaction_id = transfer_money(1, 2, 100.0, "General")[1]['id']
+
+    result = confirm_transaction("deny", transaction_id, 1)
+
+    assert result == f'Transaction with id: {transaction_id} was DECLINED!'
+    assert balance_of(local_query, 1) == 150.0
+
+
+#accept
+def test_accept_transaction_credits_receiver(local_query):
+    transaction_id = transfer_money(1, 2, 100.0, "General")[1]['id']
+    confirm_transaction("confirm", transaction_id, 1)
+
+    result = accept_transaction(transaction_id, 'accept', 2)
+
+    assert result == f'Transaction with id: {transaction_id} successfully accepted!'
+    assert balance_of(local_query, 2) == 150.0
+
+
+def test_accept_transaction_not_confirmed(local_query):
+    transaction_id = transfer_money(1, 2, 100.0, "General")[1]['id']
+
+    with pytest.raises(HTTPException) as exc_info:
+        accept_transaction(transaction_id, 'accept', 2)
+
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    assert balance_of(local_query, 2) == 50.0
 
 #deny
 def test_deny_transaction_not_admin():
@@ -416,3 +528,32 @@ def test_edit_category_success():
 
         assert result == 'Category was edited successfully!'
         mock_query.table().update().eq().execute.assert_called_once()
+
+
+# category totals tests
+def test_category_totals_follow_every_write(local_query):
+    transfer_money(1, 2, 20.0, 'food')
+    transfer_money(1, 2, 50.0, 'food')
+    deposit_money(100.0, 1)
+    with patch('services.transactions_services.get_transaction',
+               return_value=MagicMock(sender_id=1)):
+        edit_category(2, 'rent', 1)
+
+    totals = get_category_totals(1)
+
+    assert totals == [CategoryTotal(category='atm', total=100.0, count=1, min_amount=100.0, max_amount=100.0),
+                      CategoryTotal(category='rent', total=50.0, count=1, min_amount=50.0, max_amount=50.0),
+                      CategoryTotal(category='food', total=20.0, count=1, min_amount=20.0, max_amount=20.0)]
+
+
+def test_category_totals_add_up_days_in_range(local_query):
+    local_query.table('transactions').insert([
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 10.0, 'category': 'food', 'created_at': '2024-06-01T10:00:00'},
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 30.0, 'category': 'food', 'created_at': '2024-06-02T10:00:00'},
+        {'sender_id': 1, 'receiver_id': 2, 'amount': 5.0, 'category': 'food', 'created_at': '2024-06-03T10:00:00'},
+        {'sender_id': 2, 'receiver_id': 1, 'amount': 99.0, 'category': 'food', 'created_at': '2024-06-02T10:00:00'},
+    ]).execute()
+
+    totals = get_category_totals(1, date(2024, 6, 1), date(2024, 6, 2), 'food')
+
+    assert totals == [CategoryTotal(category='food', total=40.0, count=2, min_amount=10.0, max_amount=30.0)]
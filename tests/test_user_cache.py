@@ -0,0 +1,94 @@
+from data.schemas import GetUser
+from data.user_cache import UserCache
+
+
+def make_user(user_id: int, username: str = None) -> GetUser:
+    username = username or f'user{user_id}'
+    return GetUser(id=user_id, username=username, password='x', email=f'{username}@test.com',
+                   phone_number=f'{user_id:010d}', is_admin=False, amount=10.0, is_registered=True,
+                   is_blocked=False)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_by_every_key():
+    cache = UserCache()
+    cache.put(make_user(1))
+
+    assert cache.get(1).id == 1
+    assert cache.get('user1@test.com', 'email').id == 1
+    assert cache.get('0000000001', 'phone_number').id == 1
+    assert cache.get('user1', 'username').id == 1
+    assert cache.hits == 4
+
+
+def test_miss_is_counted():
+    cache = UserCache()
+
+    assert cache.get(1) is None
+    assert cache.get('nobody', 'username') is None
+    assert cache.misses == 2
+
+
+def test_entry_expires_after_ttl():
+    clock = FakeClock()
+    cache = UserCache(ttl=30, clock=clock)
+    cache.put(make_user(1))
+
+    clock.now = 29
+    assert cache.get(1) is not None
+
+    clock.now = 30
+    assert cache.get(1) is None
+    assert cache.get('user1', 'username') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_least_recently_used_user_is_evicted():
+    cache = UserCache(max_size=2)
+    cache.put(make_user(1))
+    cache.put(make_user(2))
+    cache.get(1)
+
+    cache.put(make_user(3))
+
+    assert cache.get(2) is None
+    assert cache.get('user2', 'username') is None
+    assert cache.get(1) is not None
+    assert cache.evictions == 1
+
+
+def test_invalidate_removes_every_key():
+    cache = UserCache()
+    cache.put(make_user(1))
+
+    cache.invalidate(1)
+
+    assert cache.get(1) is None
+    assert cache.get('user1@test.com', 'email') is None
+
+
+def test_changed_username_is_not_found_by_old_username():
+    cache = UserCache()
+    cache.put(make_user(1, 'old'))
+
+    cache.put(make_user(1, 'new'))
+
+    assert cache.get('old', 'username') is None
+    assert cache.get('new', 'username').id == 1
+
+
+def test_stats():
+    cache = UserCache(max_size=5)
+    cache.put(make_user(1))
+    cache.get(1)
+    cache.get(2)
+
+    assert cache.stats() == {'size': 1, 'max_size': 5, 'ttl_seconds': 30, 'hits': 1, 'misses': 1, 'evictions': 0,
+                             'hit_ratio': 0.5}
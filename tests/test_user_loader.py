@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from data.async_connection import ThreadedAsyncQuery
+from data.local_client import LocalClient
+from data.helpers import find_user_by_id, find_user_by_email, is_admin, get_account_balance, find_user_by_id_async, \
+    is_admin_async
+from data.user_loader import UserLoader, user_loader_scope
+from data.user_cache import UserCache
+
+
+@pytest.fixture
+def local_query():
+    client = LocalClient()
+    client.table('users').insert([
+        {'username': 'user', 'password': 'x', 'email': 'user@test.com', 'phone_number': '1111111111',
+         'amount': 100.0},
+        {'username': 'admin', 'password': 'x', 'email': 'admin@test.com', 'phone_number': '2222222222',
+         'is_admin': True},
+    ]).execute()
+    client.round_trips = 0
+    with patch('data.user_loader.query', client), patch('data.user_loader.user_cache', UserCache()):
+        yield client
+
+
+def test_primed_lookups_are_resolved_by_one_query(local_query):
+    loader = UserLoader()
+    loader.prime(1, 2)
+
+    user = loader.load(1)
+    admin = loader.load(2)
+
+    assert user.username == 'user'
+    assert admin.is_admin is True
+    assert local_query.round_trips == 1
+
+
+def test_load_many_is_one_query(local_query):
+    users = UserLoader().load_many([1, 2, 99])
+
+    assert [u.id if u else None for u in users] == [1, 2, None]
+    assert local_query.round_trips == 1
+
+
+def test_missing_user_is_memoized(local_query):
+    loader = UserLoader()
+
+    assert loader.load(99) is None
+    assert loader.load(99) is None
+    assert local_query.round_trips == 1
+
+
+def test_user_loaded_by_email_is_memoized_by_id(local_query):
+    loader = UserLoader()
+
+    loader.load('user@test.com', key='email')
+    user = loader.load(1)
+
+    assert user.email == 'user@test.com'
+    assert local_query.round_trips == 1
+
+
+def test_forget_reloads_user(local_query):
+    loader = UserLoader()
+    loader.load(1)
+    local_query.table('users').update({'amount': 50.0}).eq('id', 1).execute()
+
+    loader.forget(1)
+
+    assert loader.load(1).amount == 50.0
+
+
+def test_helpers_share_the_request_loader(local_query):
+    with user_loader_scope():
+        assert is_admin(1) is False
+        assert get_account_balance(1).balance == 100.0
+        assert find_user_by_id(1).username == 'user'
+        assert find_user_by_email('user@test.com').id == 1
+
+    assert local_query.round_trips == 1
+
+
+def test_process_cache_serves_lookups_outside_a_request(local_query):
+    find_user_by_id(1)
+    find_user_by_email('user@test.com')
+
+    assert local_query.round_trips == 1
+
+
+def test_forget_invalidates_process_cache(local_query):
+    find_user_by_id(1)
+    local_query.table('users').update({'amount': 50.0}).eq('id', 1).execute()
+
+    UserLoader().forget(1)
+
+    assert find_user_by_id(1).amount == 50.0
+
+
+def test_async_loads_share_memo_with_sync_loads(local_query):
+    async def load():
+        with patch('data.user_loader.get_async_query', lambda: ThreadedAsyncQuery(local_query)), \
+                user_loader_scope() as user_loader:
+            user_loader.prime(2)
+            user = await find_user_by_id_async(1)
+            admin = await is_admin_async(2)
+            return user, admin, find_user_by_id(1)
+
+    user, admin, same_user = asyncio.run(load())
+
+    assert user.username == 'user'
+    assert admin is True
+    assert same_user is user
+    assert local_query.round_trips == 1
@@ -1,3 +1,4 @@
+import hashlib
 import unittest
 from unittest.mock import patch, Mock, MagicMock
 from fastapi.testclient import TestClient
@@ -8,6 +9,7 @@ import routers.users
 import services.user_services
 from main import app
 from data.schemas import UserOut, GetUser, AccountBalanceOut
+from security.password_hashing import get_password_hash, verify_password
 
 ID = 1
 USERNAME = 'test'
@@ -99,14 +101,14 @@ class TestUserServices(unittest.TestCase):
         self.assertEqual(res, expected)
 
     @patch('services.user_services.find_user_by_email')
-    @patch('services.user_services.get_password_hash')
-    def test_try_login(self, mock_pass_hash, mock_find_user_by_email):
-        mock_find_user_by_email.return_value = GetUser(id=ID, username=USERNAME, password=PASSWORD,
+    @patch('services.user_services.query.table')
+    def test_try_login(self, mock_query_table, mock_find_user_by_email):
+        mock_find_user_by_email.return_value = GetUser(id=ID, username=USERNAME,
+                                                       password=get_password_hash(PASSWORD),
                                                        email=EMAIL, phone_number=PHONE_NUM, is_admin=IS_ADMIN,
                                                        created_at=CREATED_AT, amount=AMOUNT,
                                                        is_registered=IS_REGISTERED,
                                                        is_blocked=IS_BLOCKED)
-        mock_pass_hash.return_value = PASSWORD
 
         expected = UserOut(id=ID, username=USERNAME, email=EMAIL, phone_number=PHONE_NUM,
                            created_at=CREATED_AT)
@@ -115,6 +117,37 @@ class TestUserServices(unittest.TestCase):
 
         self.assertEqual(res, expected)
         self.assertIsInstance(res, UserOut)
+        mock_query_table.assert_not_called()
+
+    @patch('services.user_services.find_user_by_email')
+    @patch('services.user_services.query.table')
+    def test_try_login_rehashes_legacy_password(self, mock_query_table, mock_find_user_by_email):
+        mock_find_user_by_email.return_value = GetUser(id=ID, username=USERNAME,
+                                                       password=hashlib.sha256(PASSWORD.encode()).hexdigest(),
+                                                       email=EMAIL, phone_number=PHONE_NUM, is_admin=IS_ADMIN,
+                                                       created_at=CREATED_AT, amount=AMOUNT,
+                                                       is_registered=IS_REGISTERED,
+                                                       is_blocked=IS_BLOCKED)
+
+        services.user_services.try_login(EMAIL, PASSWORD)
+
+        new_hash = mock_query_table.return_value.update.call_args.args[0]['password']
+        self.assertTrue(new_hash.startswith('$scrypt$'))
+        self.assertTrue(verify_password(PASSWORD, new_hash))
+
+    @patch('services.user_services.find_user_by_email')
+    def test_try_login_with_wrong_password(self, mock_find_user_by_email):
+        mock_find_user_by_email.return_value = GetUser(id=ID, username=USERNAME,
+                                                       password=hashlib.sha256(PASSWORD.encode()).hexdigest(),
+                                                       email=EMAIL, phone_number=PHONE_NUM, is_admin=IS_ADMIN,
+                                                       created_at=CREATED_AT, amount=AMOUNT,
+                                                       is_registered=IS_REGISTERED,
+                                                       is_blocked=IS_BLOCKED)
+
+        with self.assertRaises(HTTPException) as error:
+            services.user_services.try_login(EMAIL, 'wrong')
+
+        self.assertEqual(error.exception.status_code, 401)
 
     @patch('services.user_services.find_user_by_id')
     @patch('services.user_services.is_valid_password')